@@ -0,0 +1,22 @@
+"""
+Appointment types, cached in each process.
+
+The types change rarely but are listed on every booking form, so they are
+kept in a local cache that dashboard.signals evicts whenever a type is saved
+or deleted (see dashboard.invalidation).
+"""
+
+from dashboard.invalidation import LocalCache
+
+from .models import AppointmentType
+
+appointment_types = LocalCache('appointment_types')
+
+def active_appointment_types():
+    return appointment_types.get_or_set(
+        'active', lambda: list(AppointmentType.objects.filter(is_active=True).order_by('name'))
+    )
+
+def appointment_type_names():
+    """{pk: name} for every type, including inactive ones."""
+    return appointment_types.get_or_set('names', lambda: dict(AppointmentType.objects.values_list('pk', 'name')))
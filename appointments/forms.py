@@ -97,12 +97,15 @@ class PrescriptionForm(forms.ModelForm):
             'notes': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
         }
 
+# Lets a visit's whole medication plan be submitted in one request
+PrescriptionFormSet = forms.formset_factory(PrescriptionForm, extra=1)
+
 class LabOrderForm(forms.ModelForm):
     """Form for creating lab orders."""
     
     class Meta:
         model = LabOrder
-        exclude = ['appointment', 'ordered_by', 'ordered_date', 'results_date']
+        exclude = ['appointment', 'ordered_by', 'ordered_date', 'results_date', 'results_reviewed_at', 'results_reviewed_by']
         widgets = {
             'lab_name': forms.TextInput(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
@@ -0,0 +1,161 @@
+"""
+Prebuilt iCalendar (RFC 5545) feeds of each provider's appointments.
+
+A feed is cached as rendered bytes together with the provider's latest
+change log sequence and number of change rows it reflects. When they move on,
+only the appointments named in the newer change log rows are re-rendered;
+everything else is reused from the cached copy. Patient names are reduced to
+initials because feeds are read by third-party calendar apps.
+
+Sequences are taken at insert rather than commit, so a change can become
+visible below a sequence a feed was already built at. The row count catches
+that: when it grew by more than the rows above the cached sequence, the feed
+is rebuilt in full.
+
+Only rows above ``CalendarFeed.checkpoint`` are counted, so the count stays
+small however long the change log gets. Each full rebuild moves the
+checkpoint up to a sequence every change below which has long committed (see
+AppointmentChange), and a rebuild is forced once ``CHECKPOINT_ROWS`` rows
+pile up above it. Rows at or below every feed's checkpoint can be purged.
+"""
+
+from datetime import timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Appointment, AppointmentChange, CalendarFeed
+
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Change rows counted above a feed's checkpoint before it is moved up
+CHECKPOINT_ROWS = 1000
+
+CALENDAR_HEADER = (
+    'BEGIN:VCALENDAR\r\n'
+    'VERSION:2.0\r\n'
+    'PRODID:-//DocsDash//Provider Schedule//EN\r\n'
+    'CALSCALE:GREGORIAN\r\n'
+    'X-WR-CALNAME:DocsDash Schedule\r\n'
+).encode()
+CALENDAR_FOOTER = b'END:VCALENDAR\r\n'
+
+EVENT_STATUSES = {
+    'scheduled': 'TENTATIVE',
+    'confirmed': 'CONFIRMED',
+}
+
+def escape_text(value):
+    return (
+        value.replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\r\n', '\\n')
+        .replace('\n', '\\n')
+    )
+
+def fold_line(line):
+    """Fold a content line into CRLF-terminated chunks of at most 75 octets."""
+    encoded = line.encode()
+    chunks = []
+    limit = 75
+    while len(encoded) > limit:
+        # Never split a multi-byte UTF-8 sequence
+        cut = limit
+        while encoded[cut] & 0xC0 == 0x80:
+            cut -= 1
+        chunks.append(encoded[:cut])
+        encoded = b' ' + encoded[cut:]
+    chunks.append(encoded)
+    return b'\r\n'.join(chunks) + b'\r\n'
+
+def format_datetime(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def render_event(appointment):
+    patient = appointment.patient
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:appointment-{appointment.pk}@docsdash',
+        f'DTSTAMP:{format_datetime(appointment.updated_at)}',
+        f'DTSTART:{format_datetime(appointment.start_time)}',
+        f'DTEND:{format_datetime(appointment.end_time)}',
+        'SUMMARY:' + escape_text(
+            f"{appointment.appointment_type.name} - {patient.first_name[:1]}.{patient.last_name[:1]}."
+        ),
+        f'STATUS:{EVENT_STATUSES.get(appointment.status, "CONFIRMED")}',
+        f'URL:/appointments/{appointment.pk}/',
+        'END:VEVENT',
+    ]
+    return b''.join(fold_line(line) for line in lines)
+
+def feed_cache_key(provider_id):
+    return f'ical-feed:{provider_id}'
+
+def build_feed(provider_id, version, change_count, checkpoint):
+    """Return the cached feed for ``provider_id`` brought up to ``version``.
+    
+    ``version`` is the provider's latest change sequence and ``change_count``
+    their number of change rows above ``checkpoint``. The result is a dict
+    with the rendered ``body`` and the version, checkpoint and count it
+    reflects. Only appointments changed since the cached version are fetched,
+    unless a change committed late or the checkpoint is due to move.
+    """
+    key = feed_cache_key(provider_id)
+    feed = cache.get(key)
+    state = (version, checkpoint, change_count)
+    # Feeds cached before checkpoints were added have none, and are rebuilt
+    if feed is not None and (feed['version'], feed.get('checkpoint'), feed['change_count']) == state:
+        return feed
+    
+    appointments = (
+        Appointment.objects.filter(provider_id=provider_id)
+        .exclude(status='cancelled')
+        .select_related('patient', 'appointment_type')
+    )
+    
+    changes = None
+    if (
+        feed is not None and feed.get('checkpoint') == checkpoint and feed['version'] <= version
+        and change_count <= CHECKPOINT_ROWS
+    ):
+        changes = list(
+            AppointmentChange.objects.filter(
+                provider_id=provider_id, pk__gt=feed['version'], pk__lte=version
+            ).values_list('appointment_id', flat=True)
+        )
+        if feed['change_count'] + len(changes) != change_count:
+            # Rows committed below the cached sequence
+            changes = None
+    
+    if changes is None:
+        settled_before = timezone.now() - timedelta(seconds=AppointmentChange.RESCAN_SECONDS)
+        settled = min(AppointmentChange.latest_sequence_before(settled_before), version)
+        if settled > checkpoint:
+            CalendarFeed.objects.filter(provider_id=provider_id).update(checkpoint=settled)
+            # Counted before rendering, so a row committing in between is caught next time
+            change_count = AppointmentChange.objects.filter(
+                provider_id=provider_id, pk__gt=settled, pk__lte=version
+            ).count()
+            checkpoint = settled
+        events = {appointment.pk: render_event(appointment) for appointment in appointments}
+    else:
+        events = dict(feed['events'])
+        changed_ids = set(changes)
+        current = {appointment.pk: appointment for appointment in appointments.filter(pk__in=changed_ids)}
+        for appointment_id in changed_ids:
+            if appointment_id in current:
+                events[appointment_id] = render_event(current[appointment_id])
+            else:
+                # Cancelled, deleted or moved to another provider
+                events.pop(appointment_id, None)
+    
+    feed = {
+        'version': version,
+        'checkpoint': checkpoint,
+        'change_count': change_count,
+        'events': events,
+        'body': CALENDAR_HEADER + b''.join(events.values()) + CALENDAR_FOOTER,
+    }
+    cache.set(key, feed, FEED_CACHE_TIMEOUT)
+    return feed
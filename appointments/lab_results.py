@@ -0,0 +1,234 @@
+"""
+Streaming ingestion of reference lab result files.
+
+Two flat file layouts are understood:
+
+* Delimited text (comma, tab, pipe or semicolon separated) with a header row.
+  ``order_id`` is required; results come either from a ``result`` column or
+  from ``test``/``value``/``units``/``reference_range``/``flag`` columns, one
+  row per analyte. Optional ``status`` and ``result_date`` columns are honoured.
+* HL7 v2 style messages: each ``OBR`` segment opens an order (OBR-2 is our
+  lab order number) and the following ``OBX`` segments carry its results.
+
+Files are read line by line and grouped into per-order records, which are
+matched to lab orders by primary key and written in batches, each batch in one
+transaction with its history rows bulk-created alongside.
+"""
+
+import csv
+import time
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+from simple_history.utils import bulk_update_with_history
+
+from .models import LabOrder
+
+BATCH_SIZE = 500
+
+UPDATE_FIELDS = ['status', 'results', 'results_date', 'results_reviewed_at', 'results_reviewed_by']
+
+# HL7 OBR-25 result status codes
+HL7_RESULT_STATUSES = {
+    'F': 'completed',
+    'C': 'completed',
+    'P': 'in_process',
+    'I': 'in_process',
+    'X': 'cancelled',
+}
+
+class LabResultRecord:
+    """Results for one lab order collected from consecutive file lines."""
+
+    def __init__(self, line_number, order_ref):
+        self.line_number = line_number
+        self.order_ref = order_ref.strip()
+        self.lines = []
+        self.status = 'completed'
+        self.results_date = None
+
+    @property
+    def order_id(self):
+        return int(self.order_ref) if self.order_ref.isdigit() else None
+
+    @property
+    def results(self):
+        return '\n'.join(self.lines)
+
+class IngestReport:
+    """Counts and unmatched rows from one or more ingested files."""
+
+    def __init__(self):
+        self.records = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.unmatched = []
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.records / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"{self.records} records in {self.elapsed:.2f}s ({self.rate:.0f}/s): "
+            f"{self.updated} updated, {self.unchanged} unchanged, {len(self.unmatched)} unmatched"
+        )
+
+def format_result_line(test, value, units='', reference_range='', flag=''):
+    line = f"{test}: {value}" if test else value
+    if units:
+        line += f" {units}"
+    if reference_range:
+        line += f" (ref {reference_range})"
+    if flag:
+        line += f" [{flag}]"
+    return line
+
+def parse_date(value):
+    value = (value or '').strip()
+    for fmt, length in (('%Y-%m-%d', 10), ('%Y%m%d', 8)):
+        try:
+            return datetime.strptime(value[:length], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def parse_delimited(lines):
+    """Yield LabResultRecords from delimited text with a header row."""
+    lines = iter(lines)
+    header = next(lines, '')
+    try:
+        dialect = csv.Sniffer().sniff(header, delimiters=',\t|;')
+    except csv.Error:
+        dialect = csv.excel
+    columns = [column.strip().lower() for column in next(csv.reader([header], dialect))]
+    reader = csv.DictReader(lines, fieldnames=columns, dialect=dialect)
+
+    record = None
+    for row in reader:
+        # The header was consumed before the reader started counting
+        line_number = reader.line_num + 1
+        order_ref = (row.get('order_id') or '').strip()
+        if record is None or order_ref != record.order_ref:
+            if record is not None:
+                yield record
+            record = LabResultRecord(line_number, order_ref)
+        if row.get('result'):
+            record.lines.append(row['result'].strip())
+        elif row.get('value'):
+            record.lines.append(format_result_line(
+                (row.get('test') or '').strip(),
+                row['value'].strip(),
+                (row.get('units') or '').strip(),
+                (row.get('reference_range') or '').strip(),
+                (row.get('flag') or '').strip(),
+            ))
+        if row.get('status'):
+            record.status = row['status'].strip().lower()
+        if row.get('result_date'):
+            record.results_date = parse_date(row['result_date'])
+    if record is not None:
+        yield record
+
+def parse_hl7(lines):
+    """Yield LabResultRecords from HL7 v2 style OBR/OBX segments."""
+    record = None
+    for line_number, line in enumerate(lines, start=1):
+        fields = line.rstrip('\r\n').split('|')
+        segment = fields[0]
+        if segment == 'OBR':
+            if record is not None:
+                yield record
+            placer_order = fields[2].split('^')[0] if len(fields) > 2 else ''
+            record = LabResultRecord(line_number, placer_order)
+            if len(fields) > 7:
+                record.results_date = parse_date(fields[7])
+            if len(fields) > 25:
+                record.status = HL7_RESULT_STATUSES.get(fields[25].strip(), 'completed')
+        elif segment == 'OBX' and record is not None:
+            padded = fields + [''] * (9 - len(fields))
+            identifier = padded[3].split('^')
+            test = identifier[1] if len(identifier) > 1 and identifier[1] else identifier[0]
+            record.lines.append(format_result_line(test, padded[5], padded[6], padded[7], padded[8]))
+    if record is not None:
+        yield record
+
+def parse_file(lines):
+    """Detect the file layout from its first line and yield records."""
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return iter(())
+    rest = _prepend(first, lines)
+    return parse_hl7(rest) if first.startswith('MSH|') else parse_delimited(rest)
+
+def _prepend(first, lines):
+    yield first
+    yield from lines
+
+def apply_batch(records, report, change_reason):
+    """Match ``records`` to lab orders and write the changes in one transaction.
+
+    Returns the primary keys of the lab orders that were updated.
+    """
+    orders = LabOrder.objects.in_bulk([record.order_id for record in records if record.order_id])
+    valid_statuses = {choice[0] for choice in LabOrder.STATUS_CHOICES}
+    today = timezone.localdate()
+    changed = {}
+
+    for record in records:
+        order = orders.get(record.order_id)
+        if order is None:
+            report.unmatched.append((record.line_number, record.order_ref, 'unknown order'))
+            continue
+        if record.status not in valid_statuses:
+            report.unmatched.append((record.line_number, record.order_ref, f'invalid status {record.status!r}'))
+            continue
+        results = record.results
+        if order.results != results:
+            # Amended results need a fresh review
+            order.results_reviewed_at = None
+            order.results_reviewed_by = None
+        elif order.status == record.status:
+            report.unchanged += 1
+            continue
+        order.results = results
+        order.status = record.status
+        order.results_date = record.results_date or order.results_date or today
+        changed[order.pk] = order
+
+    if changed:
+        with transaction.atomic():
+            bulk_update_with_history(
+                list(changed.values()), LabOrder, UPDATE_FIELDS,
+                batch_size=BATCH_SIZE, default_change_reason=change_reason,
+            )
+    report.updated += len(changed)
+    return list(changed)
+
+def ingest_lines(lines, report, change_reason='Lab result import', on_batch=None):
+    """Stream ``lines`` through the parser and apply records in batches.
+
+    ``on_batch`` is called with the primary keys updated by each batch, e.g. to
+    refresh derived data that normally reacts to ``post_save``.
+    """
+    batch = []
+    for record in parse_file(lines):
+        report.records += 1
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE:
+            updated = apply_batch(batch, report, change_reason)
+            if on_batch and updated:
+                on_batch(updated)
+            batch = []
+    if batch:
+        updated = apply_batch(batch, report, change_reason)
+        if on_batch and updated:
+            on_batch(updated)
+    return report
@@ -0,0 +1,35 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from appointments.models import Appointment
+from appointments.utilization import backfill
+
+class Command(BaseCommand):
+    help = "Rebuild the daily and hourly utilization rollups from appointments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help="First day (YYYY-MM-DD); defaults to the earliest appointment.")
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help="Last day (YYYY-MM-DD); defaults to the latest appointment.")
+        parser.add_argument('--chunk-days', type=int, default=31, help="Days rebuilt per transaction.")
+
+    def handle(self, *args, **options):
+        bounds = Appointment.objects.aggregate(first=Min('start_time'), last=Max('start_time'))
+        if bounds['first'] is None and not (options['date_from'] and options['date_to']):
+            self.stdout.write("No appointments to roll up.")
+            return
+
+        date_from = options['date_from'] or timezone.localdate(bounds['first'])
+        date_to = options['date_to'] or timezone.localdate(bounds['last'])
+        if date_from > date_to:
+            raise CommandError("--from must not be after --to.")
+        if options['chunk_days'] < 1:
+            raise CommandError("--chunk-days must be at least 1.")
+
+        total = 0
+        for chunk_start, chunk_end, count in backfill(date_from, date_to, options['chunk_days']):
+            total += count
+            self.stdout.write(f"  {chunk_start} to {chunk_end}: {count} appointments")
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {total} appointments from {date_from} to {date_to}"))
@@ -0,0 +1,97 @@
+import csv
+import shutil
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from appointments.lab_results import IngestReport, ingest_lines
+
+class Command(BaseCommand):
+    help = (
+        "Import reference lab result files (delimited or HL7 v2 style). "
+        "Pass files to import them once, or --watch a drop directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help="Result files to import.")
+        parser.add_argument('--watch', metavar='DIR', help="Poll DIR for new files, moving them to DIR/processed.")
+        parser.add_argument('--interval', type=float, default=30, help="Seconds between polls in --watch mode.")
+
+    def handle(self, *args, **options):
+        if not options['files'] and not options['watch']:
+            raise CommandError("Give result files to import or --watch a directory.")
+
+        for path in options['files']:
+            self.ingest(Path(path))
+
+        if options['watch']:
+            self.watch(Path(options['watch']), options['interval'])
+
+    def watch(self, directory, interval):
+        (directory / 'processed').mkdir(parents=True, exist_ok=True)
+        (directory / 'failed').mkdir(parents=True, exist_ok=True)
+        self.stdout.write(f"Watching {directory} for lab result files")
+
+        seen = {}
+        try:
+            while True:
+                seen = self.poll(directory, seen)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped watching")
+
+    def poll(self, directory, seen):
+        """Ingest the files in ``directory`` unchanged since the previous poll.
+
+        ``seen`` maps file names to the (size, mtime) they had then; the map
+        for the next poll is returned. A file still being uploaded changes
+        between polls, so it waits for a later one. Dotfiles and ``*.tmp``
+        files, the names uploads usually get until renamed into place, are
+        never picked up.
+        """
+        processed_dir = directory / 'processed'
+        failed_dir = directory / 'failed'
+        pending = {}
+        for path in sorted(directory.iterdir()):
+            if not path.is_file() or path.name.startswith('.') or path.suffix == '.tmp':
+                continue
+            stat = path.stat()
+            pending[path.name] = (stat.st_size, stat.st_mtime_ns)
+            if seen.get(path.name) != pending[path.name]:
+                continue
+            del pending[path.name]
+            try:
+                report = self.ingest(path)
+            except Exception as exc:
+                self.stderr.write(f"{path.name}: failed ({exc})")
+                shutil.move(str(path), failed_dir / path.name)
+                continue
+            shutil.move(str(path), processed_dir / path.name)
+            if report.unmatched:
+                self.write_unmatched(processed_dir / f"{path.name}.unmatched.csv", report)
+        return pending
+
+    def ingest(self, path):
+        from dashboard.alerts import RULES_BY_KIND, refresh_alerts
+
+        def refresh_lab_alerts(order_ids):
+            # bulk_update skips post_save, so keep unreviewed-result alerts in step here
+            refresh_alerts(RULES_BY_KIND['unreviewed_lab'], order_ids)
+
+        report = IngestReport()
+        with path.open(newline='', encoding='utf-8-sig') as lines:
+            ingest_lines(lines, report, change_reason=f"Lab result import: {path.name}", on_batch=refresh_lab_alerts)
+
+        self.stdout.write(f"{path.name}: {report.summary()}")
+        for line_number, order_ref, reason in report.unmatched[:20]:
+            self.stderr.write(f"  line {line_number}: order {order_ref!r} {reason}")
+        if len(report.unmatched) > 20:
+            self.stderr.write(f"  ... and {len(report.unmatched) - 20} more unmatched records")
+        return report
+
+    def write_unmatched(self, path, report):
+        with path.open('w', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(['line', 'order_id', 'reason'])
+            writer.writerows(report.unmatched)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from appointments.models import Appointment
+from appointments.status_sweep import OPEN_STATUSES, SWEEP_CHUNK_SIZE, sweep_appointments
+from authentication.models import User
+
+class Command(BaseCommand):
+    help = "Move past appointments still scheduled or confirmed to no-show and report no-show rates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', help="Status to set instead of APPOINTMENT_SWEEP_STATUS.")
+        parser.add_argument('--chunk-size', type=int, default=SWEEP_CHUNK_SIZE, help="Appointments per transaction.")
+
+    def handle(self, *args, **options):
+        status = options['status']
+        if status and status not in dict(Appointment.STATUS_CHOICES):
+            raise CommandError(f"Unknown appointment status {status!r}.")
+        if status in OPEN_STATUSES:
+            raise CommandError(f"Cannot sweep appointments to the open status {status!r}.")
+
+        swept, rates = sweep_appointments(new_status=status, chunk_size=options['chunk_size'])
+        self.stdout.write(f"Swept {sum(swept.values())} appointments")
+
+        names = dict(User.objects.filter(pk__in=rates).values_list('pk', 'email'))
+        for provider_id, (no_shows, total) in sorted(rates.items(), key=lambda item: -item[1][0] / item[1][1]):
+            self.stdout.write(
+                f"  {names.get(provider_id, provider_id)}: {swept[provider_id]} swept, "
+                f"no-show rate {no_shows}/{total} ({no_shows / total:.0%})"
+            )
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:54
+
+import appointments.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0003_appointmentchange'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(default=appointments.models.generate_feed_token, max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appointmentchange',
+            name='provider_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='appointmentchange',
+            name='kind',
+            field=models.CharField(choices=[('updated', 'Updated'), ('cancelled', 'Cancelled'), ('deleted', 'Deleted'), ('reassigned', 'Reassigned')], max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentchange',
+            index=models.Index(fields=['provider_id', 'id'], name='appt_change_provider_idx'),
+        ),
+        migrations.AddField(
+            model_name='calendarfeed',
+            name='provider',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_feed', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-19 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_utilization_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointmentchange',
+            index=models.Index(fields=['changed_at'], name='appt_change_changed_at_idx'),
+        ),
+    ]
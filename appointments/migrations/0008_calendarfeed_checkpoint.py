@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_appointmentchange_changed_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarfeed',
+            name='checkpoint',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
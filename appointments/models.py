@@ -1,8 +1,41 @@
+import secrets
+from datetime import datetime, time, timedelta
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from simple_history.models import HistoricalRecords
 from patients.models import Patient
 
+def day_start(day):
+    """Return the aware datetime at which ``day`` begins in the clinic's timezone."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+class AppointmentQuerySet(models.QuerySet):
+    """Date filters expressed as half-open start_time ranges.
+    
+    Filtering on ``start_time__date`` casts the column and defeats its indexes,
+    so calendar days are converted to [day_start, next day_start) bounds instead.
+    """
+    
+    def on_date(self, day):
+        return self.between_dates(day, day)
+    
+    def between_dates(self, date_from=None, date_to=None):
+        """Appointments starting on any day from ``date_from`` to ``date_to`` inclusive."""
+        queryset = self
+        if date_from:
+            queryset = queryset.filter(start_time__gte=day_start(date_from))
+        if date_to:
+            queryset = queryset.filter(start_time__lt=day_start(date_to + timedelta(days=1)))
+        return queryset
+    
+    def after_date(self, day):
+        return self.filter(start_time__gte=day_start(day + timedelta(days=1)))
+    
+    def before_date(self, day):
+        return self.filter(start_time__lt=day_start(day))
+
 class AppointmentType(models.Model):
     """Model for appointment types/templates."""
     
@@ -43,6 +76,21 @@ class Appointment(models.Model):
     # Audit trail
     history = HistoricalRecords()
     
+    objects = AppointmentQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_time'], name='appt_start_time_idx'),
+            models.Index(fields=['provider', 'start_time'], name='appt_provider_start_idx'),
+            models.Index(fields=['status', 'start_time'], name='appt_status_start_idx'),
+            # Open appointments drive the upcoming lists and counts
+            models.Index(
+                fields=['start_time'],
+                name='appt_open_start_idx',
+                condition=models.Q(status__in=['scheduled', 'confirmed']),
+            ),
+        ]
+    
     def __str__(self):
         return f"{self.patient.full_name} - {self.appointment_type.name} on {self.start_time}"
     
@@ -99,6 +147,10 @@ class LabOrder(models.Model):
     ordered_date = models.DateField(auto_now_add=True)
     results_date = models.DateField(blank=True, null=True)
     results = models.TextField(blank=True, null=True)
+    results_reviewed_at = models.DateTimeField(blank=True, null=True)
+    results_reviewed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='reviewed_lab_orders'
+    )
     notes = models.TextField(blank=True, null=True)
     
     # Audit trail
@@ -130,3 +182,155 @@ class FollowUp(models.Model):
     def __str__(self):
         status = "Scheduled" if self.is_scheduled else "Not Scheduled"
         return f"Follow-up for {self.appointment.patient.full_name} ({status})"
+
+class AppointmentChange(models.Model):
+    """Append-only change log backing the calendar delta sync feed.
+    
+    The auto-incrementing primary key is the change sequence: clients keep the
+    last sequence they have seen as a sync token and ask only for newer rows.
+    Cancellations and deletions are recorded as tombstones so clients can drop
+    the event without re-downloading the whole range.
+    
+    Sequences are handed out when a row is inserted, not when it commits, so
+    a row can become visible after higher sequences have been read. Readers
+    therefore also keep a settled sequence, the highest one below which no
+    sequence is missing, and re-read the rows above it. A missing sequence
+    stops counting once a row logged after it is ``RESCAN_SECONDS`` old: its
+    transaction would have committed by then, so it was rolled back.
+    
+    Rows are never deleted today. A purge has to keep every row above the
+    lowest ``CalendarFeed.checkpoint``, which provider feeds count to notice
+    late commits (see appointments.ical).
+    """
+    
+    RESCAN_SECONDS = 300
+    
+    KIND_CHOICES = (
+        ('updated', 'Updated'),
+        ('cancelled', 'Cancelled'),
+        ('deleted', 'Deleted'),
+        ('reassigned', 'Reassigned'),
+    )
+    
+    # Plain columns rather than foreign keys so tombstones outlive deleted rows
+    appointment_id = models.BigIntegerField()
+    provider_id = models.BigIntegerField(null=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    changed_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['provider_id', 'id'], name='appt_change_provider_idx'),
+            models.Index(fields=['changed_at'], name='appt_change_changed_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"#{self.pk}: appointment {self.appointment_id} {self.kind}"
+    
+    @property
+    def is_tombstone(self):
+        return self.kind != 'updated'
+    
+    @classmethod
+    def latest_sequence(cls):
+        return cls.objects.aggregate(latest=models.Max('pk'))['latest'] or 0
+    
+    @classmethod
+    async def alatest_sequence(cls):
+        return (await cls.objects.aaggregate(latest=models.Max('pk')))['latest'] or 0
+    
+    @classmethod
+    def latest_sequence_before(cls, moment):
+        """The sequence of the last change logged before ``moment``, or 0."""
+        return cls.objects.filter(changed_at__lt=moment).order_by('-changed_at').values_list(
+            'pk', flat=True
+        ).first() or 0
+    
+    @classmethod
+    async def alatest_sequence_before(cls, moment):
+        return await cls.objects.filter(changed_at__lt=moment).order_by('-changed_at').values_list(
+            'pk', flat=True
+        ).afirst() or 0
+
+    @classmethod
+    def settle(cls, settled, changes, now):
+        """Advance ``settled`` through ``changes``, ``(sequence, changed_at)`` pairs above it in order."""
+        for sequence, changed_at in changes:
+            # A gap is still in flight until a change logged after it is RESCAN_SECONDS old
+            if sequence != settled + 1 and changed_at > now - timedelta(seconds=cls.RESCAN_SECONDS):
+                break
+            settled = sequence
+        return settled
+
+    @classmethod
+    def record_bulk(cls, appointments):
+        """Log changes for appointments written without save(), e.g. by bulk_update."""
+        cls.objects.bulk_create([
+            cls(
+                appointment_id=appointment.pk,
+                provider_id=appointment.provider_id,
+                kind='cancelled' if appointment.status == 'cancelled' else 'updated',
+            )
+            for appointment in appointments
+        ])
+
+def generate_feed_token():
+    return secrets.token_urlsafe(32)
+
+class CalendarFeed(models.Model):
+    """Secret token granting read access to a provider's iCalendar feed."""
+    
+    provider = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='calendar_feed')
+    token = models.CharField(max_length=64, unique=True, default=generate_feed_token)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Change rows are counted above this sequence (see appointments.ical)
+    checkpoint = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Calendar feed for {self.provider.full_name}"
+    
+    def rotate_token(self):
+        self.token = generate_feed_token()
+        self.save(update_fields=['token'])
+
+class UtilizationCounts(models.Model):
+    """Counters shared by the utilization rollup tables.
+    
+    ``appointments`` and ``booked_minutes`` exclude cancelled appointments.
+    """
+    
+    provider = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    appointment_type = models.ForeignKey(AppointmentType, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    appointments = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    no_shows = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+    booked_minutes = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        abstract = True
+
+class DailyUtilization(UtilizationCounts):
+    """Per provider, appointment type and clinic-local day rollup of appointments."""
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'provider', 'appointment_type'], name='daily_util_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} provider {self.provider_id} type {self.appointment_type_id}"
+
+class HourlyUtilization(UtilizationCounts):
+    """Per hour of day rollup; appointments count in their starting hour, minutes in every hour they occupy."""
+    
+    hour = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'provider', 'appointment_type', 'hour'], name='hourly_util_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.hour:02d}:00 provider {self.provider_id} type {self.appointment_type_id}"
@@ -0,0 +1,111 @@
+"""
+Write path for prescriptions and the patient medication list.
+
+A visit's prescriptions are saved together with the matching Medication rows
+in one transaction, with history rows bulk-created alongside. Prescriptions
+are reconciled against the patient's active medications by name, so renewing
+or adjusting a medication updates the existing entry instead of adding a
+duplicate.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from dashboard.alerts import RULES_BY_KIND, refresh_alerts
+from patients.chart import patient_charts
+from patients.models import Medication
+from .models import Prescription
+
+MEDICATION_FIELDS = ['dosage', 'frequency', 'start_date', 'end_date', 'prescribing_doctor', 'reason', 'notes', 'is_active']
+
+def medication_key(name):
+    return ' '.join(name.split()).casefold()
+
+def medication_values(prescription, prescriber_name, today):
+    return {
+        'dosage': prescription.dosage,
+        'frequency': prescription.frequency,
+        'end_date': today + timedelta(days=prescription.duration_days) if prescription.duration_days else None,
+        'prescribing_doctor': prescriber_name,
+        'reason': prescription.instructions,
+        'notes': prescription.notes,
+        'is_active': True,
+    }
+
+def prescribe(appointment, prescriptions, prescriber):
+    """Save unsaved ``prescriptions`` for ``appointment`` and update the medication list.
+
+    Returns ``(created, updated)`` lists of the Medication rows written.
+    """
+    today = timezone.localdate()
+    prescriber_name = prescriber.get_full_name()
+    change_reason = f"Prescribed at appointment #{appointment.pk}"
+
+    for prescription in prescriptions:
+        prescription.appointment = appointment
+        prescription.prescribed_by = prescriber
+
+    # Most recently started entry first, so it is the one kept for each name
+    active = Medication.objects.filter(patient_id=appointment.patient_id, is_active=True).order_by('-start_date', '-pk')
+    with transaction.atomic():
+        bulk_create_with_history(
+            prescriptions, Prescription, default_user=prescriber, default_change_reason=change_reason
+        )
+
+        existing = {}
+        duplicates = []
+        for medication in active.select_for_update():
+            key = medication_key(medication.medication_name)
+            if key in existing:
+                duplicates.append(medication)
+            else:
+                existing[key] = medication
+
+        planned = {}
+        for prescription in prescriptions:
+            planned[medication_key(prescription.medication_name)] = prescription
+
+        created, updated = [], []
+        for key, prescription in planned.items():
+            values = medication_values(prescription, prescriber_name, today)
+            medication = existing.get(key)
+            if medication is None:
+                created.append(Medication(
+                    patient_id=appointment.patient_id,
+                    medication_name=prescription.medication_name,
+                    start_date=today,
+                    **values,
+                ))
+                continue
+            if (medication.dosage, medication.frequency) != (values['dosage'], values['frequency']):
+                # A changed regimen starts today; a plain renewal keeps its start date
+                medication.start_date = today
+            for field, value in values.items():
+                setattr(medication, field, value)
+            updated.append(medication)
+
+        # Collapse duplicate entries left over from before reconciliation
+        planned_duplicates = [medication for medication in duplicates if medication_key(medication.medication_name) in planned]
+        for medication in planned_duplicates:
+            medication.is_active = False
+
+        if created:
+            bulk_create_with_history(
+                created, Medication, default_user=prescriber, default_change_reason=change_reason
+            )
+        if updated or planned_duplicates:
+            bulk_update_with_history(
+                updated + planned_duplicates, Medication, MEDICATION_FIELDS,
+                default_user=prescriber, default_change_reason=change_reason,
+            )
+
+        # Bulk writes skip post_save, so keep expired-medication alerts in step here
+        refresh_alerts(
+            RULES_BY_KIND['expired_medication'],
+            [medication.pk for medication in created + updated + planned_duplicates],
+        )
+        patient_charts.invalidate(appointment.patient_id)
+    return created, updated
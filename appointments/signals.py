@@ -0,0 +1,53 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Appointment, AppointmentChange
+from .utilization import refresh_provider_days
+
+@receiver(post_init, sender=Appointment)
+def remember_loaded_state(sender, instance, **kwargs):
+    instance._loaded_provider_id = instance.provider_id
+    # Read without triggering a query when start_time was deferred
+    instance._loaded_start_time = instance.__dict__.get('start_time')
+
+@receiver(post_save, sender=Appointment)
+def record_appointment_saved(sender, instance, created, **kwargs):
+    """Append a change (or a tombstone for cancellations) to the sync log."""
+    previous_provider_id = instance._loaded_provider_id
+    if not created and previous_provider_id and previous_provider_id != instance.provider_id:
+        # Drop the appointment from the previous provider's feed
+        AppointmentChange.objects.create(
+            appointment_id=instance.pk, provider_id=previous_provider_id, kind='reassigned'
+        )
+    
+    kind = 'cancelled' if instance.status == 'cancelled' else 'updated'
+    AppointmentChange.objects.create(appointment_id=instance.pk, provider_id=instance.provider_id, kind=kind)
+
+@receiver(post_delete, sender=Appointment)
+def record_appointment_deleted(sender, instance, **kwargs):
+    """Append a tombstone so synced clients drop the deleted appointment."""
+    AppointmentChange.objects.create(appointment_id=instance.pk, provider_id=instance.provider_id, kind='deleted')
+
+def provider_day(provider_id, start_time):
+    return (provider_id, timezone.localdate(start_time)) if provider_id and start_time else None
+
+@receiver(post_save, sender=Appointment)
+def refresh_utilization_on_save(sender, instance, **kwargs):
+    """Recompute the rollups for the provider-days the appointment left and joined."""
+    previous = provider_day(instance._loaded_provider_id, instance._loaded_start_time)
+    current = provider_day(instance.provider_id, instance.start_time)
+    refresh_provider_days(key for key in {previous, current} if key)
+
+@receiver(post_save, sender=Appointment)
+def remember_saved_state(sender, instance, **kwargs):
+    # Connected last so the receivers above still see the previously saved values
+    instance._loaded_provider_id = instance.provider_id
+    instance._loaded_start_time = instance.start_time
+
+@receiver(post_delete, sender=Appointment)
+def refresh_utilization_on_delete(sender, instance, **kwargs):
+    key = provider_day(instance.provider_id, instance.start_time)
+    if key:
+        refresh_provider_days([key])
+
@@ -0,0 +1,93 @@
+"""
+End-of-day sweep closing out appointments nobody updated.
+
+Appointments still ``scheduled`` or ``confirmed`` after their day has ended
+are moved to ``settings.APPOINTMENT_SWEEP_STATUS`` (``no_show`` by default).
+Work is done in short transactions of ``SWEEP_CHUNK_SIZE`` rows, claimed with
+SKIP LOCKED where supported, so the sweep never holds long locks and can run
+alongside normal traffic. Each chunk writes its history rows and change log
+entries in bulk, and refreshes the utilization rollups it affects.
+"""
+
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from simple_history.utils import bulk_update_with_history
+
+from .models import Appointment, AppointmentChange, day_start
+from .utilization import refresh_for_appointments
+
+SWEEP_CHUNK_SIZE = 500
+
+OPEN_STATUSES = ['scheduled', 'confirmed']
+
+# Trailing window used for the per-provider no-show rates in the sweep report
+NO_SHOW_RATE_DAYS = 30
+
+def sweep_chunk(cutoff, new_status, chunk_size):
+    """Close one chunk of stale appointments; returns the swept appointments."""
+    with transaction.atomic():
+        stale = Appointment.objects.filter(start_time__lt=cutoff, status__in=OPEN_STATUSES).order_by('start_time')
+        if connection.features.has_select_for_update_skip_locked:
+            stale = stale.select_for_update(skip_locked=True)
+        appointments = list(stale[:chunk_size])
+        if not appointments:
+            return []
+        now = timezone.now()
+        for appointment in appointments:
+            appointment.status = new_status
+            appointment.updated_at = now
+        bulk_update_with_history(
+            appointments, Appointment, ['status', 'updated_at'],
+            default_change_reason='End-of-day status sweep',
+        )
+        AppointmentChange.record_bulk(appointments)
+        refresh_for_appointments(appointments)
+    return appointments
+
+def no_show_rates(provider_ids, today, days=NO_SHOW_RATE_DAYS):
+    """No-show rate per provider over the ``days`` before ``today``."""
+    window = Appointment.objects.filter(
+        provider_id__in=provider_ids,
+        start_time__gte=day_start(today - timedelta(days=days)),
+        start_time__lt=day_start(today),
+    )
+    rates = {}
+    for row in window.values('provider_id').annotate(
+        total=Count('pk'), no_shows=Count('pk', filter=Q(status='no_show'))
+    ):
+        rates[row['provider_id']] = (row['no_shows'], row['total'])
+    return rates
+
+def sweep_status():
+    """The configured sweep status, which must close the appointments it is applied to."""
+    status = settings.APPOINTMENT_SWEEP_STATUS
+    if status in OPEN_STATUSES or status not in dict(Appointment.STATUS_CHOICES):
+        raise ImproperlyConfigured(f"APPOINTMENT_SWEEP_STATUS must be a closed appointment status, not {status!r}.")
+    return status
+
+def sweep_appointments(today=None, new_status=None, chunk_size=SWEEP_CHUNK_SIZE):
+    """Sweep every appointment from before ``today`` that is still open.
+
+    Returns ``(swept_per_provider, no_show_rates)`` where the rates map each
+    affected provider to ``(no_shows, total)`` over the trailing window.
+    ``new_status`` must not be one of ``OPEN_STATUSES``: swept rows would be
+    picked up again by the next chunk and the sweep would never finish.
+    """
+    if new_status in OPEN_STATUSES:
+        raise ValueError(f"Cannot sweep appointments to the open status {new_status!r}.")
+    today = today or timezone.localdate()
+    new_status = new_status or sweep_status()
+    cutoff = day_start(today)
+    swept = Counter()
+    while True:
+        appointments = sweep_chunk(cutoff, new_status, chunk_size)
+        if not appointments:
+            break
+        swept.update(appointment.provider_id for appointment in appointments)
+    return swept, no_show_rates(list(swept), today)
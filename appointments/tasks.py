@@ -0,0 +1,9 @@
+from datetime import timedelta
+
+from jobs.queue import task
+from . import status_sweep
+
+@task(schedule=timedelta(hours=1))
+def sweep_appointment_statuses():
+    """Close out yesterday's (and older) appointments left scheduled or confirmed."""
+    status_sweep.sweep_appointments()
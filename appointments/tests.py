@@ -1,3 +1,744 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+from unittest import mock
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from authentication import permissions
+from authentication.models import User
+from dashboard.models import Alert
+from patients.models import Medication, Patient
+from profiling.plans import QueryPlanAssertions
+from .lab_results import IngestReport, ingest_lines
+from .management.commands.ingest_lab_results import Command as IngestCommand
+from .models import (
+    Appointment, AppointmentChange, AppointmentType, CalendarFeed, DailyUtilization, HourlyUtilization, LabOrder,
+    Prescription, day_start,
+)
+from .prescriptions import prescribe
+from .status_sweep import OPEN_STATUSES, sweep_appointments
+
+
+def make_appointment(patient, appointment_type, provider, start_time, status='scheduled'):
+    return Appointment.objects.create(
+        patient=patient,
+        appointment_type=appointment_type,
+        provider=provider,
+        created_by=provider,
+        start_time=start_time,
+        end_time=start_time + timedelta(minutes=30),
+        status=status,
+        reason='Checkup',
+    )
+
+
+class AppointmentFixturesMixin:
+    """Shared provider, patient and appointment type for appointment tests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.provider = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+        cls.patient = Patient.objects.create(
+            medical_record_number='MRN-0001', first_name='John', last_name='Smith',
+            date_of_birth=date(1980, 1, 1), gender='M', phone_primary='555-0100', address='1 Main St', emergency_contact_name='Jane Smith',
+            emergency_contact_relation='Spouse', emergency_contact_phone='555-0101',
+        )
+        cls.appointment_type = AppointmentType.objects.create(name='Consultation')
+
+
+@override_settings(TIME_ZONE='America/New_York')
+class AppointmentDateRangeTests(AppointmentFixturesMixin, TestCase):
+    """Calendar-day filters must follow the clinic's timezone, not UTC."""
+
+    def test_day_start_is_local_midnight(self):
+        start = day_start(date(2024, 3, 10))
+        self.assertEqual(start.isoformat(), '2024-03-10T00:00:00-05:00')
+
+    def test_on_date_uses_clinic_day_boundaries(self):
+        tz = timezone.get_current_timezone()
+        late_evening = make_appointment(
+            self.patient, self.appointment_type, self.provider, datetime(2024, 5, 1, 23, 30, tzinfo=tz)
+        )
+        next_morning = make_appointment(
+            self.patient, self.appointment_type, self.provider, datetime(2024, 5, 2, 0, 0, tzinfo=tz)
+        )
+
+        self.assertQuerySetEqual(Appointment.objects.on_date(date(2024, 5, 1)), [late_evening])
+        self.assertQuerySetEqual(Appointment.objects.on_date(date(2024, 5, 2)), [next_morning])
+
+    def test_between_dates_is_inclusive_of_both_days(self):
+        tz = timezone.get_current_timezone()
+        appointments = [
+            make_appointment(self.patient, self.appointment_type, self.provider, datetime(2024, 5, day, 9, tzinfo=tz))
+            for day in (1, 2, 3, 4)
+        ]
+
+        self.assertQuerySetEqual(
+            Appointment.objects.between_dates(date(2024, 5, 2), date(2024, 5, 3)).order_by('start_time'),
+            appointments[1:3],
+        )
+        self.assertQuerySetEqual(
+            Appointment.objects.after_date(date(2024, 5, 3)), appointments[3:]
+        )
+        self.assertQuerySetEqual(
+            Appointment.objects.before_date(date(2024, 5, 2)), appointments[:1]
+        )
+
+
+class AppointmentQueryPlanTests(QueryPlanAssertions, AppointmentFixturesMixin, TestCase):
+    """Hot appointment queries must be answerable from an index, not a table scan."""
+
+    force_index_paths = True
+
+    def assertUsesIndex(self, queryset, *index_names):
+        self.assertPlan(queryset, uses=index_names, no_seq_scan=['appointments_appointment'])
+
+    def test_todays_appointments_use_start_time_index(self):
+        today = timezone.localdate()
+        self.assertUsesIndex(
+            Appointment.objects.on_date(today).order_by('start_time'),
+            'appt_start_time_idx',
+        )
+
+    def test_provider_filter_uses_composite_index(self):
+        today = timezone.localdate()
+        self.assertUsesIndex(
+            Appointment.objects.filter(provider=self.provider).between_dates(today, today + timedelta(days=7)),
+            'appt_provider_start_idx',
+        )
+
+    def test_status_filter_uses_composite_index(self):
+        self.assertUsesIndex(
+            Appointment.objects.filter(status='completed').before_date(timezone.localdate()),
+            'appt_status_start_idx',
+        )
+
+    def test_upcoming_count_uses_open_appointment_index(self):
+        today = timezone.localdate()
+        self.assertUsesIndex(
+            Appointment.objects.between_dates(today + timedelta(days=1), today + timedelta(days=7))
+            .filter(status__in=['scheduled', 'confirmed']),
+            'appt_open_start_idx',
+            'appt_status_start_idx',
+        )
+
+
+class CalendarSyncFeedTests(AppointmentFixturesMixin, TestCase):
+    """The delta feed only returns what changed since the client's token."""
+
+    def setUp(self):
+        self.client.force_login(self.provider)
+        self.url = reverse('get_calendar_changes')
+
+    def sync(self, since=None):
+        params = {'since': since} if since is not None else {}
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def settle(self):
+        """Age the logged changes past the rescan window, as if logged long ago."""
+        AppointmentChange.objects.update(
+            changed_at=timezone.now() - timedelta(seconds=AppointmentChange.RESCAN_SECONDS + 60)
+        )
+
+    def test_initial_sync_returns_snapshot_and_token(self):
+        appointment = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now(), status='cancelled')
+
+        data = self.sync()
+
+        self.assertTrue(data['reset'])
+        self.assertFalse(data['has_more'])
+        self.assertEqual([event['id'] for event in data['events']], [appointment.id])
+        self.assertEqual(data['sync_token'].split('-')[0], str(AppointmentChange.latest_sequence()))
+
+    def test_initial_snapshot_is_paged(self):
+        first = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        second = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+
+        with mock.patch('appointments.views.CALENDAR_SYNC_BATCH_SIZE', 1):
+            page = self.sync()
+            self.assertEqual((page['reset'], page['has_more']), (True, True))
+            self.assertEqual([event['id'] for event in page['events']], [first.id])
+
+            page = self.sync(page['sync_token'])
+            self.assertEqual((page['reset'], page['has_more']), (False, False))
+            self.assertEqual([event['id'] for event in page['events']], [second.id])
+
+        self.settle()
+        data = self.sync(page['sync_token'])
+        self.assertEqual(self.sync(data['sync_token'])['events'], [])
+
+    def test_changes_committed_after_a_higher_sequence_are_not_lost(self):
+        late = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        # A lower sequence that is not visible yet when the client syncs
+        late_change = AppointmentChange.objects.filter(appointment_id=late.id).get()
+        late_change.delete()
+        token = self.sync()['sync_token']
+
+        AppointmentChange.objects.create(
+            pk=late_change.pk, appointment_id=late.id, provider_id=self.provider.id, kind='updated'
+        )
+
+        self.assertIn(late.id, [event['id'] for event in self.sync(token)['events']])
+
+    def test_rows_are_not_rescanned_once_settled(self):
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        self.settle()
+        appointment = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        token = self.sync()['sync_token']
+        self.assertEqual(self.sync(token)['events'], [])
+
+        appointment.status = 'confirmed'
+        appointment.save()
+        data = self.sync(token)
+        self.assertEqual([event['id'] for event in data['events']], [appointment.id])
+        self.assertEqual(self.sync(data['sync_token'])['events'], [])
+
+    def test_rows_above_a_gap_are_rescanned_until_it_settles(self):
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        self.settle()
+        # A sequence whose transaction rolled back
+        rolled_back = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        AppointmentChange.objects.filter(appointment_id=rolled_back.id).delete()
+        appointment = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        token = self.sync()['sync_token']
+
+        data = self.sync(token)
+        self.assertEqual([event['id'] for event in data['events']], [appointment.id])
+        self.settle()
+        data = self.sync(data['sync_token'])
+        sequence, settled = data['sync_token'].split('-')
+        self.assertEqual(settled, sequence)
+        self.assertEqual(self.sync(data['sync_token'])['events'], [])
+
+    def test_rescan_is_capped_at_the_batch_size(self):
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        self.settle()
+        rolled_back = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        AppointmentChange.objects.filter(appointment_id=rolled_back.id).delete()
+        first = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+
+        with mock.patch('appointments.views.CALENDAR_SYNC_BATCH_SIZE', 1):
+            page = self.sync()
+            while page['has_more']:
+                page = self.sync(page['sync_token'])
+            data = self.sync(page['sync_token'])
+
+        self.assertEqual([event['id'] for event in data['events']], [first.id])
+        # Stuck behind the gap, so the client waits for its next poll
+        self.assertFalse(data['has_more'])
+
+    def test_delta_contains_only_changes_since_token(self):
+        unchanged = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        changed = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        self.settle()
+        token = self.sync()['sync_token']
+
+        changed.status = 'confirmed'
+        changed.save()
+        data = self.sync(token)
+
+        self.assertFalse(data['reset'])
+        self.assertEqual([event['id'] for event in data['events']], [changed.id])
+        self.assertNotIn(unchanged.id, data['removed'])
+        self.settle()
+        self.assertEqual(self.sync(data['sync_token'])['events'], [])
+
+    def test_cancellations_and_deletions_are_tombstoned(self):
+        cancelled = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        deleted = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        self.settle()
+        token = self.sync()['sync_token']
+
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        deleted_id = deleted.id
+        deleted.delete()
+        data = self.sync(token)
+
+        self.assertEqual(data['events'], [])
+        self.assertCountEqual(data['removed'], [cancelled.id, deleted_id])
+
+    def test_invalid_token_is_rejected(self):
+        for token in ('abc', '1-2-3-4', '1--2'):
+            response = self.client.get(self.url, {'since': token})
+            self.assertEqual(response.status_code, 400)
+
+
+class AsyncCalendarEventsTests(AppointmentFixturesMixin, TestCase):
+    """The async calendar endpoint serves events through the ASGI request path."""
+
+    async def test_events_in_range_are_returned(self):
+        start = timezone.now()
+        appointment = await sync_to_async(make_appointment)(self.patient, self.appointment_type, self.provider, start)
+        await sync_to_async(make_appointment)(
+            self.patient, self.appointment_type, self.provider, start + timedelta(days=10)
+        )
+        await self.async_client.aforce_login(self.provider)
+
+        response = await self.async_client.get(reverse('get_calendar_events'), {
+            'start': (start - timedelta(hours=1)).isoformat(), 'end': (start + timedelta(days=1)).isoformat(),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event['id'] for event in response.json()], [appointment.id])
+
+    async def test_anonymous_requests_are_sent_to_login(self):
+        response = await self.async_client.get(reverse('get_calendar_events'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response['Location'])
+
+
+class ProviderCalendarFeedTests(AppointmentFixturesMixin, TestCase):
+    """Tokenized iCalendar feeds are rebuilt from the change log and cached."""
+
+    def setUp(self):
+        cache.clear()
+        self.feed = CalendarFeed.objects.create(provider=self.provider)
+        self.url = reverse('provider_calendar_feed', args=[self.feed.token])
+
+    def test_feed_lists_provider_appointments(self):
+        appointment = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now(), status='cancelled')
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = response.content.decode()
+        self.assertEqual(body.count('BEGIN:VEVENT'), 1)
+        self.assertIn(f'UID:appointment-{appointment.pk}@docsdash', body)
+        self.assertIn('SUMMARY:Consultation - J.S.', body)
+
+    def test_unchanged_feed_is_not_modified(self):
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_feed_is_updated_incrementally(self):
+        kept = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        moved = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        first_etag = self.client.get(self.url)['ETag']
+
+        other_provider = User.objects.create_user(
+            email='other@example.com', password='unused-password', first_name='Bo', last_name='Ray', role='doctor'
+        )
+        moved.provider = other_provider
+        moved.save()
+        added = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+
+        body = response.content.decode()
+        self.assertNotEqual(response['ETag'], first_etag)
+        self.assertIn(f'UID:appointment-{kept.pk}@docsdash', body)
+        self.assertIn(f'UID:appointment-{added.pk}@docsdash', body)
+        self.assertNotIn(f'UID:appointment-{moved.pk}@docsdash', body)
+
+    def test_changes_committed_below_the_cached_version_are_picked_up(self):
+        late = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        # Not visible yet when the feed is built
+        late_change = AppointmentChange.objects.get(appointment_id=late.pk)
+        late_change.delete()
+        etag = self.client.get(self.url)['ETag']
+
+        late_change.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'UID:appointment-{late.pk}@docsdash', response.content.decode())
+
+    def test_only_changes_above_the_checkpoint_are_counted(self):
+        make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        AppointmentChange.objects.update(
+            changed_at=timezone.now() - timedelta(seconds=AppointmentChange.RESCAN_SECONDS + 60)
+        )
+        self.client.get(self.url)
+        self.feed.refresh_from_db()
+        self.assertEqual(self.feed.checkpoint, AppointmentChange.latest_sequence())
+
+        added = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+
+        self.assertIn(f'UID:appointment-{added.pk}@docsdash', response.content.decode())
+        self.assertTrue(response['ETag'].endswith(f'-{self.feed.checkpoint}-1"'))
+
+    def test_unknown_token_is_not_found(self):
+        response = self.client.get(reverse('provider_calendar_feed', args=['not-a-token']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_rotating_token_revokes_old_url(self):
+        self.client.force_login(self.provider)
+        new_url = self.client.post(reverse('calendar_feed_url')).json()['url']
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertTrue(new_url.endswith('.ics'))
+
+
+class LabResultIngestionTests(AppointmentFixturesMixin, TestCase):
+    """Result files are matched to lab orders and applied with history."""
+
+    def setUp(self):
+        appointment = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        self.orders = [
+            LabOrder.objects.create(
+                appointment=appointment, lab_name=name, description=name, ordered_by=self.provider
+            )
+            for name in ('CBC', 'Lipid panel')
+        ]
+
+    def test_delimited_rows_are_grouped_per_order(self):
+        cbc, lipids = self.orders
+        lines = [
+            'order_id|test|value|units|reference_range|flag|result_date\n',
+            f'{cbc.pk}|WBC|6.1|10^9/L|4.0-11.0||2024-05-01\n',
+            f'{cbc.pk}|Hgb|10.2|g/dL|12.0-16.0|L|2024-05-01\n',
+            f'{lipids.pk}|LDL|3.1|mmol/L|<3.4||2024-05-01\n',
+            '999999|LDL|3.1|mmol/L|<3.4||2024-05-01\n',
+        ]
+
+        report = ingest_lines(lines, IngestReport())
+
+        self.assertEqual((report.records, report.updated), (3, 2))
+        self.assertEqual(report.unmatched, [(5, '999999', 'unknown order')])
+        cbc.refresh_from_db()
+        self.assertEqual(cbc.status, 'completed')
+        self.assertEqual(cbc.results, 'WBC: 6.1 10^9/L (ref 4.0-11.0)\nHgb: 10.2 g/dL (ref 12.0-16.0) [L]')
+        self.assertEqual(cbc.results_date, date(2024, 5, 1))
+        self.assertEqual(cbc.history.first().history_change_reason, 'Lab result import')
+
+    def test_hl7_segments_update_orders(self):
+        cbc = self.orders[0]
+        fields = [''] * 26
+        fields[0], fields[2], fields[7], fields[25] = 'OBR', f'{cbc.pk}^DOCSDASH', '20240502083000', 'P'
+        lines = [
+            'MSH|^~\\&|REFLAB|LAB|DOCSDASH|CLINIC|20240502||ORU^R01|1|P|2.5\r',
+            '|'.join(fields) + '\r',
+            'OBX|1|NM|718-7^Hemoglobin^LN||13.5|g/dL|12.0-16.0|N|||P\r',
+        ]
+
+        report = ingest_lines(lines, IngestReport())
+
+        self.assertEqual(report.updated, 1)
+        cbc.refresh_from_db()
+        self.assertEqual(cbc.status, 'in_process')
+        self.assertEqual(cbc.results, 'Hemoglobin: 13.5 g/dL (ref 12.0-16.0) [N]')
+        self.assertEqual(cbc.results_date, date(2024, 5, 2))
+
+    def test_reimporting_identical_results_is_a_no_op(self):
+        lines = ['order_id,result\n', f'{self.orders[0].pk},Negative\n']
+        ingest_lines(lines, IngestReport())
+
+        with self.assertNumQueries(1):
+            report = ingest_lines(lines, IngestReport())
+
+        self.assertEqual((report.updated, report.unchanged), (0, 1))
+
+    def test_command_imports_files_and_opens_review_alerts(self):
+        cbc = self.orders[0]
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as result_file:
+            result_file.write(f'order_id,result\n{cbc.pk},Positive\n')
+        self.addCleanup(os.remove, result_file.name)
+
+        output = io.StringIO()
+        call_command('ingest_lab_results', result_file.name, stdout=output, stderr=io.StringIO())
+
+        self.assertIn('1 updated', output.getvalue())
+        self.assertTrue(Alert.objects.filter(kind='unreviewed_lab', source_id=cbc.pk).exists())
+
+    def test_watch_waits_for_files_to_stop_changing(self):
+        cbc, lipids = self.orders
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        drop = Path(directory.name)
+        (drop / 'processed').mkdir()
+        (drop / 'failed').mkdir()
+        upload = drop / 'results.csv'
+        upload.write_text(f'order_id,result\n{cbc.pk},Positive\n')
+        (drop / 'renamed.csv.tmp').write_text(f'order_id,result\n{lipids.pk},Positive\n')
+        command = IngestCommand(stdout=io.StringIO(), stderr=io.StringIO())
+
+        seen = command.poll(drop, {})
+        with upload.open('a') as lines:
+            lines.write(f'{lipids.pk},Negative\n')
+        seen = command.poll(drop, seen)
+        self.assertTrue(upload.exists())
+        command.poll(drop, seen)
+
+        self.assertFalse(upload.exists())
+        self.assertTrue((drop / 'processed' / 'results.csv').exists())
+        self.assertEqual(
+            dict(LabOrder.objects.filter(pk__in=[cbc.pk, lipids.pk]).values_list('pk', 'results')),
+            {cbc.pk: 'Positive', lipids.pk: 'Negative'},
+        )
+        self.assertTrue((drop / 'renamed.csv.tmp').exists())
+
+
+class AppointmentStatusSweepTests(AppointmentFixturesMixin, TestCase):
+    """Open appointments from past days are closed out in chunks with history."""
+
+    def setUp(self):
+        today = timezone.localdate()
+        yesterday = day_start(today) - timedelta(hours=12)
+        self.stale = [
+            make_appointment(self.patient, self.appointment_type, self.provider, yesterday - timedelta(days=offset), status)
+            for offset, status in enumerate(['scheduled', 'confirmed', 'scheduled'])
+        ]
+        self.completed = make_appointment(self.patient, self.appointment_type, self.provider, yesterday, 'completed')
+        self.upcoming = make_appointment(self.patient, self.appointment_type, self.provider, day_start(today) + timedelta(hours=9))
+
+    def test_past_open_appointments_become_no_shows(self):
+        sequence = AppointmentChange.latest_sequence()
+
+        swept, rates = sweep_appointments(chunk_size=2)
+
+        self.assertEqual(swept, {self.provider.pk: 3})
+        self.assertEqual(rates, {self.provider.pk: (3, 4)})
+        statuses = dict(Appointment.objects.values_list('pk', 'status'))
+        self.assertEqual({statuses[appointment.pk] for appointment in self.stale}, {'no_show'})
+        self.assertEqual(statuses[self.completed.pk], 'completed')
+        self.assertEqual(statuses[self.upcoming.pk], 'scheduled')
+        self.assertEqual(self.stale[0].history.first().history_change_reason, 'End-of-day status sweep')
+        self.assertEqual(
+            set(AppointmentChange.objects.filter(pk__gt=sequence).values_list('appointment_id', flat=True)),
+            {appointment.pk for appointment in self.stale},
+        )
+
+    @override_settings(APPOINTMENT_SWEEP_STATUS='cancelled')
+    def test_sweep_status_is_configurable(self):
+        sweep_appointments()
+
+        self.assertEqual(Appointment.objects.filter(status='cancelled').count(), 3)
+        self.assertEqual(sweep_appointments(), ({}, {}))
+
+    def test_open_statuses_are_rejected(self):
+        for status in OPEN_STATUSES:
+            with self.subTest(status=status):
+                with self.assertRaises(CommandError):
+                    call_command('sweep_appointments', status=status, stdout=io.StringIO())
+                with self.assertRaises(ValueError):
+                    sweep_appointments(new_status=status)
+                with override_settings(APPOINTMENT_SWEEP_STATUS=status), self.assertRaises(ImproperlyConfigured):
+                    sweep_appointments()
+        self.assertEqual(Appointment.objects.filter(status__in=OPEN_STATUSES).count(), 4)
+
+    def test_command_reports_no_show_rates(self):
+        out = io.StringIO()
+        call_command('sweep_appointments', stdout=out)
+
+        self.assertIn('Swept 3 appointments', out.getvalue())
+        self.assertIn('doctor@example.com: 3 swept, no-show rate 3/4 (75%)', out.getvalue())
+
+
+class PrescriptionServiceTests(AppointmentFixturesMixin, TestCase):
+    """Prescriptions are saved with the medication list in one reconciled write."""
+
+    def setUp(self):
+        self.appointment = make_appointment(self.patient, self.appointment_type, self.provider, timezone.now())
+        self.client.force_login(self.provider)
+
+    def prescription_data(self, prefix='', **overrides):
+        data = {
+            'medication_name': 'Amoxicillin', 'dosage': '500mg', 'frequency': 'twice_daily',
+            'duration_days': '10', 'refills': '0', 'instructions': 'Take with food', 'notes': '',
+        }
+        data.update(overrides)
+        return {f'{prefix}{field}': value for field, value in data.items()}
+
+    def test_single_prescription_adds_medication(self):
+        self.client.post(reverse('add_prescription', args=[self.appointment.pk]), self.prescription_data())
+
+        prescription = Prescription.objects.get(appointment=self.appointment)
+        medication = Medication.objects.get(patient=self.patient)
+        self.assertEqual(medication.medication_name, 'Amoxicillin')
+        self.assertEqual(medication.end_date, timezone.localdate() + timedelta(days=10))
+        self.assertEqual(prescription.history.get().history_user, self.provider)
+        self.assertEqual(medication.history.get().history_change_reason, f'Prescribed at appointment #{self.appointment.pk}')
+
+    def test_plan_reconciles_with_active_medications(self):
+        existing = Medication.objects.create(
+            patient=self.patient, medication_name='Lisinopril', dosage='10mg', frequency='once_daily',
+            start_date=date(2024, 1, 1), prescribing_doctor='Dr. Doe',
+        )
+        duplicate = Medication.objects.create(
+            patient=self.patient, medication_name='lisinopril ', dosage='10mg', frequency='once_daily',
+            start_date=date(2023, 1, 1), prescribing_doctor='Dr. Doe',
+        )
+        data = {'prescriptions-TOTAL_FORMS': '2', 'prescriptions-INITIAL_FORMS': '0'}
+        data.update(self.prescription_data('prescriptions-0-'))
+        data.update(self.prescription_data('prescriptions-1-', medication_name='LISINOPRIL', dosage='20mg', frequency='once_daily'))
+
+        self.client.post(reverse('add_prescription', args=[self.appointment.pk]), data)
+
+        self.assertEqual(self.appointment.prescriptions.count(), 2)
+        active = Medication.objects.filter(patient=self.patient, is_active=True)
+        self.assertEqual(sorted(active.values_list('pk', 'dosage')), sorted([
+            (existing.pk, '20mg'), (active.get(medication_name='Amoxicillin').pk, '500mg'),
+        ]))
+        existing.refresh_from_db()
+        self.assertEqual(existing.start_date, timezone.localdate())
+        duplicate.refresh_from_db()
+        self.assertFalse(duplicate.is_active)
+
+    def test_write_is_atomic(self):
+        prescription = Prescription(
+            medication_name='Amoxicillin', dosage='500mg', frequency='twice_daily', duration_days=10,
+            instructions='Take with food',
+        )
+
+        with mock.patch('appointments.prescriptions.refresh_alerts', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                prescribe(self.appointment, [prescription], self.provider)
+
+        self.assertFalse(Prescription.objects.exists())
+        self.assertFalse(Medication.objects.exists())
+
+
+@override_settings(TIME_ZONE='America/New_York')
+class UtilizationRollupTests(AppointmentFixturesMixin, TestCase):
+    """Rollups follow appointment saves and back the heatmap endpoint."""
+
+    def setUp(self):
+        self.tz = timezone.get_current_timezone()
+        self.appointment = make_appointment(
+            self.patient, self.appointment_type, self.provider, datetime(2024, 5, 1, 9, 45, tzinfo=self.tz)
+        )
+
+    def hourly(self, day):
+        return dict(
+            HourlyUtilization.objects.filter(provider=self.provider, date=day).values_list('hour', 'booked_minutes')
+        )
+
+    def test_saves_maintain_daily_and_hourly_rows(self):
+        daily = DailyUtilization.objects.get(provider=self.provider, date=date(2024, 5, 1))
+        self.assertEqual((daily.appointments, daily.booked_minutes), (1, 30))
+        self.assertEqual(self.hourly(date(2024, 5, 1)), {9: 15, 10: 15})
+
+        self.appointment.status = 'no_show'
+        self.appointment.save()
+        daily.refresh_from_db()
+        self.assertEqual((daily.appointments, daily.no_shows), (1, 1))
+
+    def test_rescheduling_moves_the_counts(self):
+        self.appointment.start_time = datetime(2024, 5, 2, 14, tzinfo=self.tz)
+        self.appointment.end_time = self.appointment.start_time + timedelta(minutes=30)
+        self.appointment.save()
+
+        self.assertFalse(DailyUtilization.objects.filter(date=date(2024, 5, 1)).exists())
+        self.assertEqual(self.hourly(date(2024, 5, 1)), {})
+        self.assertEqual(self.hourly(date(2024, 5, 2)), {14: 30})
+
+        self.appointment.delete()
+        self.assertFalse(HourlyUtilization.objects.exists())
+
+    def test_backfill_rebuilds_rollups(self):
+        DailyUtilization.objects.all().delete()
+        HourlyUtilization.objects.all().delete()
+        out = io.StringIO()
+
+        call_command('backfill_utilization', stdout=out)
+
+        self.assertIn('Rolled up 1 appointments', out.getvalue())
+        self.assertEqual(DailyUtilization.objects.get().booked_minutes, 30)
+        self.assertEqual(self.hourly(date(2024, 5, 1)), {9: 15, 10: 15})
+
+    def test_heatmap_returns_provider_by_hour_matrix(self):
+        admin = User.objects.create_user(
+            email='admin@example.com', password='unused-password', first_name='Al', last_name='Min', role='admin'
+        )
+        self.client.force_login(admin)
+        url = reverse('utilization_heatmap')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'date_from': '2024-05-01', 'date_to': '2024-05-02', 'metric': 'occupancy'})
+
+        # Served from the rollups alone, whatever the size of the appointments table
+        self.assertFalse([query for query in queries if 'appointments_appointment"' in query['sql']])
+
+        data = response.json()
+        self.assertEqual(data['providers'], [{'id': self.provider.pk, 'name': 'Ada Doe'}])
+        self.assertEqual(data['matrix'][0][9], 0.125)
+        self.assertEqual(data['by_type'][0]['appointment_type'], 'Consultation')
+        self.assertEqual(self.client.get(url, {'date_from': 'May 1'}).status_code, 400)
+
+
+# Nurses limited to the appointments they provide or booked, and those patients
+OWNER_SCOPED = {
+    **permissions.ROLE_PERMISSIONS,
+    'nurse': {
+        'appointments.view': ('created_by', 'provider'),
+        'appointments.change': ('provider',),
+        'patients.view': ('appointments__provider',),
+    },
+}
+
+
+@mock.patch.dict(permissions.ROLE_PERMISSIONS, OWNER_SCOPED)
+class AppointmentPermissionTests(AppointmentFixturesMixin, TestCase):
+    """Owner-scoped grants are applied in SQL; role checks need no queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.nurse = User.objects.create_user(
+            email='nurse@example.com', password='unused-password', first_name='Nina', last_name='Ward', role='nurse'
+        )
+        start = timezone.now() + timedelta(days=1)
+        cls.own = [
+            make_appointment(cls.patient, cls.appointment_type, cls.nurse, start + timedelta(hours=hour)) for hour in (1, 2)
+        ]
+        cls.other = make_appointment(cls.patient, cls.appointment_type, cls.provider, start)
+
+    def test_querysets_are_filtered_in_sql(self):
+        with self.assertNumQueries(1):
+            visible = list(permissions.filter_queryset(self.nurse, Appointment.objects.all(), 'appointments.view'))
+        self.assertEqual(set(visible), set(self.own))
+
+        # Patients are matched through EXISTS, so two appointments don't repeat the patient
+        patients = permissions.filter_queryset(self.nurse, Patient.objects.all(), 'patients.view')
+        self.assertEqual(list(patients), [self.patient])
+        self.assertEqual(
+            permissions.filter_queryset(self.provider, Appointment.objects.all(), 'appointments.view').count(), 3
+        )
+
+    def test_object_permission(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(permissions.has_permission(self.nurse, 'appointments.change'))
+            self.assertFalse(permissions.has_permission(self.nurse, 'reports.view'))
+        self.assertTrue(permissions.has_permission(self.nurse, 'appointments.change', self.own[0]))
+        self.assertFalse(permissions.has_permission(self.nurse, 'appointments.change', self.other))
+
+    def test_views_refuse_records_outside_the_grant(self):
+        self.client.force_login(self.nurse)
+
+        response = self.client.get(reverse('appointment_status_update', args=[self.other.pk, 'confirmed']))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('appointment_status_update', args=[self.own[0].pk, 'confirmed']))
+        self.assertRedirects(response, reverse('appointment_detail', args=[self.own[0].pk]), fetch_redirect_response=False)
+
+        # Without reports.view the heatmap sends the user back to the dashboard
+        response = self.client.get(reverse('utilization_heatmap'))
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
 
-# Create your tests here.
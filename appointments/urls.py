@@ -13,6 +13,7 @@ urlpatterns = [
     path('<int:appointment_pk>/add-prescription/', views.add_prescription, name='add_prescription'),
     path('<int:appointment_pk>/add-lab-order/', views.add_lab_order, name='add_lab_order'),
     path('<int:appointment_pk>/add-follow-up/', views.add_follow_up, name='add_follow_up'),
+    path('lab-order/<int:lab_order_pk>/review/', views.review_lab_results, name='review_lab_results'),
     path('follow-up/<int:follow_up_pk>/schedule/', views.schedule_follow_up, name='schedule_follow_up'),
     
     # Appointment types
@@ -23,4 +24,10 @@ urlpatterns = [
     # Calendar
     path('calendar/', views.calendar_view, name='calendar'),
     path('calendar/events/', views.get_calendar_events, name='get_calendar_events'),
+    path('calendar/changes/', views.get_calendar_changes, name='get_calendar_changes'),
+    path('calendar/feed/', views.calendar_feed_url, name='calendar_feed_url'),
+    path('calendar/feed/<str:token>.ics', views.provider_calendar_feed, name='provider_calendar_feed'),
+    
+    # Utilization reports
+    path('utilization/heatmap/', views.utilization_heatmap, name='utilization_heatmap'),
 ]
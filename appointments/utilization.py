@@ -0,0 +1,144 @@
+"""
+Provider utilization rollups.
+
+``DailyUtilization`` and ``HourlyUtilization`` hold appointment counters per
+provider, appointment type and clinic-local day (and hour of day). They are
+kept current from appointment saves: each change recomputes only the
+provider-days it touches from the raw appointments, which is a handful of
+rows on the (provider, start_time) index. ``backfill`` rebuilds whole date
+ranges, e.g. after a bulk import.
+
+Rows are written with ``INSERT ... ON CONFLICT DO UPDATE`` on their natural
+keys, so concurrent refreshes of the same provider-day never collide.
+Reports read the rollups by date range only and never touch appointments,
+so their cost does not grow with the amount of history kept.
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Appointment, DailyUtilization, HourlyUtilization, day_start
+
+COUNTERS = ['appointments', 'completed', 'no_shows', 'cancelled', 'booked_minutes']
+
+BATCH_SIZE = 1000
+
+def occupied_minutes(start, end):
+    """Split a local ``start``-``end`` interval into ``{hour: minutes}``, clipped to the start day."""
+    day_end = datetime.combine(start.date() + timedelta(days=1), time.min, tzinfo=start.tzinfo)
+    end = min(end, day_end)
+    minutes = {}
+    cursor = start
+    while cursor < end:
+        hour_end = min(cursor.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1), end)
+        minutes[cursor.hour] = minutes.get(cursor.hour, 0) + round((hour_end - cursor).total_seconds() / 60)
+        cursor = hour_end
+    return minutes
+
+def summarize(rows):
+    """Aggregate ``(provider_id, appointment_type_id, start_time, end_time, status)`` rows.
+
+    Returns ``(daily, hourly)`` dicts mapping rollup keys to Counters.
+    """
+    daily = defaultdict(Counter)
+    hourly = defaultdict(Counter)
+    for provider_id, appointment_type_id, start_time, end_time, status in rows:
+        start = timezone.localtime(start_time)
+        day_key = (start.date(), provider_id, appointment_type_id)
+        start_key = day_key + (start.hour,)
+        if status == 'cancelled':
+            daily[day_key]['cancelled'] += 1
+            hourly[start_key]['cancelled'] += 1
+            continue
+        daily[day_key]['appointments'] += 1
+        hourly[start_key]['appointments'] += 1
+        if status in ('completed', 'no_show'):
+            field = 'completed' if status == 'completed' else 'no_shows'
+            daily[day_key][field] += 1
+            hourly[start_key][field] += 1
+        for hour, minutes in occupied_minutes(start, timezone.localtime(end_time)).items():
+            daily[day_key]['booked_minutes'] += minutes
+            hourly[day_key + (hour,)]['booked_minutes'] += minutes
+    return daily, hourly
+
+def build_rows(daily, hourly):
+    daily_rows = [
+        DailyUtilization(date=day, provider_id=provider_id, appointment_type_id=type_id, **counts)
+        for (day, provider_id, type_id), counts in daily.items()
+    ]
+    hourly_rows = [
+        HourlyUtilization(date=day, provider_id=provider_id, appointment_type_id=type_id, hour=hour, **counts)
+        for (day, provider_id, type_id, hour), counts in hourly.items()
+    ]
+    return daily_rows, hourly_rows
+
+def upsert(model, rows, unique_fields):
+    model.objects.bulk_create(
+        rows, batch_size=BATCH_SIZE, update_conflicts=True,
+        unique_fields=unique_fields, update_fields=COUNTERS,
+    )
+
+def write_rows(daily_rows, hourly_rows):
+    upsert(DailyUtilization, daily_rows, ['date', 'provider', 'appointment_type'])
+    upsert(HourlyUtilization, hourly_rows, ['date', 'provider', 'appointment_type', 'hour'])
+
+def delete_stale(model, scope, current_keys, key_fields):
+    """Delete rows within ``scope`` whose key no longer has any appointments."""
+    stale = [
+        pk for pk, *key in model.objects.filter(scope).values_list('pk', *key_fields)
+        if tuple(key) not in current_keys
+    ]
+    if stale:
+        model.objects.filter(pk__in=stale).delete()
+
+def refresh_provider_days(provider_days):
+    """Recompute the rollups for an iterable of ``(provider_id, date)`` pairs."""
+    provider_days = set(provider_days)
+    if not provider_days:
+        return
+    appointment_scope = Q()
+    rollup_scope = Q()
+    for provider_id, day in provider_days:
+        appointment_scope |= Q(
+            provider_id=provider_id,
+            start_time__gte=day_start(day),
+            start_time__lt=day_start(day + timedelta(days=1)),
+        )
+        rollup_scope |= Q(provider_id=provider_id, date=day)
+
+    rows = Appointment.objects.filter(appointment_scope).values_list(
+        'provider_id', 'appointment_type_id', 'start_time', 'end_time', 'status'
+    )
+    daily, hourly = summarize(rows)
+    with transaction.atomic():
+        write_rows(*build_rows(daily, hourly))
+        delete_stale(DailyUtilization, rollup_scope, daily, ['date', 'provider_id', 'appointment_type_id'])
+        delete_stale(HourlyUtilization, rollup_scope, hourly, ['date', 'provider_id', 'appointment_type_id', 'hour'])
+
+def refresh_for_appointments(appointments):
+    refresh_provider_days(
+        (appointment.provider_id, timezone.localdate(appointment.start_time)) for appointment in appointments
+    )
+
+def backfill(date_from, date_to, chunk_days=31):
+    """Rebuild the rollups for every day from ``date_from`` to ``date_to`` inclusive.
+
+    Yields ``(chunk_start, chunk_end, appointment_count)`` as each chunk is written.
+    """
+    chunk_start = date_from
+    while chunk_start <= date_to:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), date_to)
+        rows = Appointment.objects.between_dates(chunk_start, chunk_end).values_list(
+            'provider_id', 'appointment_type_id', 'start_time', 'end_time', 'status'
+        )
+        daily, hourly = summarize(rows.iterator(chunk_size=BATCH_SIZE))
+        with transaction.atomic():
+            DailyUtilization.objects.filter(date__range=(chunk_start, chunk_end)).delete()
+            HourlyUtilization.objects.filter(date__range=(chunk_start, chunk_end)).delete()
+            write_rows(*build_rows(daily, hourly))
+        yield chunk_start, chunk_end, sum(counts['appointments'] + counts['cancelled'] for counts in daily.values())
+        chunk_start = chunk_end + timedelta(days=1)
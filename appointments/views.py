@@ -1,26 +1,39 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
-from django.db.models import Q
-from django.http import JsonResponse
+from django.db.models import Count, Q, OuterRef, Subquery, Sum
+from django.http import Http404, HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.core.paginator import Paginator
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 
-from .models import Appointment, AppointmentType, Prescription, LabOrder, FollowUp
+from .models import (
+    Appointment, AppointmentChange, AppointmentType, CalendarFeed,
+    Prescription, LabOrder, FollowUp, DailyUtilization, HourlyUtilization
+)
 from .forms import (
-    AppointmentForm, AppointmentTypeForm, PrescriptionForm, 
+    AppointmentForm, AppointmentTypeForm, PrescriptionForm, PrescriptionFormSet,
     LabOrderForm, FollowUpForm, AppointmentFilterForm
 )
 from patients.models import Patient, VitalSigns
-from authentication.decorators import medical_staff_required
+from authentication.decorators import login_required, permission_required
+from authentication.permissions import filter_queryset, get_permitted_or_404
+from authentication.models import User
+from docsdash.replicas import primary_reads, replica_reads
+from .catalog import active_appointment_types, appointment_type_names
+from .ical import build_feed
+from .prescriptions import prescribe
+from .utilization import COUNTERS
 
 @login_required
+@replica_reads
 def appointment_list(request):
     """View for listing all appointments with filtering capabilities."""
     
-    # Base queryset
-    appointments = Appointment.objects.all()
+    # Base queryset, limited to what the user may see
+    appointments = filter_queryset(request.user, Appointment.objects.all(), 'appointments.view')
     
     # Initialize filter form
     filter_form = AppointmentFilterForm(request.GET)
@@ -39,13 +52,10 @@ def appointment_list(request):
         if appointment_type:
             appointments = appointments.filter(appointment_type=appointment_type)
         
-        date_from = filter_form.cleaned_data.get('date_from')
-        if date_from:
-            appointments = appointments.filter(start_time__date__gte=date_from)
-        
-        date_to = filter_form.cleaned_data.get('date_to')
-        if date_to:
-            appointments = appointments.filter(start_time__date__lte=date_to)
+        appointments = appointments.between_dates(
+            filter_form.cleaned_data.get('date_from'),
+            filter_form.cleaned_data.get('date_to'),
+        )
         
         patient_search = filter_form.cleaned_data.get('patient_search')
         if patient_search:
@@ -56,17 +66,17 @@ def appointment_list(request):
             )
     
     # Default order: upcoming appointments first, then by start time
-    appointments = appointments.order_by('start_time')
+    appointments = appointments.select_related('patient', 'appointment_type', 'provider').order_by('start_time')
     
     # Get today's appointments
-    today = timezone.now().date()
-    todays_appointments = appointments.filter(start_time__date=today)
+    today = timezone.localdate()
+    todays_appointments = appointments.on_date(today)
     
     # Get upcoming appointments (excluding today)
-    upcoming_appointments = appointments.filter(start_time__date__gt=today, status__in=['scheduled', 'confirmed'])
+    upcoming_appointments = appointments.after_date(today).filter(status__in=['scheduled', 'confirmed'])
     
     # Get past appointments
-    past_appointments = appointments.filter(start_time__date__lt=today)
+    past_appointments = appointments.before_date(today)
     
     # Pagination for past appointments
     paginator = Paginator(past_appointments, 15)
@@ -83,13 +93,13 @@ def appointment_list(request):
     return render(request, 'appointments/appointment_list.html', context)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
 def appointment_create(request, patient_id=None):
     """View for creating a new appointment."""
     
     patient = None
     if patient_id:
-        patient = get_object_or_404(Patient, pk=patient_id)
+        patient = get_permitted_or_404(request.user, 'patients.view', Patient, pk=patient_id)
     
     if request.method == 'POST':
         form = AppointmentForm(request.POST)
@@ -114,7 +124,7 @@ def appointment_create(request, patient_id=None):
     context = {
         'form': form,
         'patient': patient,
-        'appointment_types': AppointmentType.objects.filter(is_active=True),
+        'appointment_types': active_appointment_types(),
     }
     
     return render(request, 'appointments/appointment_form.html', context)
@@ -123,7 +133,7 @@ def appointment_create(request, patient_id=None):
 def appointment_detail(request, pk):
     """View for displaying appointment details."""
     
-    appointment = get_object_or_404(Appointment, pk=pk)
+    appointment = get_permitted_or_404(request.user, 'appointments.view', Appointment, pk=pk)
     
     # Get related data
     prescriptions = appointment.prescriptions.all()
@@ -140,6 +150,7 @@ def appointment_detail(request, pk):
         'follow_ups': follow_ups,
         'latest_vitals': latest_vitals,
         'prescription_form': PrescriptionForm(),
+        'prescription_formset': PrescriptionFormSet(prefix='prescriptions'),
         'lab_order_form': LabOrderForm(),
         'follow_up_form': FollowUpForm(),
     }
@@ -147,11 +158,11 @@ def appointment_detail(request, pk):
     return render(request, 'appointments/appointment_detail.html', context)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
 def appointment_edit(request, pk):
     """View for editing appointment information."""
     
-    appointment = get_object_or_404(Appointment, pk=pk)
+    appointment = get_permitted_or_404(request.user, 'appointments.change', Appointment, pk=pk)
     
     if request.method == 'POST':
         form = AppointmentForm(request.POST, instance=appointment)
@@ -171,17 +182,17 @@ def appointment_edit(request, pk):
     context = {
         'form': form,
         'appointment': appointment,
-        'appointment_types': AppointmentType.objects.filter(is_active=True),
+        'appointment_types': active_appointment_types(),
     }
     
     return render(request, 'appointments/appointment_form.html', context)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
 def appointment_status_update(request, pk, status):
     """View for updating appointment status."""
     
-    appointment = get_object_or_404(Appointment, pk=pk)
+    appointment = get_permitted_or_404(request.user, 'appointments.change', Appointment, pk=pk)
     
     # Validate status
     valid_statuses = [choice[0] for choice in Appointment.STATUS_CHOICES]
@@ -198,44 +209,41 @@ def appointment_status_update(request, pk, status):
     return redirect('appointment_detail', pk=pk)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
 def add_prescription(request, appointment_pk):
     """View for adding a prescription to an appointment."""
     
-    appointment = get_object_or_404(Appointment, pk=appointment_pk)
+    appointment = get_permitted_or_404(request.user, 'appointments.change', Appointment, pk=appointment_pk)
     
     if request.method == 'POST':
-        form = PrescriptionForm(request.POST)
-        if form.is_valid():
-            prescription = form.save(commit=False)
-            prescription.appointment = appointment
-            prescription.prescribed_by = request.user
-            prescription.save()
-            
-            # Also add to patient's medications
-            patient = appointment.patient
-            patient.medications.create(
-                medication_name=prescription.medication_name,
-                dosage=prescription.dosage,
-                frequency=prescription.frequency,
-                start_date=timezone.now().date(),
-                end_date=timezone.now().date() + timedelta(days=prescription.duration_days) if prescription.duration_days else None,
-                prescribing_doctor=request.user.get_full_name(),
-                reason=prescription.instructions,
-                notes=prescription.notes,
-                is_active=True
+        # A medication plan arrives as a formset; a single form is still accepted
+        if 'prescriptions-TOTAL_FORMS' in request.POST:
+            formset = PrescriptionFormSet(request.POST, prefix='prescriptions')
+            is_valid = formset.is_valid()
+            submitted = [form for form in formset if form.has_changed()]
+        else:
+            form = PrescriptionForm(request.POST)
+            is_valid = form.is_valid()
+            submitted = [form]
+        
+        if is_valid and submitted:
+            created, updated = prescribe(appointment, [form.save(commit=False) for form in submitted], request.user)
+            messages.success(
+                request,
+                f"{len(submitted)} prescription(s) added to appointment; "
+                f"{len(created)} medication(s) added and {len(updated)} updated on the patient's list."
             )
-            
-            messages.success(request, f"Prescription added to appointment.")
+        else:
+            messages.error(request, "Please correct the prescription details.")
     
     return redirect('appointment_detail', pk=appointment_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
 def add_lab_order(request, appointment_pk):
     """View for adding a lab order to an appointment."""
     
-    appointment = get_object_or_404(Appointment, pk=appointment_pk)
+    appointment = get_permitted_or_404(request.user, 'appointments.change', Appointment, pk=appointment_pk)
     
     if request.method == 'POST':
         form = LabOrderForm(request.POST)
@@ -249,11 +257,26 @@ def add_lab_order(request, appointment_pk):
     return redirect('appointment_detail', pk=appointment_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
+def review_lab_results(request, lab_order_pk):
+    """View for signing off a lab order's results as reviewed."""
+    
+    lab_order = get_object_or_404(LabOrder, pk=lab_order_pk)
+    
+    if request.method == 'POST':
+        lab_order.results_reviewed_at = timezone.now()
+        lab_order.results_reviewed_by = request.user
+        lab_order.save()
+        messages.success(request, f"{lab_order.lab_name} results marked as reviewed.")
+    
+    return redirect('appointment_detail', pk=lab_order.appointment_id)
+
+@login_required
+@permission_required('appointments.change')
 def add_follow_up(request, appointment_pk):
     """View for adding a follow-up to an appointment."""
     
-    appointment = get_object_or_404(Appointment, pk=appointment_pk)
+    appointment = get_permitted_or_404(request.user, 'appointments.change', Appointment, pk=appointment_pk)
     
     if request.method == 'POST':
         form = FollowUpForm(request.POST)
@@ -266,7 +289,7 @@ def add_follow_up(request, appointment_pk):
     return redirect('appointment_detail', pk=appointment_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
 def schedule_follow_up(request, follow_up_pk):
     """View for scheduling a follow-up appointment."""
     
@@ -301,13 +324,13 @@ def schedule_follow_up(request, follow_up_pk):
     context = {
         'form': form,
         'follow_up': follow_up,
-        'appointment_types': AppointmentType.objects.filter(is_active=True),
+        'appointment_types': active_appointment_types(),
     }
     
     return render(request, 'appointments/schedule_follow_up.html', context)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
 def appointment_type_list(request):
     """View for listing appointment types."""
     
@@ -330,7 +353,7 @@ def appointment_type_list(request):
     return render(request, 'appointments/appointment_type_list.html', context)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
 def appointment_type_edit(request, pk):
     """View for editing appointment type."""
     
@@ -353,7 +376,7 @@ def appointment_type_edit(request, pk):
     return render(request, 'appointments/appointment_type_form.html', context)
 
 @login_required
-@medical_staff_required
+@permission_required('appointments.change')
 def toggle_appointment_type_status(request, pk):
     """View for toggling appointment type active/inactive status."""
     
@@ -373,14 +396,43 @@ def calendar_view(request):
     # This would be extended in a real app with AJAX to load appointments dynamically
     return render(request, 'appointments/calendar.html')
 
+CALENDAR_STATUS_COLORS = {
+    'scheduled': '#305F6D',
+    'confirmed': '#698C8E',
+    'in_progress': '#BF6E15',
+    'completed': '#C1884E',
+    'cancelled': '#263037',
+    'no_show': '#263037',
+}
+
+# Maximum number of change log rows consumed by one delta sync request
+CALENDAR_SYNC_BATCH_SIZE = 500
+
+def calendar_event(appointment):
+    """Serialize an appointment as a calendar event."""
+    return {
+        'id': appointment.id,
+        'title': f"{appointment.patient.full_name} - {appointment.appointment_type.name}",
+        'start': appointment.start_time.isoformat(),
+        'end': appointment.end_time.isoformat(),
+        'color': CALENDAR_STATUS_COLORS.get(appointment.status, '#305F6D'),
+        'url': f"/appointments/{appointment.id}/",
+    }
+
 @login_required
-def get_calendar_events(request):
-    """API endpoint for getting appointments as calendar events."""
+@replica_reads
+async def get_calendar_events(request):
+    """API endpoint for getting appointments as calendar events.
+    
+    Async, so under ASGI a slow query holds a coroutine rather than a worker thread.
+    """
     
     start_date = request.GET.get('start', None)
     end_date = request.GET.get('end', None)
     
-    appointments = Appointment.objects.all()
+    user = await request.auser()
+    appointments = filter_queryset(user, Appointment.objects.all(), 'appointments.view')
+    appointments = appointments.select_related('patient', 'appointment_type')
     
     if start_date:
         start_date = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
@@ -388,26 +440,245 @@ def get_calendar_events(request):
     
     if end_date:
         end_date = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-        appointments = appointments.filter(end_time__lte=end_date)
-    
-    events = []
-    for appointment in appointments:
-        status_colors = {
-            'scheduled': '#305F6D',
-            'confirmed': '#698C8E',
-            'in_progress': '#BF6E15',
-            'completed': '#C1884E',
-            'cancelled': '#263037',
-            'no_show': '#263037',
-        }
-        
-        events.append({
-            'id': appointment.id,
-            'title': f"{appointment.patient.full_name} - {appointment.appointment_type.name}",
-            'start': appointment.start_time.isoformat(),
-            'end': appointment.end_time.isoformat(),
-            'color': status_colors.get(appointment.status, '#305F6D'),
-            'url': f"/appointments/{appointment.id}/",
-        })
+        # The start_time bound is implied, but lets appt_start_time_idx stop at the window's end
+        appointments = appointments.filter(start_time__lt=end_date, end_time__lte=end_date)
+    
+    events = [calendar_event(appointment) async for appointment in appointments]
     
     return JsonResponse(events, safe=False)
+
+def format_sync_token(sequence, settled, snapshot_after=None):
+    parts = [sequence, settled] + ([snapshot_after] if snapshot_after is not None else [])
+    return '-'.join(str(part) for part in parts)
+
+def parse_sync_token(token):
+    """(sequence, settled, snapshot_after) from a token; raises ValueError if malformed.
+    
+    Change rows above ``settled`` may have committed after the previous read,
+    so they are read again. ``snapshot_after`` is set while the initial
+    snapshot is paged. Plain sequences from older clients are accepted
+    without a rescan.
+    """
+    parts = [int(part) for part in token.split('-')]
+    if not 1 <= len(parts) <= 3 or any(part < 0 for part in parts):
+        raise ValueError(token)
+    parts += [None] * (3 - len(parts))
+    return tuple(parts)
+
+async def settle_through(settled, sequence, now):
+    """Advance ``settled`` over the change rows up to ``sequence`` that are no longer in flight."""
+    changes = [
+        change async for change in AppointmentChange.objects.filter(pk__gt=settled, pk__lte=sequence)
+        .order_by('pk').values_list('pk', 'changed_at')[:CALENDAR_SYNC_BATCH_SIZE]
+    ]
+    return AppointmentChange.settle(settled, changes, now)
+
+# Sync tokens must never go backwards, so this always reads the primary
+@login_required
+@primary_reads
+async def get_calendar_changes(request):
+    """API endpoint for incremental calendar sync.
+    
+    Without a ``since`` token the non-cancelled appointments are returned as a
+    snapshot, in pages, along with a token. With a token, only appointments
+    changed after it are returned, and cancelled or deleted ones are listed
+    in ``removed``. ``has_more`` tells the client to ask again straight away
+    with the new token. Only the first snapshot page has ``reset`` set.
+    """
+    
+    since = request.GET.get('since')
+    user = await request.auser()
+    now = timezone.now()
+    rescan_cutoff = now - timedelta(seconds=AppointmentChange.RESCAN_SECONDS)
+    
+    if not since:
+        # Read the token first so changes racing with the snapshot are re-sent, not lost
+        sequence = await AppointmentChange.alatest_sequence()
+        settled = min(await AppointmentChange.alatest_sequence_before(rescan_cutoff), sequence)
+        settled = await settle_through(settled, sequence, now)
+        snapshot_after = 0
+    else:
+        try:
+            sequence, settled, snapshot_after = parse_sync_token(since)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid sync token.'}, status=400)
+        if settled is None:
+            settled = sequence
+        elif settled > sequence:
+            # Older tokens carried the Unix time to rescan from instead
+            rescan_from = datetime.fromtimestamp(settled, tz=dt_timezone.utc)
+            settled = min(await AppointmentChange.alatest_sequence_before(rescan_from), sequence)
+    
+    if snapshot_after is not None:
+        appointments = filter_queryset(user, Appointment.objects.exclude(status='cancelled'), 'appointments.view')
+        page = [
+            appointment async for appointment in appointments.filter(pk__gt=snapshot_after)
+            .select_related('patient', 'appointment_type').order_by('pk')[:CALENDAR_SYNC_BATCH_SIZE + 1]
+        ]
+        has_more = len(page) > CALENDAR_SYNC_BATCH_SIZE
+        page = page[:CALENDAR_SYNC_BATCH_SIZE]
+        return JsonResponse({
+            'sync_token': format_sync_token(sequence, settled, page[-1].pk if has_more else None),
+            'reset': not since,
+            'has_more': has_more,
+            'events': [calendar_event(appointment) for appointment in page],
+            'removed': [],
+        })
+    
+    # Rows below the token that may have committed after the previous read
+    late = [
+        change async for change in AppointmentChange.objects.filter(pk__gt=settled, pk__lte=sequence)
+        .order_by('pk').values_list('pk', 'appointment_id', 'kind', 'changed_at')[:CALENDAR_SYNC_BATCH_SIZE + 1]
+    ]
+    late_truncated = len(late) > CALENDAR_SYNC_BATCH_SIZE
+    late = late[:CALENDAR_SYNC_BATCH_SIZE]
+    changes = [
+        change async for change in AppointmentChange.objects.filter(pk__gt=sequence)
+        .order_by('pk')
+        .values_list('pk', 'appointment_id', 'kind', 'changed_at')[:CALENDAR_SYNC_BATCH_SIZE + 1]
+    ]
+    has_more = len(changes) > CALENDAR_SYNC_BATCH_SIZE
+    changes = changes[:CALENDAR_SYNC_BATCH_SIZE]
+    if changes:
+        sequence = changes[-1][0]
+    # Settling can't pass rows the rescan didn't reach
+    read = late if late_truncated else late + changes
+    settled = AppointmentChange.settle(settled, [(change[0], change[3]) for change in read], now)
+    
+    # Collapse to the latest change per appointment
+    latest_kind = {}
+    for change_sequence, appointment_id, kind, changed_at in late + changes:
+        latest_kind[appointment_id] = kind
+    
+    updated_ids = [pk for pk, kind in latest_kind.items() if kind == 'updated']
+    appointments = filter_queryset(user, Appointment.objects.filter(pk__in=updated_ids), 'appointments.view')
+    appointments = appointments.select_related('patient', 'appointment_type')
+    events = [calendar_event(appointment) async for appointment in appointments]
+    
+    # Appointments deleted after their last logged update show up as missing rows
+    found_ids = {event['id'] for event in events}
+    removed = [pk for pk, kind in latest_kind.items() if kind != 'updated' or pk not in found_ids]
+    
+    return JsonResponse({
+        'sync_token': format_sync_token(sequence, settled),
+        'reset': False,
+        # Ask for the rest of a capped rescan only once it has settled past it
+        'has_more': has_more or (late_truncated and settled == late[-1][0]),
+        'events': events,
+        'removed': removed,
+    })
+
+@login_required
+def calendar_feed_url(request):
+    """Return the user's private iCalendar feed URL; POST issues a new one."""
+    
+    feed, created = CalendarFeed.objects.get_or_create(provider=request.user)
+    if request.method == 'POST' and not created:
+        feed.rotate_token()
+    
+    url = request.build_absolute_uri(reverse('provider_calendar_feed', args=[feed.token]))
+    return JsonResponse({'url': url})
+
+def provider_calendar_feed(request, token):
+    """Serve a provider's schedule as iCalendar, authenticated by the URL token.
+    
+    The token lookup and the provider's latest change sequence and change
+    count above the feed's checkpoint come from a single query. The count is in the ETag too, so a change
+    that commits below the latest sequence still modifies the feed. Unchanged
+    feeds answer conditional requests with 304 and everything else is served
+    from the prebuilt cached bytes.
+    """
+    
+    provider_changes = AppointmentChange.objects.filter(provider_id=OuterRef('provider_id'))
+    latest_change = provider_changes.order_by('-pk')
+    feed_state = CalendarFeed.objects.filter(token=token).annotate(
+        version=Subquery(latest_change.values('pk')[:1]),
+        last_changed=Subquery(latest_change.values('changed_at')[:1]),
+        change_count=Subquery(
+            provider_changes.filter(pk__gt=OuterRef('checkpoint')).order_by().values('provider_id')
+            .annotate(count=Count('pk')).values('count')
+        ),
+    ).values('provider_id', 'version', 'last_changed', 'checkpoint', 'change_count').first()
+    
+    if feed_state is None:
+        raise Http404("Calendar feed not found.")
+    
+    provider_id = feed_state['provider_id']
+    version = feed_state['version'] or 0
+    checkpoint = feed_state['checkpoint']
+    change_count = feed_state['change_count'] or 0
+    etag = f'"{provider_id}-{version}-{checkpoint}-{change_count}"'
+    last_modified = int(feed_state['last_changed'].timestamp()) if feed_state['last_changed'] else None
+    
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        feed = build_feed(provider_id, version, change_count, checkpoint)
+        response = HttpResponse(feed['body'], content_type='text/calendar; charset=utf-8')
+    
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+HEATMAP_METRICS = ('occupancy', 'appointments', 'completed', 'no_shows', 'cancelled')
+HEATMAP_MAX_DAYS = 366
+
+@login_required
+@permission_required('reports.view')
+def utilization_heatmap(request):
+    """Provider by hour-of-day utilization matrix built from the rollup tables.
+    
+    ``occupancy`` is the share of each hour that was booked, averaged over the
+    days in range; the other metrics are totals. Only the rollups are read, so
+    the cost depends on the range requested rather than on stored history.
+    """
+    
+    today = timezone.localdate()
+    try:
+        date_to = date.fromisoformat(request.GET['date_to']) if request.GET.get('date_to') else today
+        date_from = date.fromisoformat(request.GET['date_from']) if request.GET.get('date_from') else date_to - timedelta(days=27)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date.'}, status=400)
+    days = (date_to - date_from).days + 1
+    if not 0 < days <= HEATMAP_MAX_DAYS:
+        return JsonResponse({'error': f'Date range must cover 1 to {HEATMAP_MAX_DAYS} days.'}, status=400)
+    metric = request.GET.get('metric', 'occupancy')
+    if metric not in HEATMAP_METRICS:
+        return JsonResponse({'error': 'Unknown metric.'}, status=400)
+    
+    hourly = HourlyUtilization.objects.filter(date__range=(date_from, date_to))
+    daily = DailyUtilization.objects.filter(date__range=(date_from, date_to))
+    appointment_type = request.GET.get('appointment_type', '')
+    if appointment_type.isdigit():
+        hourly = hourly.filter(appointment_type_id=appointment_type)
+        daily = daily.filter(appointment_type_id=appointment_type)
+    
+    field = 'booked_minutes' if metric == 'occupancy' else metric
+    cells = hourly.values('provider_id', 'hour').annotate(total=Sum(field)).order_by()
+    totals = list(
+        daily.values('provider_id', 'appointment_type_id')
+        .annotate(**{counter: Sum(counter) for counter in COUNTERS})
+        .order_by('provider_id', 'appointment_type_id')
+    )
+    
+    # Providers with any rollup in range, one matrix row each
+    rows = {}
+    for cell in cells:
+        value = cell['total']
+        if metric == 'occupancy':
+            value = round(value / (60 * days), 3)
+        rows.setdefault(cell['provider_id'], [0] * 24)[cell['hour']] = value
+    provider_ids = set(rows) | {total['provider_id'] for total in totals}
+    providers = User.objects.filter(pk__in=provider_ids).order_by('last_name', 'first_name')
+    type_names = appointment_type_names()
+    
+    return JsonResponse({
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat(),
+        'metric': metric,
+        'hours': list(range(24)),
+        'providers': [{'id': provider.pk, 'name': provider.get_full_name()} for provider in providers],
+        'matrix': [rows.get(provider.pk, [0] * 24) for provider in providers],
+        'by_type': [dict(total, appointment_type=type_names.get(total['appointment_type_id'])) for total in totals],
+    })
@@ -0,0 +1,68 @@
+"""
+Coalesced ``UserSession.last_activity`` updates.
+
+Requests only note the time in memory. A session is noted at most once per
+``SESSION_ACTIVITY_FLUSH_SECONDS``, and the noted sessions are written
+together by one UPDATE at most once per interval per process, so page views
+do not each cost a write.
+"""
+
+import atexit
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .models import UserSession
+
+class ActivityTracker:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._noted = {}
+        self._last_flush = time.monotonic()
+
+    def note(self, session_key):
+        """Note activity in memory; returns whether a flush is due."""
+        interval = settings.SESSION_ACTIVITY_FLUSH_SECONDS
+        now = time.monotonic()
+        with self._lock:
+            if now - self._noted.get(session_key, -interval) < interval:
+                return False
+            self._noted[session_key] = now
+            self._pending[session_key] = timezone.now()
+            return now - self._last_flush >= interval
+
+    def touch(self, session_key):
+        if self.note(session_key):
+            self.flush()
+
+    async def atouch(self, session_key):
+        # Only the occasional flush needs a thread
+        if self.note(session_key):
+            await sync_to_async(self.flush)()
+
+    def flush(self):
+        """Write the pending activity times; returns the number of sessions updated."""
+        interval = settings.SESSION_ACTIVITY_FLUSH_SECONDS
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = now = time.monotonic()
+            # Forget sessions that may be noted again anyway
+            self._noted = {key: noted for key, noted in self._noted.items() if now - noted < interval}
+        if not pending:
+            return 0
+        return UserSession.objects.filter(session_key__in=pending, logged_out=False).update(
+            last_activity=Case(
+                *[When(session_key=key, then=Value(seen)) for key, seen in pending.items()],
+                output_field=DateTimeField(),
+            )
+        )
+
+session_activity = ActivityTracker()
+
+atexit.register(session_activity.flush)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AuthenticationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
+
+    def ready(self):
+        from django.contrib.auth.models import update_last_login
+        from django.contrib.auth.signals import user_logged_in
+
+        # Django's version saves the user, which also writes a history row
+        user_logged_in.disconnect(update_last_login, dispatch_uid='update_last_login')
+        from . import signals  # noqa: F401
@@ -0,0 +1,88 @@
+"""
+Buffered writes for login bookkeeping.
+
+Login attempts and new session records are appended to an in-process buffer
+instead of being inserted one by one on the login request. The buffer is
+flushed with one ``bulk_create`` per model when ``LOGIN_AUDIT_BATCH_SIZE``
+records are waiting, ``LOGIN_AUDIT_FLUSH_SECONDS`` after the first record
+arrived, or when the process exits. Records are never updated in the buffer,
+only appended, so a flush is a plain batch insert.
+
+Code that reads these tables right after a login in the same process (the
+sessions page, logout) calls ``login_audit.flush()`` first.
+"""
+
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Records kept when flushes keep failing, so a database outage cannot grow the buffer forever
+MAX_PENDING = 10000
+
+class AuditBuffer:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def append(self, *records):
+        with self._lock:
+            self._pending.extend(records)
+            full = len(self._pending) >= settings.LOGIN_AUDIT_BATCH_SIZE
+            if not full:
+                self._schedule()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Insert every pending record; returns how many were written."""
+        with self._lock:
+            records, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not records:
+            return 0
+
+        by_model = {}
+        for record in records:
+            by_model.setdefault(type(record), []).append(record)
+        written = 0
+        try:
+            for model, objects in by_model.items():
+                model.objects.bulk_create(objects)
+                written += len(objects)
+        except Exception:
+            logger.exception("Flushing %s login audit records failed; keeping them for the next flush", len(records))
+            unwritten = [record for record in records if record.pk is None]
+            with self._lock:
+                self._pending[:0] = unwritten[-MAX_PENDING:]
+                self._schedule()
+        return written
+
+    def _schedule(self):
+        # Called with the lock held
+        if self._timer is None:
+            self._timer = threading.Timer(settings.LOGIN_AUDIT_FLUSH_SECONDS, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread has its own connection; don't leave it open
+            connection.close()
+
+login_audit = AuditBuffer()
+
+atexit.register(login_audit.flush)
@@ -1,25 +1,46 @@
-from django.contrib.auth.decorators import user_passes_test
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.decorators import login_required as sync_login_required
+from django.contrib.auth.views import redirect_to_login
 from django.shortcuts import redirect
 from functools import wraps
 
-def admin_required(view_func):
-    """Decorator for views that require admin privileges."""
-    @wraps(view_func)
-    def _wrapped_view(request, *args, **kwargs):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        if not request.user.is_admin:
-            return redirect('dashboard')
-        return view_func(request, *args, **kwargs)
-    return _wrapped_view
+from .permissions import has_permission
+
+def login_required(view_func):
+    """Django's ``login_required`` for sync and async views alike.
+
+    Django 5.0's only wraps sync views. The async branch reads the user with
+    ``request.auser()`` so the session and user lookups don't block the loop.
+    """
+    if not iscoroutinefunction(view_func):
+        return sync_login_required(view_func)
 
-def medical_staff_required(view_func):
-    """Decorator for views that require medical staff privileges."""
     @wraps(view_func)
-    def _wrapped_view(request, *args, **kwargs):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        if not request.user.is_medical_staff and not request.user.is_admin:
-            return redirect('dashboard')
-        return view_func(request, *args, **kwargs)
+    async def _wrapped_view(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        # request.user caches separately; sync middleware reading it later
+        # would otherwise look the user up again
+        request.user = user
+        return await view_func(request, *args, **kwargs)
     return _wrapped_view
+
+def permission_required(permission):
+    """Decorator for views that require ``permission`` (see authentication.permissions)."""
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return redirect('login')
+            if not has_permission(request.user, permission):
+                return redirect('dashboard')
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+# Decorator for views that require admin privileges
+admin_required = permission_required('users.manage')
+
+# Decorator for views that require medical staff privileges
+medical_staff_required = permission_required('patients.change')
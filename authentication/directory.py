@@ -0,0 +1,80 @@
+"""
+Staff directory queries and bulk account changes.
+
+The directory is paginated and annotates each row with its most recent
+session activity and open session count through correlated subqueries, which
+only run for the rows on the page and are answered from the UserSession
+indexes. Activating or deactivating accounts is a batched
+``bulk_update`` that still writes one history row per changed user.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from simple_history.utils import bulk_update_with_history
+
+from .models import User, UserSession
+
+DIRECTORY_PAGE_SIZE = 25
+
+BULK_BATCH_SIZE = 500
+
+def open_sessions(now=None):
+    """Sessions not logged out and active within the session cookie age."""
+    now = now or timezone.now()
+    return UserSession.objects.filter(
+        logged_out=False, last_activity__gte=now - timedelta(seconds=settings.SESSION_COOKIE_AGE)
+    )
+
+def directory_queryset(query='', role='', status='', now=None):
+    """Users matching the directory filters, with ``last_seen`` and ``active_sessions``."""
+    users = User.objects.all()
+    if role:
+        users = users.filter(role=role)
+    if status == 'active':
+        users = users.filter(is_active=True)
+    elif status == 'inactive':
+        users = users.filter(is_active=False)
+    if query:
+        users = users.filter(
+            Q(first_name__icontains=query) | Q(last_name__icontains=query) | Q(email__icontains=query)
+        )
+
+    sessions = open_sessions(now).filter(user=OuterRef('pk'))
+    return users.annotate(
+        last_seen=Subquery(
+            UserSession.objects.filter(user=OuterRef('pk')).order_by('-last_activity').values('last_activity')[:1]
+        ),
+        active_sessions=Coalesce(
+            Subquery(sessions.order_by().values('user').annotate(count=Count('pk')).values('count')),
+            0,
+            output_field=IntegerField(),
+        ),
+    ).order_by('last_name', 'first_name', 'pk')
+
+def role_counts():
+    """Number of users per role, for the directory's filter tabs, in one query."""
+    return dict(User.objects.order_by().values_list('role').annotate(count=Count('pk')))
+
+def set_users_active(user_ids, is_active, changed_by):
+    """Activate or deactivate users in batches; returns the users that changed.
+
+    Admins cannot deactivate their own account this way.
+    """
+    users = User.objects.filter(pk__in=user_ids).exclude(is_active=is_active)
+    if not is_active:
+        users = users.exclude(pk=changed_by.pk)
+    with transaction.atomic():
+        changed = list(users.select_for_update())
+        for user in changed:
+            user.is_active = is_active
+        bulk_update_with_history(
+            changed, User, ['is_active'], batch_size=BULK_BATCH_SIZE,
+            default_user=changed_by,
+            default_change_reason='Activated by an administrator' if is_active else 'Deactivated by an administrator',
+        )
+    return changed
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from authentication.retention import PURGE_BATCH_SIZE, purge_login_records
+
+class Command(BaseCommand):
+    help = "Drop login attempts and session records past their retention period and roll the monthly tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE, help="Rows per DELETE statement.")
+
+    def handle(self, *args, **options):
+        for model, (dropped, deleted) in purge_login_records(batch_size=options['batch_size']).items():
+            self.stdout.write(f"{model.__name__}: {dropped} monthly tables dropped, {deleted} rows deleted")
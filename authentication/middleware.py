@@ -0,0 +1,49 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .activity import session_activity
+
+# Session entry holding when the session was last saved to slide its expiry
+SESSION_REFRESHED_KEY = '_refreshed_at'
+
+def slide_expiry(session):
+    """Mark ``session`` modified if it was last saved ``SESSION_REFRESH_SECONDS`` ago."""
+    refreshed_at = session.get(SESSION_REFRESHED_KEY)
+    if refreshed_at is None or time.time() - refreshed_at >= settings.SESSION_REFRESH_SECONDS:
+        session[SESSION_REFRESHED_KEY] = time.time()
+
+class SessionActivityMiddleware:
+    """Note each authenticated request against its UserSession (see authentication.activity).
+
+    Also marks the session modified every ``SESSION_REFRESH_SECONDS``, so the
+    session middleware slides its expiry without saving on every request.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        session_key = request.session.session_key
+        if session_key and request.user.is_authenticated:
+            session_activity.touch(session_key)
+            slide_expiry(request.session)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        session_key = request.session.session_key
+        if session_key and (await request.auser()).is_authenticated:
+            await session_activity.atouch(session_key)
+            # auser() has loaded the session, so this doesn't touch the database
+            slide_expiry(request.session)
+        return response
@@ -0,0 +1,88 @@
+# Generated by Django 5.0.1 on 2026-10-19 16:17
+
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+# Tables partitioned by month on PostgreSQL, with their partition key
+PARTITIONED = [
+    ('authentication_loginattempt', 'timestamp'),
+    ('authentication_usersession', 'login_time'),
+]
+
+# Monthly partitions created ahead of the current month (see authentication.retention)
+MONTHS_AHEAD = 2
+
+
+def add_months(moment, months):
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_by_month(apps, schema_editor):
+    """Rebuild the login record tables as monthly range partitions on PostgreSQL.
+
+    The primary key has to include the partition key, and partitioned tables
+    cannot have identity columns, so ids come from a plain sequence instead.
+    Other databases keep ordinary tables (see authentication.retention).
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in PARTITIONED:
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_unpartitioned')
+            cursor.execute(
+                f'CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE ({column})'
+            )
+            cursor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+            cursor.execute(f'SELECT MIN({column}) FROM {table}_unpartitioned')
+            oldest = cursor.fetchone()[0] or datetime.now(timezone.utc)
+            month = add_months(oldest, 0)
+            last = add_months(datetime.now(timezone.utc), MONTHS_AHEAD)
+            while month <= last:
+                cursor.execute(
+                    f"CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+                )
+                month = add_months(month, 1)
+
+            cursor.execute(f'INSERT INTO {table} SELECT * FROM {table}_unpartitioned')
+            cursor.execute(f'DROP TABLE {table}_unpartitioned')
+            cursor.execute(f'CREATE SEQUENCE {table}_id_seq OWNED BY {table}.id')
+            cursor.execute(f"SELECT setval('{table}_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM {table}")
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+            cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, {column})')
+            cursor.execute(
+                f'ALTER TABLE {table} ADD CONSTRAINT {table}_user_id_fk FOREIGN KEY (user_id) '
+                f'REFERENCES authentication_user (id) DEFERRABLE INITIALLY DEFERRED'
+            )
+            cursor.execute(f'CREATE INDEX {table}_user_id_idx ON {table} (user_id)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_last_login_set_on_login'),
+    ]
+
+    operations = [
+        # Not reversed: the partitioned tables work with the earlier schema too
+        migrations.RunPython(partition_by_month, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='loginattempt',
+            index=models.Index(fields=['timestamp'], name='loginattempt_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['session_key', 'user', 'logged_out'], name='usersession_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['user', 'logged_out', '-last_activity'], name='usersession_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['login_time'], name='usersession_login_time_idx'),
+        ),
+    ]
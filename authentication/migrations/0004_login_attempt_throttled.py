@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_login_records_indexes_and_partitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loginattempt',
+            name='throttled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -55,7 +55,8 @@ class User(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     is_active = models.BooleanField(default=True)
     date_joined = models.DateTimeField(auto_now_add=True)
-    last_login = models.DateTimeField(auto_now=True)
+    # Set on login only, by a single-column update (see authentication.signals)
+    last_login = models.DateTimeField(blank=True, null=True)
     
     # Two-factor auth settings
     mfa_enabled = models.BooleanField(default=False)
@@ -103,6 +104,13 @@ class LoginAttempt(models.Model):
     user_agent = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     successful = models.BooleanField(default=False)
+    # Refused by the login throttle without checking the password
+    throttled = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp'], name='loginattempt_timestamp_idx'),
+        ]
 
     def __str__(self):
         return f"Login attempt by {self.email} at {self.timestamp}"
@@ -118,5 +126,14 @@ class UserSession(models.Model):
     last_activity = models.DateTimeField(auto_now=True)
     logged_out = models.BooleanField(default=False)
     
+    class Meta:
+        indexes = [
+            # logout_view and activity flushes look sessions up by key
+            models.Index(fields=['session_key', 'user', 'logged_out'], name='usersession_key_idx'),
+            # SessionsView lists a user's open sessions by recent activity
+            models.Index(fields=['user', 'logged_out', '-last_activity'], name='usersession_active_idx'),
+            models.Index(fields=['login_time'], name='usersession_login_time_idx'),
+        ]
+    
     def __str__(self):
         return f"Session for {self.user.email} started at {self.login_time}"
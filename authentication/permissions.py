@@ -0,0 +1,120 @@
+"""
+Role-based permissions, resolved once per request.
+
+Each role grants a set of permissions (``ROLE_PERMISSIONS``), either over all
+records (``ALL``) or only over records the user owns, named by the relations
+in ``OWNER_FIELDS``. Superusers have every permission.
+
+The set depends only on the user's role and flags, so it is built without
+queries and kept on the user instance for the rest of the request, tagged
+with the role it was built for so a role change is picked up at once.
+
+The same set backs the ``permission_required`` decorator (see
+authentication.decorators), the ``can`` and ``has_permission`` template tags
+and ``filter_queryset``, which turns an owner-scoped grant into a SQL filter
+so list views never fetch rows they would have to drop.
+"""
+
+from django.db.models import Exists, OuterRef, Q
+from django.shortcuts import aget_object_or_404, get_object_or_404
+
+ALL = '*'
+
+# Permissions every staff role has had from the start
+CLINICAL = {
+    'patients.view': ALL,
+    'patients.change': ALL,
+    'appointments.view': ALL,
+    'appointments.change': ALL,
+}
+
+ROLE_PERMISSIONS = {
+    'admin': {**CLINICAL, 'users.manage': ALL, 'reports.view': ALL},
+    'doctor': CLINICAL,
+    'nurse': CLINICAL,
+    'staff': CLINICAL,
+}
+
+# Relations to the user that make a record "owned" for owner-scoped grants
+OWNER_FIELDS = {
+    'appointments.Appointment': ['provider', 'created_by'],
+    'patients.Patient': ['appointments__provider'],
+}
+
+def merge(permissions, grants):
+    for permission, scope in grants.items():
+        current = permissions.get(permission)
+        if current == ALL or scope == ALL:
+            permissions[permission] = ALL
+        else:
+            permissions[permission] = tuple(sorted({*(current or ()), *scope}))
+    return permissions
+
+def resolve_permissions(user):
+    """Build the user's permission map, {permission: ALL or owner fields}."""
+    if not user.is_active:
+        return {}
+    permissions = merge({}, ROLE_PERMISSIONS.get(user.role, {}))
+    if user.is_superuser:
+        merge(permissions, {permission: ALL for grants in ROLE_PERMISSIONS.values() for permission in grants})
+    return permissions
+
+def get_permissions(user):
+    """The user's permission map, resolved at most once per request."""
+    if not user.is_authenticated:
+        return {}
+    state = (user.role, user.is_active, user.is_superuser)
+    resolved = getattr(user, '_role_permissions', None)
+    if resolved is None or resolved[0] != state:
+        resolved = user._role_permissions = (state, resolve_permissions(user))
+    return resolved[1]
+
+def owner_condition(model, user, fields):
+    """Q matching records of ``model`` the user owns through any of ``fields``."""
+    direct = Q()
+    related = Q()
+    for field in fields:
+        if '__' in field:
+            related |= Q(**{field: user})
+        else:
+            direct |= Q(**{field: user})
+    if related:
+        # Relations that fan out are checked with EXISTS so rows aren't repeated
+        direct |= Exists(model._default_manager.filter(related, pk=OuterRef('pk')))
+    return direct
+
+def has_permission(user, permission, obj=None):
+    """Whether ``user`` has ``permission``, over ``obj`` if one is given."""
+    scope = get_permissions(user).get(permission)
+    if scope is None:
+        return False
+    if scope == ALL or obj is None:
+        return True
+    fields = [field for field in scope if field in OWNER_FIELDS.get(obj._meta.label, ())]
+    if not fields:
+        return False
+    return type(obj)._default_manager.filter(owner_condition(type(obj), user, fields), pk=obj.pk).exists()
+
+def filter_queryset(user, queryset, permission):
+    """Narrow ``queryset`` to the records ``user`` has ``permission`` over, in SQL."""
+    scope = get_permissions(user).get(permission)
+    if scope == ALL:
+        return queryset
+    fields = [field for field in scope or () if field in OWNER_FIELDS.get(queryset.model._meta.label, ())]
+    if not fields:
+        return queryset.none()
+    return queryset.filter(owner_condition(queryset.model, user, fields))
+
+def as_queryset(model):
+    return model._default_manager.all() if isinstance(model, type) else model
+
+def get_permitted_or_404(user, permission, model, **lookups):
+    """``get_object_or_404`` over the records ``user`` has ``permission`` over.
+
+    ``model`` may also be a queryset, e.g. one with annotations.
+    """
+    return get_object_or_404(filter_queryset(user, as_queryset(model), permission), **lookups)
+
+async def aget_permitted_or_404(user, permission, model, **lookups):
+    """Async ``get_permitted_or_404``."""
+    return await aget_object_or_404(filter_queryset(user, as_queryset(model), permission), **lookups)
@@ -0,0 +1,182 @@
+"""
+Monthly storage and retention for login attempts and session records.
+
+On PostgreSQL both tables are partitioned by month on their timestamp
+(migration 0003), with a default partition for rows outside the monthly
+ones. Other databases have no partitioning, so closed months are moved out of
+the live tables into one archive table per month instead. Either way a month
+past retention goes with a single DROP TABLE, and only the rows of the month
+the cutoff falls in are deleted row by row, in bounded batches.
+"""
+
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import LoginAttempt, UserSession
+
+PURGE_BATCH_SIZE = 5000
+
+# Monthly partitions created ahead of the current month
+MONTHS_AHEAD = 2
+
+# Months kept in the live tables on databases without partitioning
+LIVE_MONTHS = 2
+
+# Each model with the timestamp its rows are filed under
+RECORDS = [(LoginAttempt, 'timestamp'), (UserSession, 'login_time')]
+
+def retention_days(model):
+    return {
+        LoginAttempt: settings.LOGIN_ATTEMPT_RETENTION_DAYS,
+        UserSession: settings.USER_SESSION_RETENTION_DAYS,
+    }[model]
+
+def month_of(value):
+    return date(value.year, value.month, 1)
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def month_start(month):
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+
+def is_partitioned():
+    return connection.vendor == 'postgresql'
+
+def monthly_prefix(model):
+    return f"{model._meta.db_table}_{'p' if is_partitioned() else 'archive_'}"
+
+def monthly_table(model, month):
+    return f'{monthly_prefix(model)}{month:%Y%m}'
+
+def monthly_tables(model):
+    """{month: table} for the model's monthly partitions or archive tables."""
+    prefix = monthly_prefix(model)
+    if is_partitioned():
+        # Django's introspection leaves partitions out
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass',
+                [model._meta.db_table],
+            )
+            names = [name for name, in cursor.fetchall()]
+    else:
+        names = connection.introspection.table_names()
+    tables = {}
+    for name in names:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            tables[date(int(suffix[:4]), int(suffix[4:]), 1)] = name
+    return tables
+
+def db_datetime(value):
+    return str(connection.ops.adapt_datetimefield_value(value))
+
+def before(column, moment):
+    return f"{connection.ops.quote_name(column)} < '{db_datetime(moment)}'"
+
+def within(column, month):
+    start, end = month_start(month), month_start(add_months(month, 1))
+    return f"{connection.ops.quote_name(column)} >= '{db_datetime(start)}' AND {before(column, end)}"
+
+def batch_ceiling(cursor, table, condition, batch_size):
+    """Id of the last of the first ``batch_size`` matching rows, so each batch statement is bounded."""
+    cursor.execute(f'SELECT id FROM {table} WHERE {condition} ORDER BY id LIMIT 1 OFFSET %s', [batch_size - 1])
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(f'SELECT MAX(id) FROM {table} WHERE {condition}')
+        row = cursor.fetchone()
+    return row[0]
+
+def delete_batched(table, condition, batch_size=PURGE_BATCH_SIZE):
+    table = connection.ops.quote_name(table)
+    deleted = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            ceiling = batch_ceiling(cursor, table, condition, batch_size)
+            if ceiling is None:
+                return deleted
+            cursor.execute(f'DELETE FROM {table} WHERE {condition} AND id <= %s', [ceiling])
+            deleted += cursor.rowcount
+
+def create_partition(model, column, month):
+    """Add the monthly partition for ``month``, moving its rows out of the default partition."""
+    qn = connection.ops.quote_name
+    table, default = model._meta.db_table, f'{model._meta.db_table}_default'
+    condition = within(column, month)
+    bounds = f"FROM ('{db_datetime(month_start(month))}') TO ('{db_datetime(month_start(add_months(month, 1)))}')"
+    partition = f'CREATE TABLE {qn(monthly_table(model, month))} PARTITION OF {qn(table)} FOR VALUES {bounds}'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT 1 FROM {qn(default)} WHERE {condition} LIMIT 1')
+        if cursor.fetchone() is None:
+            cursor.execute(partition)
+            return
+        # A new partition may not overlap rows already in the default one
+        cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(default)}')
+        cursor.execute(partition)
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(default)} WHERE {condition}')
+        cursor.execute(f'DELETE FROM {qn(default)} WHERE {condition}')
+        cursor.execute(f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(default)} DEFAULT')
+
+def ensure_partitions(model, column, today):
+    existing = monthly_tables(model)
+    for months in range(MONTHS_AHEAD + 1):
+        month = add_months(month_of(today), months)
+        if month not in existing:
+            create_partition(model, column, month)
+
+def archive_closed_months(model, column, today, batch_size=PURGE_BATCH_SIZE):
+    """Move rows older than the last ``LIVE_MONTHS`` months into monthly archive tables."""
+    qn = connection.ops.quote_name
+    live_from = add_months(month_of(today), 1 - LIVE_MONTHS)
+    oldest = model.objects.filter(**{f'{column}__lt': month_start(live_from)}).aggregate(oldest=Min(column))['oldest']
+    if oldest is None:
+        return 0
+    table = qn(model._meta.db_table)
+    moved = 0
+    month = month_of(oldest)
+    while month < live_from:
+        archive, condition = qn(monthly_table(model, month)), within(column, month)
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {archive} AS SELECT * FROM {table} WHERE 1 = 0')
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                ceiling = batch_ceiling(cursor, table, condition, batch_size)
+                if ceiling is None:
+                    break
+                cursor.execute(f'INSERT INTO {archive} SELECT * FROM {table} WHERE {condition} AND id <= %s', [ceiling])
+                cursor.execute(f'DELETE FROM {table} WHERE {condition} AND id <= %s', [ceiling])
+                moved += cursor.rowcount
+        month = add_months(month, 1)
+    return moved
+
+def purge_login_records(now=None, batch_size=PURGE_BATCH_SIZE):
+    """Apply retention to login attempts and session records.
+
+    Returns {model: (monthly tables dropped, rows deleted)}.
+    """
+    now = now or timezone.now()
+    results = {}
+    for model, column in RECORDS:
+        cutoff = now - timedelta(days=retention_days(model))
+        dropped = deleted = 0
+        with connection.cursor() as cursor:
+            for month, table in sorted(monthly_tables(model).items()):
+                if month_start(add_months(month, 1)) <= cutoff:
+                    cursor.execute(f'DROP TABLE {connection.ops.quote_name(table)}')
+                    dropped += 1
+                elif month_start(month) < cutoff and not is_partitioned():
+                    deleted += delete_batched(table, before(column, cutoff), batch_size)
+
+        deleted += delete_batched(model._meta.db_table, before(column, cutoff), batch_size)
+        if is_partitioned():
+            ensure_partitions(model, column, now.date())
+        else:
+            archive_closed_months(model, column, now.date(), batch_size)
+        results[model] = (dropped, deleted)
+    return results
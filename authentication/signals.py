@@ -0,0 +1,15 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import User
+
+@receiver(user_logged_in)
+def update_last_login(sender, request, user, **kwargs):
+    """Write only last_login, without a full save() or a HistoricalUser row.
+    
+    Replaces django.contrib.auth's receiver of the same name, which is
+    disconnected in AuthenticationConfig.ready().
+    """
+    user.last_login = timezone.now()
+    User.objects.filter(pk=user.pk).update(last_login=user.last_login)
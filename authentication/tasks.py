@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import send_mail
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from jobs.queue import task
+from . import retention
+from .models import User
+
+@task(executor='thread', max_attempts=5)
+def send_password_reset_email(user_id, base_url):
+    """E-mail a password reset link; ``base_url`` is the site's scheme and host."""
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if user is None:
+        return
+    
+    uid = urlsafe_base64_encode(force_bytes(user.pk))
+    token = default_token_generator.make_token(user)
+    reset_url = base_url.rstrip('/') + reverse('password_reset_confirm', args=[uid, token])
+    send_mail(
+        'DocsDash password reset',
+        f"Hello {user.first_name},\n\nUse the link below to choose a new password:\n\n{reset_url}\n\n"
+        f"If you did not request a password reset you can ignore this e-mail.",
+        None,
+        [user.email],
+    )
+
+@task(schedule=timedelta(days=1))
+def purge_login_records():
+    """Apply retention to login attempts and session records, and add next months' partitions."""
+    retention.purge_login_records()
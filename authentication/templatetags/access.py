@@ -0,0 +1,15 @@
+from django import template
+
+from authentication.permissions import has_permission as user_has_permission
+
+register = template.Library()
+
+@register.filter
+def has_permission(user, permission):
+    """``{% if user|has_permission:'users.manage' %}``"""
+    return user_has_permission(user, permission)
+
+@register.simple_tag
+def can(user, permission, obj=None):
+    """``{% can user 'appointments.change' appointment as can_edit %}``"""
+    return user_has_permission(user, permission, obj)
@@ -1,3 +1,334 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest import mock, skipIf, skipUnless
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import directory, retention, throttle
+from .activity import session_activity
+from .middleware import SESSION_REFRESHED_KEY
+from .audit import login_audit
+from .models import LoginAttempt, User, UserSession
+
+
+class LoginAuditTests(TestCase):
+    """Logins only hash the password inline; the bookkeeping is batched."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='doctor@example.com', password='correct-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        login_audit.flush()
+
+    def log_in(self, password='correct-password'):
+        return self.client.post(reverse('login'), {'email': 'doctor@example.com', 'password': password})
+
+    def test_login_updates_last_login_without_history(self):
+        history_rows = self.user.history.count()
+
+        self.log_in()
+
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(self.user.history.count(), history_rows)
+
+    def test_audit_rows_are_buffered_until_flushed(self):
+        self.log_in()
+        self.assertFalse(LoginAttempt.objects.exists())
+
+        self.assertEqual(login_audit.flush(), 2)
+
+        attempt = LoginAttempt.objects.get()
+        self.assertTrue(attempt.successful)
+        self.assertEqual(attempt.user, self.user)
+        self.assertEqual(UserSession.objects.get().session_key, self.client.session.session_key)
+
+    @override_settings(LOGIN_AUDIT_BATCH_SIZE=2)
+    def test_full_batch_is_flushed_inline(self):
+        self.log_in('wrong-password')
+        self.assertEqual(len(login_audit), 1)
+
+        self.log_in('wrong-password')
+
+        self.assertEqual(len(login_audit), 0)
+        self.assertEqual(LoginAttempt.objects.filter(successful=False).count(), 2)
+
+    def test_logout_closes_a_still_buffered_session(self):
+        self.log_in()
+
+        self.client.get(reverse('logout'))
+
+        self.assertTrue(UserSession.objects.get().logged_out)
+
+
+@override_settings(LOGIN_THROTTLE_EMAIL_LIMIT=3, LOGIN_LOCKOUT_BASE_SECONDS=60)
+class LoginThrottleTests(TestCase):
+    """Repeated failures lock out the e-mail before any password is hashed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='doctor@example.com', password='correct-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        login_audit.flush()
+
+    def log_in(self, password='wrong-password', email='doctor@example.com'):
+        return self.client.post(reverse('login'), {'email': email, 'password': password})
+
+    def test_lockout_skips_authenticate(self):
+        for email in ('doctor@example.com', 'Doctor@example.com', 'DOCTOR@example.com'):
+            self.assertEqual(self.log_in(email=email).status_code, 200)
+
+        with mock.patch('authentication.views.authenticate') as authenticate:
+            response = self.log_in('correct-password')
+
+        authenticate.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+
+    def test_repeat_lockouts_double(self):
+        now = 1_000_000.0
+        for expected in (60, 120, 240):
+            for _ in range(3):
+                throttle.record_failure('10.0.0.1', 'doctor@example.com', now)
+            self.assertEqual(throttle.check('10.0.0.1', 'doctor@example.com', now), expected)
+            now += expected
+
+    def test_success_clears_the_failure_count(self):
+        self.log_in()
+        self.log_in()
+        self.assertEqual(self.log_in('correct-password').status_code, 302)
+        self.client.logout()
+
+        self.log_in()
+        self.assertEqual(throttle.check('127.0.0.1', 'doctor@example.com'), 0)
+
+    def test_counters_are_rebuilt_from_login_attempts(self):
+        LoginAttempt.objects.bulk_create([
+            LoginAttempt(email='doctor@example.com', ip_address='10.0.0.1', user_agent='test') for _ in range(3)
+        ])
+        cache.clear()
+
+        self.assertGreater(throttle.check('10.0.0.2', 'doctor@example.com'), 0)
+        self.assertEqual(throttle.check('10.0.0.2', 'nurse@example.com'), 0)
+
+    def test_rebuilding_skips_throttled_attempts_and_ended_lockouts(self):
+        for _ in range(3):
+            self.log_in()
+        self.assertEqual(self.log_in().status_code, 429)
+        login_audit.flush()
+        self.assertEqual(LoginAttempt.objects.filter(throttled=True).count(), 1)
+        cache.clear()
+
+        # Waiting out the lockout isn't counted as more failures
+        after_lockout = time.time() + 61
+        self.assertEqual(throttle.check('10.0.0.2', 'doctor@example.com', after_lockout), 0)
+        throttle.record_failure('10.0.0.2', 'doctor@example.com', after_lockout)
+        self.assertEqual(throttle.check('10.0.0.2', 'doctor@example.com', after_lockout), 0)
+
+
+class SessionActivityTests(TestCase):
+    """Page views note activity in memory; last_activity is written in batches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='doctor@example.com', password='correct-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+
+    def setUp(self):
+        cache.clear()
+        session_activity.flush()
+        self.client.force_login(self.user)
+        self.session = UserSession.objects.create(
+            user=self.user, session_key=self.client.session.session_key, ip_address='127.0.0.1', user_agent='test'
+        )
+        UserSession.objects.filter(pk=self.session.pk).update(last_activity=timezone.now() - timedelta(hours=1))
+
+    def tearDown(self):
+        session_activity.flush()
+
+    def test_requests_are_coalesced_into_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(3):
+                self.client.get(reverse('dashboard'))
+        self.assertFalse([q for q in queries if 'UPDATE "authentication_usersession"' in q['sql']])
+
+        self.assertEqual(session_activity.flush(), 1)
+        self.session.refresh_from_db()
+        self.assertGreater(self.session.last_activity, timezone.now() - timedelta(minutes=1))
+
+        # Noted once per interval, so the next request has nothing to add
+        self.client.get(reverse('dashboard'))
+        self.assertEqual(session_activity.flush(), 0)
+
+    def test_sessions_are_saved_only_to_slide_the_expiry(self):
+        def session_writes():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('dashboard'))
+            return [q for q in queries if q['sql'].startswith(('INSERT INTO "django_session"', 'UPDATE "django_session"'))]
+
+        self.assertTrue(session_writes())
+        self.assertEqual(session_writes(), [])
+
+        session = self.client.session
+        session[SESSION_REFRESHED_KEY] -= 300
+        session.save()
+        self.assertTrue(session_writes())
+
+    @override_settings(SESSION_ACTIVITY_FLUSH_SECONDS=0)
+    def test_logged_out_sessions_are_left_alone(self):
+        UserSession.objects.filter(pk=self.session.pk).update(logged_out=True)
+        before = UserSession.objects.get(pk=self.session.pk).last_activity
+
+        self.client.get(reverse('dashboard'))
+
+        self.assertEqual(UserSession.objects.get(pk=self.session.pk).last_activity, before)
+
+
+class ThemeToggleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+
+    async def test_theme_is_toggled_and_saved(self):
+        user = self.user
+        await self.async_client.aforce_login(user)
+
+        response = await self.async_client.post(reverse('toggle_theme'))
+
+        await user.arefresh_from_db()
+        self.assertEqual(response.json(), {'success': True, 'dark_theme': user.use_dark_theme})
+        self.assertTrue(user.use_dark_theme)
+
+
+@override_settings(LOGIN_ATTEMPT_RETENTION_DAYS=90)
+class LoginRecordRetentionTests(TestCase):
+    """Expired login records go a month at a time, or in bounded batches."""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def attempt(self, days_ago):
+        attempt = LoginAttempt.objects.create(email='doctor@example.com', ip_address='10.0.0.1', user_agent='test')
+        LoginAttempt.objects.filter(pk=attempt.pk).update(timestamp=self.now - timedelta(days=days_ago))
+        return attempt
+
+    def count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0]
+
+    def test_expired_attempts_are_deleted_in_batches(self):
+        expired = [self.attempt(days_ago) for days_ago in (91, 92, 93, 94, 95)]
+        kept = self.attempt(1)
+
+        results = retention.purge_login_records(self.now, batch_size=2)
+
+        self.assertEqual(results[LoginAttempt], (0, len(expired)))
+        self.assertEqual(list(LoginAttempt.objects.values_list('pk', flat=True)), [kept.pk])
+
+    @skipIf(connection.vendor == 'postgresql', "Closed months are archived only without partitioning")
+    def test_closed_months_move_to_archive_tables(self):
+        month = retention.add_months(retention.month_of(self.now), -2)
+        old = self.attempt((self.now.date() - month).days - 1)
+        self.attempt(1)
+
+        retention.purge_login_records(self.now)
+
+        self.assertFalse(LoginAttempt.objects.filter(pk=old.pk).exists())
+        self.assertEqual(self.count(retention.monthly_tables(LoginAttempt)[month]), 1)
+
+        # Once the whole month is past retention its table is dropped
+        results = retention.purge_login_records(self.now + timedelta(days=150))
+        self.assertNotIn(month, retention.monthly_tables(LoginAttempt))
+        self.assertEqual(results[LoginAttempt][0], 1)
+
+    @skipUnless(connection.vendor == 'postgresql', "Needs PostgreSQL partitioning")
+    def test_months_are_partitions_dropped_whole(self):
+        month = retention.add_months(retention.month_of(self.now), -4)
+        old = self.attempt((self.now.date() - month).days - 1)
+        self.assertIn(retention.month_of(self.now), retention.monthly_tables(LoginAttempt))
+
+        # Rows that landed in the default partition move into the new monthly one
+        retention.create_partition(LoginAttempt, 'timestamp', month)
+        self.assertEqual(self.count(retention.monthly_table(LoginAttempt, month)), 1)
+        self.assertEqual(self.count('authentication_loginattempt_default'), 0)
+
+        # Fire the deferred FK checks a real purge would find already done
+        connection.check_constraints()
+        results = retention.purge_login_records(self.now)
+
+        self.assertEqual(results[LoginAttempt], (1, 0))
+        self.assertFalse(LoginAttempt.objects.filter(pk=old.pk).exists())
+        self.assertNotIn(month, retention.monthly_tables(LoginAttempt))
+
+
+class UserDirectoryTests(TestCase):
+    """The staff directory annotates users in one query and changes them in bulk."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            email='admin@example.com', password='correct-password', first_name='Ada', last_name='Admin', role='admin'
+        )
+        cls.nurses = [
+            User.objects.create_user(
+                email=f'nurse{number}@example.com', password='correct-password',
+                first_name='Nina', last_name=f'Nurse {number}', role='nurse',
+            )
+            for number in range(3)
+        ]
+        UserSession.objects.bulk_create([
+            UserSession(user=cls.nurses[0], session_key='a' * 40, ip_address='10.0.0.1', user_agent='test'),
+            UserSession(user=cls.nurses[0], session_key='b' * 40, ip_address='10.0.0.1', user_agent='test'),
+            UserSession(user=cls.nurses[1], session_key='c' * 40, ip_address='10.0.0.1', user_agent='test', logged_out=True),
+        ])
+
+    def test_annotations_come_from_one_query(self):
+        with self.assertNumQueries(1):
+            users = {user.email: user for user in directory.directory_queryset(role='nurse')}
+
+        self.assertEqual(len(users), 3)
+        self.assertEqual(users['nurse0@example.com'].active_sessions, 2)
+        self.assertEqual(users['nurse1@example.com'].active_sessions, 0)
+        self.assertIsNotNone(users['nurse1@example.com'].last_seen)
+        self.assertIsNone(users['nurse2@example.com'].last_seen)
+
+    def test_search_matches_name_and_email(self):
+        self.assertEqual(
+            list(directory.directory_queryset('nurse 2').values_list('email', flat=True)), ['nurse2@example.com']
+        )
+        self.assertEqual(directory.directory_queryset('ADMIN@').get(), self.admin)
+
+    def test_bulk_deactivate_writes_history_and_skips_self(self):
+        self.client.force_login(self.admin)
+        user_ids = [self.admin.pk] + [nurse.pk for nurse in self.nurses[:2]]
+
+        response = self.client.post(reverse('bulk_user_action'), {'action': 'deactivate', 'user_ids': user_ids})
+
+        self.assertRedirects(response, reverse('user_management'), fetch_redirect_response=False)
+        self.assertEqual(set(User.objects.filter(is_active=False)), set(self.nurses[:2]))
+        history = self.nurses[0].history.first()
+        self.assertFalse(history.is_active)
+        self.assertEqual(history.history_user, self.admin)
 
-# Create your tests here.
@@ -0,0 +1,138 @@
+"""
+Login throttling by client IP and by e-mail address.
+
+Failed logins are counted in the cache with sliding-window counters: each
+key has a counter per fixed window, and the current count is this window's
+counter plus the previous window's weighted by how much of it still overlaps
+the sliding window. When a key goes over its limit it is locked out, for
+``LOGIN_LOCKOUT_BASE_SECONDS`` at first and twice as long on each repeat,
+up to ``LOGIN_LOCKOUT_MAX_SECONDS``.
+
+``check`` runs before ``authenticate()``, so a locked-out client costs a few
+cache reads instead of a password hash. If the cache has lost the counters,
+they are rebuilt from recent LoginAttempt rows on the next check.
+
+The counters only limit clients across workers when the cache is shared
+(``SHARED_CACHE``). With each process's own in-memory cache, every worker
+counts separately and the effective limits are multiplied by their number.
+"""
+
+import hashlib
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import LoginAttempt
+
+WARM_KEY = 'login-throttle:warm'
+
+# Lockout levels are forgotten after a day without lockouts
+LEVEL_TIMEOUT = 60 * 60 * 24
+
+def limits():
+    return {'ip': settings.LOGIN_THROTTLE_IP_LIMIT, 'email': settings.LOGIN_THROTTLE_EMAIL_LIMIT}
+
+def throttle_key(scope, value):
+    digest = hashlib.sha256(value.strip().lower().encode()).hexdigest()[:32]
+    return f'login-throttle:{scope}:{digest}'
+
+def identities(ip_address, email):
+    return [('ip', throttle_key('ip', ip_address)), ('email', throttle_key('email', email))]
+
+def window_position(now):
+    window = settings.LOGIN_THROTTLE_WINDOW_SECONDS
+    return int(now // window), (now % window) / window
+
+def sliding_count(current, previous, elapsed):
+    return current + previous * (1 - elapsed)
+
+def check(ip_address, email, now=None):
+    """Seconds the client must wait before trying again, or 0."""
+    now = now or time.time()
+    if cache.get(WARM_KEY) is None:
+        warm_start(now)
+    keys = [f'{key}:locked' for scope, key in identities(ip_address, email)]
+    locked_until = max(cache.get_many(keys).values(), default=0)
+    return max(0, int(locked_until - now + 0.999))
+
+def record_failure(ip_address, email, now=None):
+    """Count a failed login and lock out any key that went over its limit."""
+    now = now or time.time()
+    bucket, elapsed = window_position(now)
+    window = settings.LOGIN_THROTTLE_WINDOW_SECONDS
+    for scope, key in identities(ip_address, email):
+        current_key = f'{key}:{bucket}'
+        cache.add(current_key, 0, 2 * window)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:
+            cache.set(current_key, 1, 2 * window)
+            current = 1
+        previous = cache.get(f'{key}:{bucket - 1}', 0)
+        if sliding_count(current, previous, elapsed) >= limits()[scope]:
+            lock_out(key, now)
+
+def lockout_seconds(level):
+    return min(settings.LOGIN_LOCKOUT_BASE_SECONDS * 2 ** level, settings.LOGIN_LOCKOUT_MAX_SECONDS)
+
+def lock_out(key, now):
+    level = cache.get(f'{key}:level', 0)
+    duration = lockout_seconds(level)
+    cache.set(f'{key}:locked', now + duration, duration)
+    cache.set(f'{key}:level', level + 1, LEVEL_TIMEOUT)
+    # Start counting afresh once the lockout ends
+    bucket, _ = window_position(now)
+    cache.delete_many([f'{key}:{bucket}', f'{key}:{bucket - 1}'])
+
+def record_success(email):
+    """A correct password clears the account's failure count and lockout level."""
+    key = throttle_key('email', email)
+    bucket, _ = window_position(time.time())
+    cache.delete_many([f'{key}:{bucket}', f'{key}:{bucket - 1}', f'{key}:level'])
+
+def warm_start(now=None):
+    """Rebuild the counters and lockouts from LoginAttempt rows of the last two windows.
+
+    The attempts are replayed in order, the way ``record_failure`` and
+    ``record_success`` counted them, so a lockout that has already ended is
+    not imposed again. Attempts refused while locked out never reached a
+    password check and are skipped.
+    """
+    now = now or time.time()
+    window = settings.LOGIN_THROTTLE_WINDOW_SECONDS
+    bucket, _ = window_position(now)
+    since = datetime.fromtimestamp((bucket - 1) * window, tz=dt_timezone.utc)
+
+    counts = Counter()
+    levels = Counter()
+    locked_until = {}
+    attempts = LoginAttempt.objects.filter(throttled=False, timestamp__gte=since).order_by('timestamp')
+    for ip_address, email, successful, timestamp in attempts.values_list(
+        'ip_address', 'email', 'successful', 'timestamp'
+    ).iterator():
+        attempt_bucket, elapsed = window_position(timestamp.timestamp())
+        if successful:
+            key = throttle_key('email', email)
+            del counts[key, attempt_bucket], counts[key, attempt_bucket - 1], levels[key]
+            continue
+        for scope, key in identities(ip_address or '', email):
+            counts[key, attempt_bucket] += 1
+            if sliding_count(counts[key, attempt_bucket], counts[key, attempt_bucket - 1], elapsed) >= limits()[scope]:
+                locked_until[key] = timestamp.timestamp() + lockout_seconds(levels[key])
+                levels[key] += 1
+                del counts[key, attempt_bucket], counts[key, attempt_bucket - 1]
+
+    cache.set_many(
+        {f'{key}:{attempt_bucket}': count for (key, attempt_bucket), count in counts.items() if count},
+        2 * window,
+    )
+    for key, until in locked_until.items():
+        if until > now:
+            cache.set(f'{key}:locked', until, until - now)
+    for key, level in levels.items():
+        if level:
+            cache.add(f'{key}:level', level, LEVEL_TIMEOUT)
+    cache.set(WARM_KEY, True, None)
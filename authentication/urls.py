@@ -1,5 +1,5 @@
 from django.urls import path
-from django.contrib.auth.views import PasswordChangeView
+from django.contrib.auth.views import PasswordChangeView, PasswordResetConfirmView
 from . import views
 from .forms import PasswordChangeCustomForm
 
@@ -9,6 +9,10 @@ urlpatterns = [
     path('signup/', views.signup_view, name='signup'),
     path('profile/', views.profile_view, name='profile'),
     path('password-reset/', views.password_reset_view, name='password_reset'),
+    path('password-reset/<uidb64>/<token>/', PasswordResetConfirmView.as_view(
+        template_name='authentication/password_reset_confirm.html',
+        success_url='/auth/login/'
+    ), name='password_reset_confirm'),
     path('password-change/', PasswordChangeView.as_view(
         template_name='authentication/password_change.html',
         form_class=PasswordChangeCustomForm,
@@ -16,6 +20,7 @@ urlpatterns = [
     ), name='password_change'),
     path('user-management/', views.user_management_view, name='user_management'),
     path('toggle-user-status/<int:user_id>/', views.toggle_user_status, name='toggle_user_status'),
+    path('user-management/bulk-action/', views.bulk_user_action, name='bulk_user_action'),
     path('toggle-theme/', views.toggle_theme, name='toggle_theme'),
     path('sessions/', views.SessionsView.as_view(), name='sessions'),
     path('end-session/<int:session_id>/', views.end_session, name='end_session'),
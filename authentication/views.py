@@ -2,10 +2,11 @@ from django.shortcuts import render
 
 # Create your views here.
 from django.contrib.auth import login, logout, authenticate
-from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.paginator import Paginator
 from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
+from django.views.decorators.http import require_POST
 from django.views.generic import FormView, UpdateView, TemplateView
 from django.contrib import messages
 from django.utils import timezone
@@ -14,7 +15,12 @@ from django.conf import settings
 
 from .forms import LoginForm, SignupForm, ProfileForm, PasswordResetForm
 from .models import User, LoginAttempt, UserSession
-from .decorators import admin_required
+from . import directory, throttle
+from .activity import session_activity
+from .audit import login_audit
+from .decorators import admin_required, login_required
+from .tasks import send_password_reset_email
+from jobs.queue import enqueue
 
 def login_view(request):
     """Handle user login with security features."""
@@ -27,38 +33,47 @@ def login_view(request):
             email = form.cleaned_data['email']
             password = form.cleaned_data['password']
             
+            ip_address = request.META.get('REMOTE_ADDR', '')
+            
             # Record login attempt
             login_attempt = LoginAttempt(
                 email=email,
-                ip_address=request.META.get('REMOTE_ADDR', ''),
+                ip_address=ip_address,
                 user_agent=request.META.get('HTTP_USER_AGENT', '')
             )
             
+            # Refuse throttled clients before paying for a password hash
+            retry_after = throttle.check(ip_address, email)
+            if retry_after:
+                login_attempt.throttled = True
+                login_audit.append(login_attempt)
+                messages.error(request, f'Too many failed login attempts. Try again in {(retry_after + 59) // 60} minute(s).')
+                response = render(request, 'authentication/login.html', {'form': form}, status=429)
+                response['Retry-After'] = str(retry_after)
+                return response
+            
             user = authenticate(request, username=email, password=password)
             if user is not None:
-                # Successful login
+                # Successful login; last_login is updated by the user_logged_in receiver
                 login(request, user)
+                throttle.record_success(email)
                 login_attempt.user = user
                 login_attempt.successful = True
-                login_attempt.save()
                 
-                # Create user session
-                UserSession.objects.create(
+                # Audit rows are buffered and inserted in batches
+                login_audit.append(login_attempt, UserSession(
                     user=user,
                     session_key=request.session.session_key,
-                    ip_address=request.META.get('REMOTE_ADDR', ''),
+                    ip_address=ip_address,
                     user_agent=request.META.get('HTTP_USER_AGENT', '')
-                )
-                
-                # Update last login time
-                user.last_login = timezone.now()
-                user.save()
+                ))
                 
                 next_url = request.GET.get('next', 'dashboard')
                 return redirect(next_url)
             else:
                 # Failed login
-                login_attempt.save()
+                throttle.record_failure(ip_address, email)
+                login_audit.append(login_attempt)
                 messages.error(request, 'Invalid email or password')
     else:
         form = LoginForm()
@@ -68,7 +83,8 @@ def login_view(request):
 def logout_view(request):
     """Handle user logout."""
     if request.user.is_authenticated:
-        # Update user session record
+        # Update user session record, which may still be waiting in the audit buffer
+        login_audit.flush()
         UserSession.objects.filter(
             user=request.user,
             session_key=request.session.session_key,
@@ -113,8 +129,10 @@ def password_reset_view(request):
         form = PasswordResetForm(request.POST)
         if form.is_valid():
             email = form.cleaned_data['email']
-            # In a real app, this would send an email with a reset link
-            # For this demo, we'll just show a success message
+            user = User.objects.filter(email__iexact=email, is_active=True).first()
+            if user is not None:
+                enqueue(send_password_reset_email, user.pk, request.build_absolute_uri('/'))
+            # Same message either way so the form does not reveal which emails exist
             messages.success(request, 'Password reset link sent to your email')
             return redirect('login')
     else:
@@ -124,30 +142,67 @@ def password_reset_view(request):
 
 @admin_required
 def user_management_view(request):
-    """View for managing users (admin only)."""
-    users = User.objects.all()
-    return render(request, 'authentication/user_management.html', {'users': users})
+    """Paginated, searchable staff directory (admin only)."""
+    query = request.GET.get('q', '')
+    role = request.GET.get('role', '')
+    status = request.GET.get('status', '')
+    
+    users = directory.directory_queryset(query, role, status)
+    
+    # Pagination; the per-user annotations only run for the page shown
+    paginator = Paginator(users, directory.DIRECTORY_PAGE_SIZE)
+    page_obj = paginator.get_page(request.GET.get('page', 1))
+    
+    context = {
+        'page_obj': page_obj,
+        'users': page_obj.object_list,
+        'query': query,
+        'role': role,
+        'status': status,
+        'roles': User.ROLES,
+        'role_counts': directory.role_counts(),
+    }
+    return render(request, 'authentication/user_management.html', context)
 
 @admin_required
 def toggle_user_status(request, user_id):
     """Toggle a user's active status (admin only)."""
-    try:
-        user = User.objects.get(id=user_id)
-        user.is_active = not user.is_active
-        user.save()
-        status = 'activated' if user.is_active else 'deactivated'
-        messages.success(request, f'User {user.email} {status}')
-    except User.DoesNotExist:
+    user = User.objects.filter(id=user_id).values('email', 'is_active').first()
+    if user is None:
         messages.error(request, 'User not found')
+        return redirect('user_management')
+    
+    if directory.set_users_active([user_id], not user['is_active'], request.user):
+        status = 'deactivated' if user['is_active'] else 'activated'
+        messages.success(request, f"User {user['email']} {status}")
+    else:
+        messages.error(request, 'You cannot deactivate your own account')
+    
+    return redirect('user_management')
+
+@admin_required
+@require_POST
+def bulk_user_action(request):
+    """Activate or deactivate the selected users (admin only)."""
+    action = request.POST.get('action')
+    user_ids = request.POST.getlist('user_ids')
+    
+    if not user_ids:
+        messages.warning(request, 'No users selected.')
+    elif action in ('activate', 'deactivate'):
+        changed = directory.set_users_active(user_ids, action == 'activate', request.user)
+        messages.success(request, f'{len(changed)} users {action}d.')
+    else:
+        messages.error(request, 'Invalid action.')
     
     return redirect('user_management')
 
 @login_required
-def toggle_theme(request):
+async def toggle_theme(request):
     """Toggle between light and dark themes."""
-    user = request.user
+    user = await request.auser()
     user.use_dark_theme = not user.use_dark_theme
-    user.save()
+    await user.asave()
     
     return JsonResponse({'success': True, 'dark_theme': user.use_dark_theme})
 
@@ -156,6 +211,8 @@ class SessionsView(LoginRequiredMixin, TemplateView):
     template_name = 'authentication/sessions.html'
     
     def get_context_data(self, **kwargs):
+        login_audit.flush()
+        session_activity.flush()
         context = super().get_context_data(**kwargs)
         context['active_sessions'] = UserSession.objects.filter(
             user=self.request.user,
@@ -0,0 +1,224 @@
+"""
+Rule-based alert engine behind the dashboard's alerts panel.
+
+Each rule names the records it watches and turns a matching record into one
+alert per recipient. ``refresh_alerts`` reconciles a rule's desired alerts with
+the open ``Alert`` rows: new matches are created, changed ones updated and
+alerts whose record no longer matches are resolved. Signals refresh single
+records as they are saved; the ``sweep_alerts`` command runs every rule over
+all records to catch alerts that only become due with the passage of time.
+"""
+
+import re
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.models import Appointment, FollowUp, LabOrder
+from patients.models import Medication, VitalSigns
+from .models import Alert
+
+AlertSpec = namedtuple('AlertSpec', ['source_id', 'user_id', 'patient_id', 'severity', 'title', 'message', 'url'])
+
+TIME_FRAME_PATTERN = re.compile(r'(\d+)\s*(day|week|month|year)s?', re.IGNORECASE)
+TIME_FRAME_DAYS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+
+# (field, label, low, high): values outside [low, high] are abnormal
+VITAL_SIGN_LIMITS = (
+    ('temperature', 'Temperature', 35.0, 39.0),
+    ('heart_rate', 'Heart rate', 40, 120),
+    ('blood_pressure_systolic', 'Systolic BP', 90, 180),
+    ('blood_pressure_diastolic', 'Diastolic BP', 50, 120),
+    ('respiratory_rate', 'Respiratory rate', 8, 30),
+    ('oxygen_saturation', 'SpO2', 90, 100),
+)
+
+SWEEP_CHUNK_SIZE = 2000
+
+def parse_time_frame(text):
+    """Convert a free-text time frame such as "2 weeks" into a timedelta."""
+    match = TIME_FRAME_PATTERN.search(text or '')
+    if not match:
+        return None
+    return timedelta(days=int(match.group(1)) * TIME_FRAME_DAYS[match.group(2).lower()])
+
+def latest_provider(patient_ref):
+    """Subquery for the provider of the patient's most recent appointment."""
+    return Subquery(
+        Appointment.objects.filter(patient=patient_ref).order_by('-start_time').values('provider_id')[:1]
+    )
+
+class AlertRule:
+    """Base class: subclasses define the watched records and how they alert."""
+
+    kind = None
+    # Field on the candidate rows that identifies the alert source
+    source_field = 'pk'
+
+    def candidates(self):
+        raise NotImplementedError
+
+    def evaluate(self, obj, now):
+        """Return the AlertSpecs ``obj`` currently warrants."""
+        raise NotImplementedError
+
+class OverdueFollowUpRule(AlertRule):
+    kind = 'overdue_follow_up'
+
+    def candidates(self):
+        return FollowUp.objects.filter(is_scheduled=False).select_related('appointment__patient')
+
+    def evaluate(self, follow_up, now):
+        time_frame = parse_time_frame(follow_up.recommended_time_frame)
+        appointment = follow_up.appointment
+        if time_frame is None or appointment.start_time + time_frame > now:
+            return []
+        due = timezone.localtime(appointment.start_time + time_frame).date()
+        return [AlertSpec(
+            source_id=follow_up.pk,
+            user_id=appointment.provider_id,
+            patient_id=appointment.patient_id,
+            severity='critical' if follow_up.priority == 'high' else 'warning',
+            title=f"Overdue follow-up: {appointment.patient.full_name}",
+            message=f"Follow-up due {due:%b %d, %Y} has not been scheduled. {follow_up.reason}",
+            url=reverse('appointment_detail', args=[appointment.pk]),
+        )]
+
+class UnreviewedLabResultsRule(AlertRule):
+    kind = 'unreviewed_lab'
+
+    def candidates(self):
+        return LabOrder.objects.filter(
+            status='completed', results__isnull=False, results_reviewed_at__isnull=True
+        ).exclude(results='').select_related('appointment__patient')
+
+    def evaluate(self, lab_order, now):
+        patient = lab_order.appointment.patient
+        return [AlertSpec(
+            source_id=lab_order.pk,
+            user_id=lab_order.ordered_by_id,
+            patient_id=patient.pk,
+            severity='warning',
+            title=f"Lab results to review: {patient.full_name}",
+            message=f"{lab_order.lab_name} results are in and have not been reviewed.",
+            url=reverse('appointment_detail', args=[lab_order.appointment_id]),
+        )]
+
+class ExpiredMedicationRule(AlertRule):
+    kind = 'expired_medication'
+
+    def candidates(self):
+        return Medication.objects.filter(
+            is_active=True, end_date__lt=timezone.localdate()
+        ).annotate(care_provider_id=latest_provider(OuterRef('patient'))).select_related('patient')
+
+    def evaluate(self, medication, now):
+        if medication.care_provider_id is None:
+            return []
+        return [AlertSpec(
+            source_id=medication.pk,
+            user_id=medication.care_provider_id,
+            patient_id=medication.patient_id,
+            severity='warning',
+            title=f"Medication past end date: {medication.patient.full_name}",
+            message=f"{medication.medication_name} {medication.dosage} ended {medication.end_date:%b %d, %Y} "
+                    f"but is still marked active.",
+            url=reverse('patient_detail', args=[medication.patient_id]),
+        )]
+
+class AbnormalVitalsRule(AlertRule):
+    kind = 'abnormal_vitals'
+    source_field = 'patient_id'
+
+    def candidates(self):
+        latest = VitalSigns.objects.filter(patient=OuterRef('patient')).order_by('-date_recorded', '-pk')
+        return VitalSigns.objects.annotate(
+            latest_pk=Subquery(latest.values('pk')[:1]),
+            care_provider_id=latest_provider(OuterRef('patient')),
+        ).filter(pk=F('latest_pk')).select_related('patient')
+
+    def evaluate(self, vitals, now):
+        findings = []
+        for field, label, low, high in VITAL_SIGN_LIMITS:
+            value = getattr(vitals, field)
+            if value is not None and not low <= value <= high:
+                findings.append(f"{label} {value}")
+        if not findings:
+            return []
+        recipients = {vitals.recorded_by_id, vitals.care_provider_id} - {None}
+        return [
+            AlertSpec(
+                source_id=vitals.patient_id,
+                user_id=user_id,
+                patient_id=vitals.patient_id,
+                severity='critical',
+                title=f"Abnormal vitals: {vitals.patient.full_name}",
+                message=', '.join(findings),
+                url=reverse('patient_detail', args=[vitals.patient_id]),
+            )
+            for user_id in recipients
+        ]
+
+RULES = [
+    OverdueFollowUpRule(),
+    UnreviewedLabResultsRule(),
+    ExpiredMedicationRule(),
+    AbnormalVitalsRule(),
+]
+
+RULES_BY_KIND = {rule.kind: rule for rule in RULES}
+
+def refresh_alerts(rule, source_ids=None, now=None):
+    """Reconcile ``rule``'s open alerts, for ``source_ids`` or for every record.
+
+    Returns a ``(created, updated, resolved)`` tuple of counts.
+    """
+    now = now or timezone.now()
+    candidates = rule.candidates()
+    open_alerts = Alert.objects.filter(kind=rule.kind, resolved_at__isnull=True)
+    if source_ids is not None:
+        candidates = candidates.filter(**{f'{rule.source_field}__in': source_ids})
+        open_alerts = open_alerts.filter(source_id__in=source_ids)
+
+    desired = {}
+    for obj in candidates.iterator(chunk_size=SWEEP_CHUNK_SIZE):
+        for spec in rule.evaluate(obj, now):
+            desired[(spec.source_id, spec.user_id)] = spec
+
+    with transaction.atomic():
+        existing = {(alert.source_id, alert.user_id): alert for alert in open_alerts.select_for_update()}
+
+        to_create = [
+            Alert(kind=rule.kind, **spec._asdict())
+            for key, spec in desired.items() if key not in existing
+        ]
+        to_update = []
+        for key, alert in existing.items():
+            spec = desired.get(key)
+            if spec and (alert.severity, alert.title, alert.message) != (spec.severity, spec.title, spec.message):
+                alert.severity, alert.title, alert.message = spec.severity, spec.title, spec.message
+                to_update.append(alert)
+        stale_ids = [alert.pk for key, alert in existing.items() if key not in desired]
+
+        Alert.objects.bulk_create(to_create, batch_size=SWEEP_CHUNK_SIZE)
+        Alert.objects.bulk_update(to_update, ['severity', 'title', 'message'], batch_size=SWEEP_CHUNK_SIZE)
+        resolved = 0
+        for start in range(0, len(stale_ids), SWEEP_CHUNK_SIZE):
+            chunk = stale_ids[start:start + SWEEP_CHUNK_SIZE]
+            resolved += Alert.objects.filter(pk__in=chunk).update(resolved_at=now)
+
+    return len(to_create), len(to_update), resolved
+
+def resolve_alerts(kind, source_id, now=None):
+    """Resolve open alerts for a source record that no longer exists."""
+    return Alert.objects.filter(kind=kind, source_id=source_id, resolved_at__isnull=True).update(
+        resolved_at=now or timezone.now()
+    )
+
+def sweep_alerts(now=None):
+    """Run every rule over all records; returns counts per rule kind."""
+    return {rule.kind: refresh_alerts(rule, now=now) for rule in RULES}
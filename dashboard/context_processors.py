@@ -0,0 +1,5 @@
+from django.conf import settings
+
+def fragment_cache(request):
+    """Timeout for the version-keyed ``{% cache %}`` fragments; 0 turns them off."""
+    return {'fragment_cache_timeout': settings.FRAGMENT_CACHE_TIMEOUT}
@@ -0,0 +1,217 @@
+"""
+Process-local caches kept coherent across workers and nodes.
+
+A ``LocalCache`` keeps values in this process's memory, so hot read paths
+skip both the database and the cache server. Writes call its
+``invalidate(key)``, usually from a model signal. Once the
+transaction commits, the named entry (or the whole cache when ``key`` is
+None) is evicted here. With the ``postgres`` backend the eviction is also
+NOTIFYed to every other worker, where a listener thread evicts it too.
+
+Evictions bump the cache's generation, and a value computed across a bump is
+returned but not stored, so a read racing a write can't put stale data back.
+Values are always computed from the primary, never a lagging replica.
+
+Notifications sent while a listener is disconnected are lost. So until the
+listener is connected, caches are bypassed, and they are cleared each time
+it connects. Entries also expire after ``LOCAL_CACHE_TIMEOUT`` seconds
+whatever the backend, and each cache keeps at most ``LOCAL_CACHE_MAX_ENTRIES``,
+dropping the least recently used.
+
+Two backends are available, selected with ``CACHE_INVALIDATION_BACKEND``:
+
+* ``postgres`` (default) relays evictions with LISTEN/NOTIFY to every worker.
+* ``local`` only evicts in the writing process, which is only enough when a
+  single process serves requests (and in tests).
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+from docsdash.replicas import primary_reads
+
+logger = logging.getLogger(__name__)
+
+LISTENER_RETRY_SECONDS = 5
+
+# The listener checks its connection with a query when idle this long
+LISTENER_HEARTBEAT_SECONDS = 30
+
+_caches = {}
+
+class LocalCache:
+    """A named in-memory cache evicted through the invalidation bus."""
+
+    def __init__(self, name, timeout=None, max_entries=None):
+        self.name = name
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # least recently used first
+        self.generation = 0
+        _caches[name] = self
+
+    def get_or_set(self, key, compute):
+        """The cached value for ``key``, computing and storing it with ``compute()`` on a miss."""
+        # Inside a transaction the value may include writes that aren't committed yet
+        if connection.in_atomic_block or not get_bus().ready():
+            return compute()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self.entries.move_to_end(key)
+                    return entry[0]
+                del self.entries[key]
+            generation = self.generation
+        with primary_reads:
+            value = compute()
+        timeout = self.timeout if self.timeout is not None else settings.LOCAL_CACHE_TIMEOUT
+        max_entries = self.max_entries if self.max_entries is not None else settings.LOCAL_CACHE_MAX_ENTRIES
+        with self.lock:
+            if self.generation == generation:
+                self.entries[key] = (value, now + timeout)
+                self.entries.move_to_end(key)
+                self.prune(now, max_entries)
+        return value
+
+    def prune(self, now, max_entries):
+        # Expired entries go from the least recently used end, then any over the limit
+        while self.entries:
+            key, (value, expires_at) = next(iter(self.entries.items()))
+            if expires_at > now and len(self.entries) <= max_entries:
+                break
+            del self.entries[key]
+
+    def invalidate(self, key=None):
+        """Evict ``key`` (or everything) in every worker once the write commits."""
+        invalidate(self.name, key)
+
+    def evict(self, key=None):
+        with self.lock:
+            self.generation += 1
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+def evict(name, key=None):
+    cache = _caches.get(name)
+    if cache is not None:
+        cache.evict(key)
+
+def clear_all():
+    for cache in list(_caches.values()):
+        cache.evict()
+
+class LocalBus:
+    """Evict entries in this process only."""
+
+    def ready(self):
+        return True
+
+    def invalidate(self, name, key=None):
+        transaction.on_commit(lambda: evict(name, key))
+
+class PostgresBus(LocalBus):
+    """Evict entries in every worker through LISTEN/NOTIFY."""
+
+    pg_channel = 'docsdash_invalidate'
+
+    def __init__(self):
+        # Tells this process's own notifications apart; it has evicted already
+        self.origin = uuid.uuid4().hex
+        self.connected = threading.Event()
+        self.listener = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def ready(self):
+        self.start()
+        return self.connected.is_set()
+
+    def invalidate(self, name, key=None):
+        transaction.on_commit(lambda: evict(name, key))
+        # NOTIFY is transactional, so other workers only hear of committed writes
+        payload = json.dumps({'origin': self.origin, 'name': name, 'key': key})
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.pg_channel, payload])
+
+    def start(self):
+        with self.lock:
+            # Threads don't survive a fork, so a preforked worker starts its own
+            if self.listener is not None and self.listener.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.connected.clear()
+            self.listener = threading.Thread(target=self.run, name='cache-invalidation', daemon=True)
+            self.listener.start()
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                logger.exception("Cache invalidation listener failed; reconnecting")
+            self.connected.clear()
+            time.sleep(LISTENER_RETRY_SECONDS)
+
+    def listen(self):
+        import psycopg2
+
+        conn = psycopg2.connect(**connections['default'].get_connection_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {self.pg_channel}')
+            # Anything invalidated before now may have been missed
+            clear_all()
+            self.connected.set()
+            while True:
+                if select.select([conn], [], [], LISTENER_HEARTBEAT_SECONDS) == ([], [], []):
+                    with conn.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.receive(conn.notifies.pop(0).payload)
+        finally:
+            self.connected.clear()
+            conn.close()
+
+    def receive(self, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            logger.warning("Ignoring malformed cache invalidation payload")
+            return
+        if data.get('origin') != self.origin:
+            evict(data['name'], data.get('key'))
+
+BACKENDS = {
+    'local': LocalBus,
+    'postgres': PostgresBus,
+}
+
+_bus = None
+
+def get_bus():
+    """Return the process-wide bus for the configured backend."""
+    global _bus
+    if _bus is None:
+        _bus = BACKENDS[getattr(settings, 'CACHE_INVALIDATION_BACKEND', 'local')]()
+    return _bus
+
+def invalidate(name, key=None):
+    """Evict ``key`` (or everything) from cache ``name`` in every worker once the write commits."""
+    get_bus().invalidate(name, key)
@@ -0,0 +1,159 @@
+"""
+In-process pub/sub for live dashboard and chart updates.
+
+Subscribers are asyncio queues owned by server-sent event streams, so an ASGI
+worker can hold thousands of idle connections on its event loop without a
+thread per client. Messages are small JSON-serializable dicts describing what
+changed; clients re-render or refetch from them.
+
+Two backends are available, selected with the ``LIVE_UPDATES_BACKEND`` setting:
+
+* ``local`` (default) delivers messages to subscribers in the same process.
+* ``postgres`` publishes through ``NOTIFY`` and runs one ``LISTEN`` connection
+  per worker, so every node sees every message once the transaction commits.
+"""
+
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Messages a subscriber may fall behind by before new ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+LISTENER_RETRY_SECONDS = 5
+
+class LocalBroker:
+    """Fan out messages to subscribers living on this process's event loops."""
+
+    def __init__(self):
+        self._subscribers = {}
+
+    @asynccontextmanager
+    async def subscribe(self, channels):
+        """Yield a queue receiving messages for ``channels`` until the block exits."""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        for channel in channels:
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+        try:
+            await self.start()
+            yield queue
+        finally:
+            for channel in channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    async def start(self):
+        """Hook for backends that need a background listener."""
+
+    def publish(self, channel, message):
+        """Publish ``message`` to ``channel`` once the current transaction commits."""
+        transaction.on_commit(lambda: self.send(channel, message))
+
+    def send(self, channel, message):
+        self.dispatch(channel, message)
+
+    def dispatch(self, channel, message):
+        """Deliver ``message`` to local subscribers; safe to call from any thread."""
+        for loop, queue in list(self._subscribers.get(channel, ())):
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, message)
+            except RuntimeError:
+                # The subscriber's loop has already shut down
+                pass
+
+    @staticmethod
+    def _deliver(queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.debug("Dropping live update for a slow subscriber")
+
+class PostgresBroker(LocalBroker):
+    """Broker that relays messages between nodes with LISTEN/NOTIFY."""
+
+    pg_channel = 'docsdash_live'
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def publish(self, channel, message):
+        # NOTIFY is transactional, so it is only delivered if the write commits
+        self.send(channel, message)
+
+    def send(self, channel, message):
+        payload = json.dumps({'channel': channel, 'message': message}, cls=DjangoJSONEncoder)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.pg_channel, payload])
+
+    async def start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+            except Exception:
+                logger.exception("Live update listener failed; reconnecting")
+            await asyncio.sleep(LISTENER_RETRY_SECONDS)
+
+    async def _listen(self):
+        import psycopg2.extensions
+
+        params = connections['default'].get_connection_params()
+        conn = await asyncio.to_thread(psycopg2.connect, **params)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.pg_channel}')
+
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(conn.fileno(), readable.set)
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        data = json.loads(notify.payload)
+                    except ValueError:
+                        logger.warning("Ignoring malformed live update payload")
+                        continue
+                    self.dispatch(data['channel'], data['message'])
+        finally:
+            loop.remove_reader(conn.fileno())
+            conn.close()
+
+BACKENDS = {
+    'local': LocalBroker,
+    'postgres': PostgresBroker,
+}
+
+_broker = None
+
+def get_broker():
+    """Return the process-wide broker for the configured backend."""
+    global _broker
+    if _broker is None:
+        _broker = BACKENDS[getattr(settings, 'LIVE_UPDATES_BACKEND', 'local')]()
+    return _broker
+
+def publish(channel, message):
+    get_broker().publish(channel, message)
+
+def patient_channel(patient_id):
+    return f'patient.{patient_id}'
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from dashboard.alerts import sweep_alerts
+
+class Command(BaseCommand):
+    help = "Re-evaluate every alert rule, opening and resolving dashboard alerts. Run periodically."
+
+    def handle(self, *args, **options):
+        for kind, (created, updated, resolved) in sweep_alerts().items():
+            self.stdout.write(f"{kind}: {created} opened, {updated} updated, {resolved} resolved")
@@ -1,3 +1,54 @@
 from django.db import models
+from django.conf import settings
+from patients.models import Patient
 
-# Create your models here.
+class Alert(models.Model):
+    """Precomputed clinical alert shown on a user's dashboard.
+    
+    Alerts are maintained by the rules in ``dashboard.alerts``: they are opened
+    when a rule matches its source record and resolved once it no longer does.
+    """
+    
+    KIND_CHOICES = (
+        ('overdue_follow_up', 'Overdue Follow-up'),
+        ('unreviewed_lab', 'Unreviewed Lab Results'),
+        ('expired_medication', 'Expired Medication'),
+        ('abnormal_vitals', 'Abnormal Vital Signs'),
+    )
+    
+    SEVERITY_CHOICES = (
+        ('critical', 'Critical'),
+        ('warning', 'Warning'),
+    )
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='alerts')
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='alerts')
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    # Primary key of the record the rule evaluated (follow-up, lab order, medication or patient)
+    source_id = models.BigIntegerField()
+    severity = models.CharField(max_length=10, choices=SEVERITY_CHOICES, default='warning')
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    url = models.CharField(max_length=200)
+    created_at = models.DateTimeField(auto_now_add=True)
+    resolved_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'source_id', 'user'],
+                condition=models.Q(resolved_at__isnull=True),
+                name='alert_open_unique',
+            ),
+        ]
+        indexes = [
+            # Serves the dashboard's open-alerts query
+            models.Index(
+                fields=['user', '-created_at'],
+                condition=models.Q(resolved_at__isnull=True),
+                name='alert_open_user_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} for {self.user.full_name}: {self.title}"
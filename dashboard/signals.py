@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from appointments.catalog import appointment_types
+from appointments.models import Appointment, AppointmentType, FollowUp, LabOrder
+from patients.chart import patient_charts
+from patients.models import (
+    Allergy, ChronicCondition, FamilyHistory, Immunization, MedicalHistory, Medication, Patient, PatientNote,
+    RecentPatient, VitalSigns,
+)
+from . import alerts, live, stats, versions
+
+def mark_stale(name):
+    """Bump ``name`` and queue a refresh of the stats rollup that depends on it."""
+    versions.bump(name)
+    stats.schedule_refresh()
+
+@receiver(post_save, sender=Appointment)
+def push_appointment_update(sender, instance, created, **kwargs):
+    """Tell open dashboards and the patient's chart about the appointment.
+    
+    Every signed-in user can follow the dashboard channel, so its copy names
+    neither the patient nor the provider; chart subscribers have already been
+    checked against the patient.
+    """
+    message = {
+        'type': 'appointment',
+        'id': instance.pk,
+        'patient_id': instance.patient_id,
+        'provider_id': instance.provider_id,
+        'status': instance.status,
+        'status_display': instance.get_status_display(),
+        'start_time': instance.start_time,
+        'created': created,
+    }
+    live.publish('dashboard', {
+        key: value for key, value in message.items() if key not in ('patient_id', 'provider_id')
+    })
+    live.publish(live.patient_channel(instance.patient_id), message)
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=AppointmentType)
+@receiver(post_delete, sender=AppointmentType)
+def bump_appointments_version(sender, **kwargs):
+    """Mark cached appointment lists and the stats rollup stale once the write commits."""
+    transaction.on_commit(lambda: mark_stale('appointments'))
+
+@receiver(post_save, sender=AppointmentType)
+@receiver(post_delete, sender=AppointmentType)
+def invalidate_appointment_types(sender, **kwargs):
+    """Evict the booking form's type lists in every worker (see dashboard.invalidation)."""
+    appointment_types.invalidate()
+
+@receiver([post_save, post_delete], sender=Allergy)
+@receiver([post_save, post_delete], sender=ChronicCondition)
+@receiver([post_save, post_delete], sender=Medication)
+@receiver([post_save, post_delete], sender=MedicalHistory)
+@receiver([post_save, post_delete], sender=FamilyHistory)
+@receiver([post_save, post_delete], sender=Immunization)
+@receiver([post_save, post_delete], sender=VitalSigns)
+@receiver([post_save, post_delete], sender=PatientNote)
+def invalidate_patient_chart(sender, instance, **kwargs):
+    patient_charts.invalidate(instance.patient_id)
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def bump_patients_version(sender, **kwargs):
+    transaction.on_commit(lambda: mark_stale('patients'))
+
+@receiver(post_save, sender=RecentPatient)
+@receiver(post_delete, sender=RecentPatient)
+def bump_recent_patients_version(sender, instance, **kwargs):
+    name = versions.recent_patients_version_name(instance.user_id)
+    transaction.on_commit(lambda: versions.bump(name))
+
+@receiver(post_save, sender=VitalSigns)
+def push_vital_signs(sender, instance, created, **kwargs):
+    if created:
+        live.publish(live.patient_channel(instance.patient_id), {
+            'type': 'vitals',
+            'id': instance.pk,
+            'patient_id': instance.patient_id,
+            'date_recorded': instance.date_recorded,
+        })
+
+@receiver(post_save, sender=PatientNote)
+def push_patient_note(sender, instance, created, **kwargs):
+    if created:
+        live.publish(live.patient_channel(instance.patient_id), {
+            'type': 'note',
+            'id': instance.pk,
+            'patient_id': instance.patient_id,
+            'created_by_id': instance.created_by_id,
+        })
+
+@receiver(post_save, sender=FollowUp)
+def refresh_follow_up_alerts(sender, instance, **kwargs):
+    alerts.refresh_alerts(alerts.RULES_BY_KIND['overdue_follow_up'], [instance.pk])
+
+@receiver(post_save, sender=LabOrder)
+def refresh_lab_order_alerts(sender, instance, **kwargs):
+    alerts.refresh_alerts(alerts.RULES_BY_KIND['unreviewed_lab'], [instance.pk])
+
+@receiver(post_save, sender=Medication)
+def refresh_medication_alerts(sender, instance, **kwargs):
+    alerts.refresh_alerts(alerts.RULES_BY_KIND['expired_medication'], [instance.pk])
+
+@receiver(post_save, sender=VitalSigns)
+@receiver(post_delete, sender=VitalSigns)
+def refresh_vitals_alerts(sender, instance, **kwargs):
+    alerts.refresh_alerts(alerts.RULES_BY_KIND['abnormal_vitals'], [instance.patient_id])
+
+@receiver(post_delete, sender=FollowUp)
+@receiver(post_delete, sender=LabOrder)
+@receiver(post_delete, sender=Medication)
+def resolve_deleted_source_alerts(sender, instance, **kwargs):
+    kind = {
+        FollowUp: 'overdue_follow_up',
+        LabOrder: 'unreviewed_lab',
+        Medication: 'expired_medication',
+    }[sender]
+    alerts.resolve_alerts(kind, instance.pk)
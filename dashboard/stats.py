@@ -0,0 +1,182 @@
+"""
+Home page statistics shared by every user.
+
+The counts are computed with one conditional aggregate per model and kept in
+the cache for the clinic day. The rollup is fresh for ``STATS_FRESH_SECONDS``
+and only while the appointment and patient versions (see dashboard.versions)
+match the ones it was computed at, so edits show up on the next load.
+
+The home page never computes the counts: ``current_stats`` returns whatever
+rollup is cached, and when it is missing or out of date with no refresh
+queued, the page renders placeholders or the previous counts and fetches them
+from the ``dashboard_stats`` endpoint once it has loaded.
+
+With a shared cache (``SHARED_CACHE``) the rollup is also refreshed
+off-request: committed appointment and patient writes queue a background
+refresh (see dashboard.signals), and a periodic job renews it every
+``STATS_REFRESH_SECONDS``. While a refresh is queued, pages serve the previous
+counts. Without a shared cache the job worker's rollup would never reach the
+web workers, so nothing is queued.
+
+Recomputation in ``get_stats`` is single flight: the request that takes the
+lock refreshes the rollup while concurrent requests keep serving the previous
+value, or wait briefly for the first one when there is none yet.
+
+``aget_stats`` is the same for async views; when it recomputes, the patient
+and appointment counts are queried at the same time (see docsdash.asyncdb).
+"""
+
+import asyncio
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from appointments.models import Appointment, day_start
+from docsdash.asyncdb import run_query
+from jobs.queue import enqueue
+from patients.models import Patient
+from . import versions
+
+STATS_FRESH_SECONDS = 60
+STATS_TIMEOUT = 60 * 60 * 24
+STATS_LOCK_SECONDS = 10
+
+# Background refreshes: how often the periodic job runs, and how long a queued
+# refresh may take to run before requests stop waiting for it
+STATS_REFRESH_SECONDS = 30
+STATS_QUEUED_SECONDS = 30
+STATS_REFRESH_TASK = 'dashboard.tasks.refresh_stats'
+
+STATS_DEPENDENCIES = ('appointments', 'patients')
+
+# How long a request without any cached stats waits for another to compute them
+STATS_WAIT_SECONDS = 2
+STATS_WAIT_INTERVAL = 0.05
+
+def stats_cache_key(day):
+    return f'dashboard-stats:{day.isoformat()}'
+
+def patient_counts():
+    return Patient.objects.aggregate(
+        total_patients=Count('pk'),
+        active_patients=Count('pk', filter=Q(is_active=True)),
+    )
+
+def appointment_counts(today):
+    tomorrow = today + timedelta(days=1)
+    today_range = Q(start_time__gte=day_start(today), start_time__lt=day_start(tomorrow))
+    tomorrow_range = Q(start_time__gte=day_start(tomorrow), start_time__lt=day_start(tomorrow + timedelta(days=1)))
+    upcoming_range = Q(start_time__gte=day_start(tomorrow), status__in=['scheduled', 'confirmed'])
+
+    return Appointment.objects.between_dates(today, today + timedelta(days=7)).aggregate(
+        appointments_today=Count('pk', filter=today_range),
+        appointments_tomorrow=Count('pk', filter=tomorrow_range),
+        upcoming_appointments=Count('pk', filter=upcoming_range),
+    )
+
+def compute_stats(today):
+    return {**patient_counts(), **appointment_counts(today)}
+
+async def acompute_stats(today):
+    patients, appointments = await asyncio.gather(run_query(patient_counts), run_query(appointment_counts, today))
+    return {**patients, **appointments}
+
+def store_stats(today, stats, dependency_versions):
+    key = stats_cache_key(today)
+    cache.set(key, stats, STATS_TIMEOUT)
+    # Versions read before computing, so a write landing mid-computation keeps the result stale
+    cache.set(f'{key}:fresh', dependency_versions, STATS_FRESH_SECONDS)
+    return stats
+
+def refresh_stats(today, dependency_versions):
+    return store_stats(today, compute_stats(today), dependency_versions)
+
+def schedule_refresh():
+    """Queue a background refresh of today's rollup unless one is already queued."""
+    if settings.SHARED_CACHE and cache.add(f'{stats_cache_key(timezone.localdate())}:queued', True, STATS_QUEUED_SECONDS):
+        enqueue(STATS_REFRESH_TASK)
+
+def refresh_current_stats():
+    """Recompute today's rollup at the current versions; run by the background job."""
+    today = timezone.localdate()
+    # Cleared first, so a write committing during the refresh queues another one
+    cache.delete(f'{stats_cache_key(today)}:queued')
+    dependency_versions = versions.get_versions(*STATS_DEPENDENCIES)
+    return refresh_stats(today, [dependency_versions[name] for name in STATS_DEPENDENCIES])
+
+def current_stats(today, dependency_versions):
+    """The cached rollup for ``today`` without computing it, as ``(stats, pending)``.
+
+    ``stats`` is None when there is no rollup yet. ``pending`` is True when it
+    is missing or out of date and no refresh is queued.
+    """
+    current = [dependency_versions[name] for name in STATS_DEPENDENCIES]
+    key = stats_cache_key(today)
+    cached = cache.get_many([key, f'{key}:fresh', f'{key}:queued'])
+    stats = cached.get(key)
+    fresh = stats is not None and (cached.get(f'{key}:fresh') == current or cached.get(f'{key}:queued'))
+    return stats, not fresh
+
+def get_stats(today=None, dependency_versions=None):
+    """Return the dashboard counts for ``today``, recomputing them at most once at a time.
+
+    A stale rollup is served as is while a background refresh is queued.
+
+    Pass ``dependency_versions`` when the caller has already read them.
+    """
+    today = today or timezone.localdate()
+    if dependency_versions is None:
+        dependency_versions = versions.get_versions(*STATS_DEPENDENCIES)
+    stats, pending = current_stats(today, dependency_versions)
+    if not pending:
+        return stats
+
+    key = stats_cache_key(today)
+    if cache.add(f'{key}:lock', True, STATS_LOCK_SECONDS):
+        try:
+            return refresh_stats(today, [dependency_versions[name] for name in STATS_DEPENDENCIES])
+        finally:
+            cache.delete(f'{key}:lock')
+    if stats is not None:
+        return stats
+
+    deadline = time.monotonic() + STATS_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(STATS_WAIT_INTERVAL)
+        stats = cache.get(key)
+        if stats is not None:
+            return stats
+    return compute_stats(today)
+
+async def aget_stats(today=None):
+    """Async ``get_stats``."""
+    today = today or timezone.localdate()
+    dependency_versions = await sync_to_async(versions.get_versions)(*STATS_DEPENDENCIES)
+    current = [dependency_versions[name] for name in STATS_DEPENDENCIES]
+    key = stats_cache_key(today)
+    cached = await cache.aget_many([key, f'{key}:fresh', f'{key}:queued'])
+    stats = cached.get(key)
+    if stats is not None and (cached.get(f'{key}:fresh') == current or cached.get(f'{key}:queued')):
+        return stats
+
+    if await cache.aadd(f'{key}:lock', True, STATS_LOCK_SECONDS):
+        try:
+            stats = await acompute_stats(today)
+            return await sync_to_async(store_stats)(today, stats, current)
+        finally:
+            await cache.adelete(f'{key}:lock')
+    if stats is not None:
+        return stats
+
+    deadline = time.monotonic() + STATS_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(STATS_WAIT_INTERVAL)
+        stats = await cache.aget(key)
+        if stats is not None:
+            return stats
+    return await acompute_stats(today)
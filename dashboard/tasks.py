@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.conf import settings
+
+from jobs.queue import task
+from . import alerts, stats
+
+@task(schedule=timedelta(minutes=15))
+def sweep_alerts():
+    """Periodic re-evaluation of alert rules whose outcome changes with time."""
+    alerts.sweep_alerts()
+
+# Only with a shared cache, where web workers read the rollup it writes
+@task(schedule=timedelta(seconds=stats.STATS_REFRESH_SECONDS) if settings.SHARED_CACHE else None)
+def refresh_stats():
+    """Recompute the dashboard stats rollup, queued by writes and run periodically."""
+    if settings.SHARED_CACHE:
+        stats.refresh_current_stats()
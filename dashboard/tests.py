@@ -1,3 +1,494 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.catalog import active_appointment_types, appointment_types
+from appointments.models import Appointment, AppointmentType, FollowUp, LabOrder
+from authentication import permissions
+from authentication.models import User
+from jobs.models import Job
+from jobs.worker import Worker
+from patients.chart import patient_charts
+from patients.models import Allergy, Medication, Patient, RecentPatient, VitalSigns
+from . import invalidation, live, stats, versions
+from .alerts import parse_time_frame, sweep_alerts
+from .models import Alert
+
+
+def create_patient(**kwargs):
+    fields = dict(
+        medical_record_number='MRN-0001', first_name='John', last_name='Smith',
+        date_of_birth=date(1980, 1, 1), gender='M', phone_primary='555-0100', address='1 Main St',
+        emergency_contact_name='Jane Smith', emergency_contact_relation='Spouse',
+        emergency_contact_phone='555-0101',
+    )
+    fields.update(kwargs)
+    return Patient.objects.create(**fields)
+
+
+class LocalBrokerTests(SimpleTestCase):
+    """The in-process broker fans messages out to matching subscribers only."""
+
+    def test_subscribers_receive_messages_for_their_channels(self):
+        broker = live.LocalBroker()
+
+        async def scenario():
+            async with broker.subscribe(['dashboard']) as dashboard_queue, \
+                    broker.subscribe(['patient.1']) as chart_queue:
+                broker.send('dashboard', {'type': 'appointment', 'id': 1})
+                message = await asyncio.wait_for(dashboard_queue.get(), timeout=1)
+                self.assertEqual(message['id'], 1)
+                self.assertTrue(chart_queue.empty())
+            self.assertEqual(broker._subscribers, {})
+
+        asyncio.run(scenario())
+
+    def test_slow_subscribers_drop_messages_instead_of_blocking(self):
+        broker = live.LocalBroker()
+
+        async def scenario():
+            async with broker.subscribe(['dashboard']) as queue:
+                for index in range(live.SUBSCRIBER_QUEUE_SIZE + 5):
+                    broker.send('dashboard', {'type': 'appointment', 'id': index})
+                await asyncio.sleep(0)
+                self.assertEqual(queue.qsize(), live.SUBSCRIBER_QUEUE_SIZE)
+
+        asyncio.run(scenario())
+
+
+class LiveUpdateSignalTests(TestCase):
+    """Chart changes are published to the patient's channel after commit."""
+
+    def test_new_vitals_are_published_on_commit(self):
+        patient = create_patient()
+
+        with mock.patch.object(live.get_broker(), 'send') as send:
+            with self.captureOnCommitCallbacks(execute=True):
+                vitals = VitalSigns.objects.create(patient=patient, date_recorded=timezone.now(), heart_rate=70)
+                send.assert_not_called()
+
+        send.assert_called_once()
+        channel, message = send.call_args.args
+        self.assertEqual(channel, live.patient_channel(patient.pk))
+        self.assertEqual(message['type'], 'vitals')
+        self.assertEqual(message['id'], vitals.pk)
+
+    def test_dashboard_appointment_messages_name_no_one(self):
+        patient = create_patient()
+        doctor = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+
+        with mock.patch.object(live.get_broker(), 'send') as send:
+            with self.captureOnCommitCallbacks(execute=True):
+                appointment = Appointment.objects.create(
+                    patient=patient, appointment_type=AppointmentType.objects.create(name='Consultation'),
+                    provider=doctor, created_by=doctor, reason='Checkup',
+                    start_time=timezone.now(), end_time=timezone.now() + timedelta(minutes=30),
+                )
+
+        messages = dict(call.args for call in send.call_args_list)
+        self.assertEqual(messages['dashboard']['id'], appointment.pk)
+        self.assertNotIn('patient_id', messages['dashboard'])
+        self.assertNotIn('provider_id', messages['dashboard'])
+        self.assertEqual(messages[live.patient_channel(patient.pk)]['patient_id'], patient.pk)
+
+
+class LiveUpdatesViewTests(TestCase):
+
+    def test_requires_authentication(self):
+        response = self.client.get(reverse('live_updates'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_rejects_unknown_channels(self):
+        user = User.objects.create_user(
+            email='nurse@example.com', password='unused-password', first_name='Ann', last_name='Lee', role='nurse'
+        )
+        self.client.force_login(user)
+        response = self.client.get(reverse('live_updates'), {'channels': 'users'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_patients_the_user_cannot_view(self):
+        patient = create_patient()
+        user = User.objects.create_user(
+            email='nurse@example.com', password='unused-password', first_name='Ann', last_name='Lee', role='nurse'
+        )
+        self.client.force_login(user)
+        url = reverse('live_updates')
+
+        with mock.patch.dict(permissions.ROLE_PERMISSIONS, {'nurse': {'patients.view': ('appointments__provider',)}}):
+            response = self.client.get(url, {'channels': f'dashboard,patient.{patient.pk}'})
+            self.assertEqual(response.status_code, 403)
+
+            response = self.client.get(url, {'channels': f'patient.{patient.pk + 1}'})
+            self.assertEqual(response.status_code, 403)
+
+
+class AlertEngineTests(TestCase):
+    """Rules open alerts for matching records and resolve them once they stop matching."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+        cls.patient = create_patient()
+        cls.appointment = Appointment.objects.create(
+            patient=cls.patient, appointment_type=AppointmentType.objects.create(name='Consultation'),
+            provider=cls.doctor, created_by=cls.doctor, reason='Checkup',
+            start_time=timezone.now() - timedelta(days=30), end_time=timezone.now() - timedelta(days=30),
+        )
+
+    def open_alerts(self, kind):
+        return Alert.objects.filter(user=self.doctor, kind=kind, resolved_at__isnull=True)
+
+    def test_parse_time_frame(self):
+        self.assertEqual(parse_time_frame('2 weeks'), timedelta(days=14))
+        self.assertEqual(parse_time_frame('Follow up in 3 Months'), timedelta(days=90))
+        self.assertIsNone(parse_time_frame('as needed'))
+
+    def test_overdue_follow_up_is_opened_on_save_and_resolved_when_scheduled(self):
+        follow_up = FollowUp.objects.create(
+            appointment=self.appointment, recommended_time_frame='2 weeks', reason='Recheck', priority='high'
+        )
+        self.assertTrue(self.open_alerts('overdue_follow_up').exists())
+
+        follow_up.is_scheduled = True
+        follow_up.save()
+        self.assertFalse(self.open_alerts('overdue_follow_up').exists())
+
+    def test_sweep_opens_alerts_that_became_due(self):
+        FollowUp.objects.create(appointment=self.appointment, recommended_time_frame='6 weeks', reason='Recheck')
+        self.assertFalse(self.open_alerts('overdue_follow_up').exists())
+
+        sweep_alerts(now=timezone.now() + timedelta(days=30))
+
+        self.assertEqual(self.open_alerts('overdue_follow_up').count(), 1)
+        sweep_alerts(now=timezone.now() + timedelta(days=30))
+        self.assertEqual(self.open_alerts('overdue_follow_up').count(), 1)
+
+    def test_completed_lab_results_alert_until_reviewed(self):
+        lab_order = LabOrder.objects.create(
+            appointment=self.appointment, lab_name='CBC', description='Blood count',
+            status='completed', results='Normal', ordered_by=self.doctor,
+        )
+        self.assertEqual(self.open_alerts('unreviewed_lab').count(), 1)
+
+        self.client.force_login(self.doctor)
+        self.client.post(reverse('review_lab_results', args=[lab_order.pk]))
+
+        self.assertFalse(self.open_alerts('unreviewed_lab').exists())
+
+    def test_active_medication_past_end_date_alerts_care_provider(self):
+        Medication.objects.create(
+            patient=self.patient, medication_name='Amoxicillin', dosage='500mg', frequency='twice_daily',
+            start_date=date.today() - timedelta(days=20), end_date=date.today() - timedelta(days=10),
+            prescribing_doctor='Dr. Doe',
+        )
+        self.assertEqual(self.open_alerts('expired_medication').count(), 1)
+
+    def test_only_latest_vitals_are_checked(self):
+        VitalSigns.objects.create(
+            patient=self.patient, date_recorded=timezone.now() - timedelta(hours=1), oxygen_saturation=85
+        )
+        self.assertEqual(self.open_alerts('abnormal_vitals').get().severity, 'critical')
+
+        VitalSigns.objects.create(patient=self.patient, date_recorded=timezone.now(), oxygen_saturation=98)
+        self.assertFalse(self.open_alerts('abnormal_vitals').exists())
+
+    def test_dashboard_reads_precomputed_alerts(self):
+        Alert.objects.create(
+            user=self.doctor, patient=self.patient, kind='abnormal_vitals', source_id=self.patient.pk,
+            title='Abnormal vitals: John Smith', message='SpO2 85', url='/patients/1/',
+        )
+        self.client.force_login(self.doctor)
+
+        response = self.client.get(reverse('dashboard'))
+
+        self.assertContains(response, 'Abnormal vitals: John Smith')
+
+
+@override_settings(FRAGMENT_CACHE_TIMEOUT=60 * 60 * 24, SHARED_CACHE=True)
+class DashboardStatsTests(TestCase):
+    """Home page counts and fragments come from the shared cache and follow writes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+        cls.patient = create_patient()
+        cls.appointment_type = AppointmentType.objects.create(name='Consultation')
+
+    def setUp(self):
+        cache.clear()
+
+    def schedule(self, start_time, status='scheduled'):
+        return Appointment.objects.create(
+            patient=self.patient, appointment_type=self.appointment_type, provider=self.doctor,
+            created_by=self.doctor, reason='Checkup', start_time=start_time,
+            end_time=start_time + timedelta(minutes=30), status=status,
+        )
+
+    def view_queries(self):
+        """Dashboard queries, leaving out the session and request.user lookups."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return [
+            query['sql'] for query in queries
+            if not any(skip in query['sql'] for skip in ('django_session', 'SAVEPOINT', 'FROM "authentication_user"'))
+        ]
+
+    def test_counts_use_one_query_per_model(self):
+        today_start = stats.day_start(timezone.localdate())
+        self.schedule(today_start + timedelta(hours=9))
+        self.schedule(today_start + timedelta(days=1, hours=9))
+        self.schedule(today_start + timedelta(days=3, hours=9), status='cancelled')
+        create_patient(medical_record_number='MRN-0002', is_active=False)
+
+        with self.assertNumQueries(2):
+            counts = stats.compute_stats(timezone.localdate())
+
+        self.assertEqual(counts, {
+            'total_patients': 2, 'active_patients': 1,
+            'appointments_today': 1, 'appointments_tomorrow': 1, 'upcoming_appointments': 1,
+        })
+
+    def test_home_page_costs_at_most_three_queries(self):
+        self.schedule(stats.day_start(timezone.localdate()) + timedelta(hours=9))
+        self.schedule(stats.day_start(timezone.localdate()) + timedelta(days=1, hours=9))
+        self.client.force_login(self.doctor)
+
+        # Both appointment lists, recent patients and alerts; with no rollup yet
+        # the page leaves the counts to dashboard_stats
+        cold = self.view_queries()
+        self.assertLessEqual(len(cold), 3)
+        self.assertFalse(any('COUNT(' in sql for sql in cold))
+        response = self.client.get(reverse('dashboard'))
+        self.assertTrue(response.context['stats_pending'])
+        self.assertContains(response, reverse('dashboard_stats'))
+
+        # As the endpoint does (see DashboardStatsViewTests)
+        self.assertEqual(stats.get_stats()['appointments_today'], 1)
+        warm = self.view_queries()
+        self.assertEqual(len(warm), 1)
+        self.assertIn('dashboard_alert', warm[0])
+        response = self.client.get(reverse('dashboard'))
+        self.assertFalse(response.context['stats_pending'])
+        self.assertNotContains(response, reverse('dashboard_stats'))
+
+    def test_cached_fragments_follow_appointment_writes(self):
+        self.client.force_login(self.doctor)
+        self.assertContains(self.client.get(reverse('dashboard')), 'No appointments scheduled for today.')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment = self.schedule(stats.day_start(timezone.localdate()) + timedelta(hours=9))
+        Worker(threads=0).run_once()
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, f'data-appointment-id="{appointment.pk}"')
+        self.assertEqual(response.context['appointments_today'], 1)
+
+    @override_settings(FRAGMENT_CACHE_TIMEOUT=0)
+    def test_fragments_are_not_cached_without_a_shared_cache(self):
+        self.client.force_login(self.doctor)
+        self.client.get(reverse('dashboard'))
+
+        # Written without bumping this process's version, as by another worker
+        appointment = self.schedule(stats.day_start(timezone.localdate()) + timedelta(hours=9))
+
+        self.assertContains(self.client.get(reverse('dashboard')), f'data-appointment-id="{appointment.pk}"')
+
+    def test_recent_patients_fragment_is_per_user(self):
+        nurse = User.objects.create_user(
+            email='nurse@example.com', password='unused-password', first_name='Ann', last_name='Lee', role='nurse'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            RecentPatient.objects.create(user=self.doctor, patient=self.patient)
+
+        self.client.force_login(self.doctor)
+        self.assertContains(self.client.get(reverse('dashboard')), 'John Smith')
+        self.client.force_login(nurse)
+        self.assertContains(self.client.get(reverse('dashboard')), 'No recently viewed patients.')
+
+    def test_writes_queue_a_background_refresh(self):
+        self.assertEqual(stats.get_stats()['total_patients'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_patient(medical_record_number='MRN-0002')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get_stats()['total_patients'], 1)
+        Worker(threads=0).run_once()
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get_stats()['total_patients'], 2)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_writes_queue_nothing_without_a_shared_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_patient(medical_record_number='MRN-0002')
+        self.assertFalse(Job.objects.exists())
+
+    def test_stale_rollup_is_recomputed_inline_when_no_worker_refreshes_it(self):
+        stats.get_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_patient(medical_record_number='MRN-0002')
+
+        # The queued marker expires when no worker picks the refresh up in time
+        cache.delete(f'{stats.stats_cache_key(timezone.localdate())}:queued')
+        self.assertEqual(stats.get_stats()['total_patients'], 2)
+
+    def test_stale_rollup_is_served_while_another_request_recomputes(self):
+        stats.get_stats()
+        versions.bump('patients')
+        cache.add(f'{stats.stats_cache_key(timezone.localdate())}:lock', True)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get_stats()['total_patients'], 1)
+
+
+class LocalCacheTests(SimpleTestCase):
+    """Values are cached until evicted, and a value computed across an eviction isn't kept."""
+
+    def setUp(self):
+        self.cache = invalidation.LocalCache('test_cache', timeout=60)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_values_are_cached_until_evicted(self):
+        self.assertEqual(self.cache.get_or_set('key', self.compute), 1)
+        self.assertEqual(self.cache.get_or_set('key', self.compute), 1)
+        invalidation.evict('test_cache', 'key')
+        self.assertEqual(self.cache.get_or_set('key', self.compute), 2)
+
+    def test_values_expire(self):
+        with mock.patch('dashboard.invalidation.time.monotonic', return_value=1000.0):
+            self.cache.get_or_set('key', self.compute)
+        with mock.patch('dashboard.invalidation.time.monotonic', return_value=1061.0):
+            self.assertEqual(self.cache.get_or_set('key', self.compute), 2)
+
+    def test_least_recently_used_entries_are_dropped(self):
+        cache = invalidation.LocalCache('test_lru', timeout=60, max_entries=2)
+        cache.get_or_set('a', self.compute)
+        cache.get_or_set('b', self.compute)
+        cache.get_or_set('a', self.compute)
+        cache.get_or_set('c', self.compute)
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+
+    def test_expired_entries_are_dropped(self):
+        with mock.patch('dashboard.invalidation.time.monotonic', return_value=1000.0):
+            self.cache.get_or_set('old', self.compute)
+        with mock.patch('dashboard.invalidation.time.monotonic', return_value=1061.0):
+            self.cache.get_or_set('new', self.compute)
+        self.assertEqual(list(self.cache.entries), ['new'])
+
+    def test_values_computed_across_an_eviction_are_not_stored(self):
+        def racing_compute():
+            self.cache.evict()
+            return 'stale'
+
+        self.assertEqual(self.cache.get_or_set('key', racing_compute), 'stale')
+        self.assertEqual(self.cache.get_or_set('key', self.compute), 1)
+
+    def test_caches_are_bypassed_until_the_bus_is_ready(self):
+        with mock.patch.object(invalidation.get_bus(), 'ready', return_value=False):
+            self.cache.get_or_set('key', self.compute)
+            self.cache.get_or_set('key', self.compute)
+        self.assertEqual(self.calls, 2)
+
+    def test_listener_ignores_its_own_notifications(self):
+        bus = invalidation.PostgresBus()
+        self.cache.get_or_set('key', self.compute)
+        bus.receive(json.dumps({'origin': bus.origin, 'name': 'test_cache', 'key': 'key'}))
+        self.assertIn('key', self.cache.entries)
+        bus.receive(json.dumps({'origin': 'another-worker', 'name': 'test_cache', 'key': 'key'}))
+        self.assertNotIn('key', self.cache.entries)
+
+
+class CacheInvalidationSignalTests(TestCase):
+    """Writes evict the cached entries they affect once they commit."""
+
+    def setUp(self):
+        for cache in (appointment_types, patient_charts):
+            cache.evict()
+            self.addCleanup(cache.evict)
+
+    def cached(self, cache, key):
+        cache.entries[key] = ('cached', float('inf'))
+
+    def test_reads_inside_a_transaction_bypass_the_cache(self):
+        self.cached(appointment_types, 'active')
+        AppointmentType.objects.create(name='Consultation', duration_minutes=30)
+        self.assertEqual([kind.name for kind in active_appointment_types()], ['Consultation'])
+
+    def test_appointment_type_changes_evict_the_lists(self):
+        self.cached(appointment_types, 'active')
+        with self.captureOnCommitCallbacks(execute=True):
+            AppointmentType.objects.create(name='Consultation', duration_minutes=30)
+            self.assertIn('active', appointment_types.entries)
+        self.assertNotIn('active', appointment_types.entries)
+
+    def test_chart_changes_evict_only_that_patient(self):
+        patient = create_patient()
+        other = create_patient(medical_record_number='MRN-0002')
+        self.cached(patient_charts, patient.pk)
+        self.cached(patient_charts, other.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Allergy.objects.create(
+                patient=patient, allergy_type='medication', allergen='Penicillin', reaction='Rash', severity='moderate'
+            )
+
+        self.assertNotIn(patient.pk, patient_charts.entries)
+        self.assertIn(other.pk, patient_charts.entries)
+
+    def test_postgres_bus_notifies_other_workers(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('LISTEN/NOTIFY is PostgreSQL only.')
+        bus = invalidation.PostgresBus()
+        with CaptureQueriesContext(connection) as queries:
+            bus.invalidate('patient_chart', 1)
+        self.assertIn('pg_notify', queries.captured_queries[-1]['sql'])
+
+
+class DashboardStatsViewTests(TransactionTestCase):
+    """The async stats endpoint runs its counts concurrently, each on its own connection."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+        self.patient = create_patient()
+        appointment_type = AppointmentType.objects.create(name='Consultation')
+        Appointment.objects.create(
+            patient=self.patient, appointment_type=appointment_type, provider=self.user, created_by=self.user,
+            start_time=timezone.now(), end_time=timezone.now() + timedelta(minutes=30), status='scheduled',
+            reason='Checkup',
+        )
+
+    def test_counts_match_the_sync_rollup(self):
+        self.client.force_login(self.user)
+        with mock.patch('dashboard.stats.run_query', wraps=stats.run_query) as run_query:
+            response = self.client.get(reverse('dashboard_stats'))
+        self.assertEqual(run_query.call_count, 2)
+        self.assertEqual(response.json(), stats.compute_stats(timezone.localdate()))
+
+    def test_fresh_rollups_are_served_from_the_cache(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('dashboard_stats'))
+        with mock.patch('dashboard.stats.run_query') as run_query:
+            self.assertEqual(self.client.get(reverse('dashboard_stats')).json()['total_patients'], 1)
+        run_query.assert_not_called()
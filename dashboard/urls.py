@@ -6,4 +6,6 @@ urlpatterns = [
     path('medical-references/', views.medical_references, name='medical_references'),
     path('drug-interaction/', views.check_drug_interaction, name='drug_interaction'),
     path('medical-calculator/', views.medical_calculator, name='medical_calculator'),
+    path('stats/', views.dashboard_stats, name='dashboard_stats'),
+    path('live/', views.live_updates, name='live_updates'),
 ]
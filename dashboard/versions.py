@@ -0,0 +1,37 @@
+"""
+Version counters for data that cached content depends on.
+
+Cached fragments and rollups put the versions of their inputs in their keys
+(or store them alongside), and writes bump the versions, so stale entries are
+simply never looked up again. Counters live in the shared cache; a counter
+that is missing or evicted restarts from the current time in nanoseconds
+rather than from zero, so it can never repeat a value an old entry used.
+"""
+
+import time
+
+from django.core.cache import cache
+
+VERSION_TIMEOUT = None
+
+def version_key(name):
+    return f'version:{name}'
+
+def get_versions(*names):
+    """Return ``{name: version}`` for ``names`` in one cache round trip."""
+    keys = {version_key(name): name for name in names}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        cache.add(key, time.time_ns(), VERSION_TIMEOUT)
+        found[key] = cache.get(key)
+    return {keys[key]: value for key, value in found.items()}
+
+def bump(*names):
+    for name in names:
+        try:
+            cache.incr(version_key(name))
+        except ValueError:
+            cache.add(version_key(name), time.time_ns(), VERSION_TIMEOUT)
+
+def recent_patients_version_name(user_id):
+    return f'recent-patients:{user_id}'
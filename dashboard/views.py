@@ -1,64 +1,129 @@
+import asyncio
+import json
+import re
+
 from django.shortcuts import render
-from django.contrib.auth.decorators import login_required
-from django.db.models import Count, Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from datetime import timedelta
 
 from patients.models import Patient, RecentPatient
-from appointments.models import Appointment
+from appointments.models import Appointment, day_start
+from authentication.decorators import login_required
+from authentication.permissions import filter_queryset
+from docsdash.replicas import primary_reads
 from .forms import DrugInteractionForm, MedicalCalculatorForm
+from .models import Alert
+from . import live, stats, versions
+
+# Seconds between keep-alive comments on idle live update streams
+LIVE_HEARTBEAT_SECONDS = 25
+
+LIVE_CHANNEL_PATTERN = re.compile(r'^(dashboard|patient\.\d+)$')
 
+# Always reads the primary: lists and stats are cached under the current
+# versions, and a lagging replica read would be cached as if it were current
 @login_required
+@primary_reads
 def dashboard(request):
     """Main dashboard view."""
     
-    # Get current date
-    today = timezone.now().date()
+    # Get current date in the clinic's timezone
+    today = timezone.localdate()
     tomorrow = today + timedelta(days=1)
     
-    # Today's appointments
-    todays_appointments = Appointment.objects.filter(
-        start_time__date=today
-    ).order_by('start_time')
+    # Cached fragments and the stats rollup are keyed on these versions
+    recent_version_name = versions.recent_patients_version_name(request.user.pk)
+    dependency_versions = versions.get_versions('appointments', 'patients', recent_version_name)
     
-    # Tomorrow's appointments
-    tomorrows_appointments = Appointment.objects.filter(
-        start_time__date=tomorrow
+    # Both lists come from one query, which only runs when one of their cached
+    # fragments has to be rendered again
+    appointments = Appointment.objects.between_dates(today, tomorrow).select_related(
+        'patient', 'appointment_type'
     ).order_by('start_time')
+    tomorrow_start = day_start(tomorrow)
+    todays_appointments = SimpleLazyObject(
+        lambda: [appointment for appointment in appointments if appointment.start_time < tomorrow_start]
+    )
+    tomorrows_appointments = SimpleLazyObject(
+        lambda: [appointment for appointment in appointments if appointment.start_time >= tomorrow_start]
+    )
     
     # Recent patients for this user
-    recent_patients = RecentPatient.objects.filter(user=request.user)[:5]
-    
-    # Stats for quick view
-    total_patients = Patient.objects.count()
-    active_patients = Patient.objects.filter(is_active=True).count()
+    recent_patients = RecentPatient.objects.filter(user=request.user).select_related('patient')[:5]
     
-    appointments_today = todays_appointments.count()
-    appointments_tomorrow = tomorrows_appointments.count()
+    # Stats for quick view, shared by all users. Never computed here: when the
+    # rollup is missing or out of date the page fetches it from dashboard_stats
+    quick_stats, stats_pending = stats.current_stats(today, dependency_versions)
     
-    upcoming_appointments = Appointment.objects.filter(
-        start_time__date__gt=today,
-        start_time__date__lte=today + timedelta(days=7),
-        status__in=['scheduled', 'confirmed']
-    ).count()
-    
-    # Get alerts (in a real app, this would include overdue follow-ups, critical lab results, etc.)
-    alerts = []
+    # Alerts are precomputed by the rules in dashboard.alerts
+    alerts = Alert.objects.filter(user=request.user, resolved_at__isnull=True).order_by('-created_at')[:10]
     
     context = {
         'todays_appointments': todays_appointments,
         'tomorrows_appointments': tomorrows_appointments,
         'recent_patients': recent_patients,
-        'total_patients': total_patients,
-        'active_patients': active_patients,
-        'appointments_today': appointments_today,
-        'appointments_tomorrow': appointments_tomorrow,
-        'upcoming_appointments': upcoming_appointments,
         'alerts': alerts,
+        'today': today,
+        'appointments_version': dependency_versions['appointments'],
+        'patients_version': dependency_versions['patients'],
+        'recent_patients_version': dependency_versions[recent_version_name],
+        'stats_pending': stats_pending,
+        **(quick_stats or {}),
     }
     
     return render(request, 'dashboard/dashboard.html', context)
 
+# Primary only, for the same reason as the dashboard
+@login_required
+@primary_reads
+async def dashboard_stats(request):
+    """The dashboard counts as JSON, for clients refreshing them in place."""
+    
+    return JsonResponse(await stats.aget_stats())
+
+async def live_updates(request):
+    """Server-sent event stream of appointment, vitals and note changes.
+    
+    Clients pass the channels they care about, e.g. ``?channels=dashboard`` or
+    ``?channels=patient.42``. The view is async so idle streams only cost a
+    queue on the event loop; it must be served by the ASGI application.
+    """
+    
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    
+    channels = [channel for channel in request.GET.get('channels', 'dashboard').split(',') if channel]
+    if not channels or not all(LIVE_CHANNEL_PATTERN.match(channel) for channel in channels):
+        return HttpResponse('Invalid channels.', status=400)
+    
+    # Chart events carry vitals and notes, so only patients the user may view
+    patient_ids = {int(channel.split('.')[1]) for channel in channels if channel.startswith('patient.')}
+    if patient_ids:
+        permitted = filter_queryset(user, Patient.objects.filter(pk__in=patient_ids), 'patients.view')
+        if await permitted.acount() != len(patient_ids):
+            return HttpResponse(status=403)
+    
+    async def event_stream():
+        async with live.get_broker().subscribe(channels) as queue:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=LIVE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                data = json.dumps(message, cls=DjangoJSONEncoder)
+                yield f"event: {message['type']}\ndata: {data}\n\n"
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def medical_references(request):
     """View for medical reference tools."""
@@ -6,6 +6,9 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from docsdash.static import StaticFilesASGI
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'docsdash.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+# Static files are served in front of Django (see docsdash.static)
+application = StaticFilesASGI(get_asgi_application())
\ No newline at end of file
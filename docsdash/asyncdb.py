@@ -0,0 +1,26 @@
+"""
+Independent queries run concurrently from async code.
+
+Django's async ORM runs each query through ``sync_to_async`` on the request's
+single thread and connection, so awaiting several at once still runs them one
+after another. ``run_query`` runs a sync ORM function on a thread of its own,
+with its own connection that is closed (or handed back to the pool, see
+docsdash.postgresql_pool) when it finishes, so ``asyncio.gather`` over
+several calls overlaps their round trips.
+
+Each call sees only committed data, so don't use it for reads that must see
+the caller's uncommitted writes.
+"""
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+def call_and_close(func, *args):
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+async def run_query(func, *args):
+    """Await sync ``func(*args)`` on its own thread and database connection."""
+    return await sync_to_async(call_and_close, thread_sensitive=False)(func, *args)
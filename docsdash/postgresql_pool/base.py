@@ -0,0 +1,110 @@
+"""
+PostgreSQL backend that keeps connections open in a per-process pool.
+
+Django closes its connection at the end of every request (``CONN_MAX_AGE``
+is 0 with this backend); here closing returns it to the pool instead, so the
+next request on any thread reuses it without a TCP and authentication
+handshake. Pool settings go in ``OPTIONS['pool']``, e.g.::
+
+    'OPTIONS': {'pool': {'max_size': 10, 'min_size': 2, 'timeout': 10}}
+
+See docsdash.postgresql_pool.pool for the options. A connection closed in
+the middle of a transaction, or one that errored, is closed for real; any
+other is reset with ``DISCARD ALL`` before it goes back.
+"""
+
+import threading
+
+import psycopg2
+from django.db.backends.postgresql import base, creation
+
+from .pool import ConnectionPool, PoolTimeout
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(key, factory):
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = factory()
+        return _pools[key]
+
+def pools():
+    """{alias: pool} for every pool open in this process."""
+    with _pools_lock:
+        return {key[0]: pool for key, pool in _pools.items()}
+
+def close_pools(database=None, alias=None):
+    """Close every pool, or those for ``database`` or ``alias``."""
+    with _pools_lock:
+        closing = [
+            key for key in _pools
+            if (database is None or dict(key[1]).get('dbname') == database) and (alias is None or key[0] == alias)
+        ]
+        closing = [_pools.pop(key) for key in closing]
+    for pool in closing:
+        pool.close()
+
+def check(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+def reset(connection):
+    """Roll back and discard session state; False if the connection is broken.
+
+    ``DISCARD ALL`` drops anything a request left on the session (``SET``s,
+    ``LISTEN``s, advisory locks, temporary tables) so it can't leak into the
+    next one. Django sets the time zone and role again on every checkout.
+    """
+    if connection.closed:
+        return False
+    try:
+        if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        # DISCARD ALL can't run inside a transaction block
+        autocommit = connection.autocommit
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute('DISCARD ALL')
+        connection.autocommit = autocommit
+    except psycopg2.Error:
+        return False
+    return connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep the test database from being dropped
+        close_pools(database=test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    @property
+    def pool(self):
+        params = self.get_connection_params()
+        key = (self.alias, tuple(sorted((name, str(value)) for name, value in params.items())))
+        options = self.settings_dict['OPTIONS'].get('pool', {})
+        return get_pool(key, lambda: ConnectionPool(check, reset, **options))
+
+    def get_new_connection(self, conn_params):
+        try:
+            return self.pool.getconn(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        except PoolTimeout as error:
+            # Surfaces as django.db.OperationalError
+            raise psycopg2.OperationalError(str(error)) from error
+
+    def _close(self):
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            if self.in_atomic_block or (self.errors_occurred and not self.is_usable()):
+                self.pool.discard(self.connection)
+            else:
+                self.pool.putconn(self.connection)
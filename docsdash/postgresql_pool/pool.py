@@ -0,0 +1,176 @@
+"""
+A thread-safe pool of open database connections.
+
+Connections are handed out most recently used first, so the ones that stay
+idle sit at the bottom of the stack and are closed after ``max_idle``
+seconds, down to ``min_size``. Connections older than ``max_lifetime`` are
+closed when they come back, so a failover or a changed password is picked up
+without a restart.
+
+When all ``max_size`` connections are in use, ``getconn`` waits up to
+``timeout`` seconds for one to come back. Connections that have been idle for
+``check_after`` seconds or more are health checked before they are handed
+out; ones that fail are closed and replaced.
+
+``stats()`` reports the pool's size and saturation and how long checkouts
+waited, for the metrics endpoint (see profiling.views).
+"""
+
+import threading
+import time
+
+class PoolTimeout(Exception):
+    """No connection came back within the pool's timeout."""
+
+class ConnectionPool:
+
+    def __init__(self, check, reset, max_size=10, min_size=0, timeout=10.0,
+                 max_idle=300.0, max_lifetime=1800.0, check_after=5.0):
+        # check(connection) raises if it is unusable, reset(connection) returns
+        # whether it can be reused
+        self.check = check
+        self.reset = reset
+        self.max_size = max_size
+        self.min_size = min_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+
+        self.condition = threading.Condition()
+        self.idle = []  # [(connection, opened_at, returned_at)], most recently returned last
+        self.opened_at = {}  # id(connection) -> opened_at, for connections in use
+        self.size = 0
+        self.closed = False
+        self.peak_in_use = 0
+        self.counters = dict.fromkeys(
+            ['checkouts', 'waits', 'timeouts', 'opened', 'failed_checks', 'closed_idle', 'closed_expired'], 0
+        )
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def getconn(self, connect):
+        """Check out a healthy connection, opening one with ``connect()`` if the pool has room."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            with self.condition:
+                self.evict_idle()
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters['timeouts'] += 1
+                        raise PoolTimeout(f"No connection available within {self.timeout} s ({self.max_size} in use)")
+                    waited = True
+                    self.condition.wait(remaining)
+                if self.idle:
+                    connection, opened_at, returned_at = self.idle.pop()
+                else:
+                    connection, opened_at, returned_at = None, None, None
+                    self.size += 1
+
+            if connection is None:
+                try:
+                    connection = connect()
+                except BaseException:
+                    self.release_slot()
+                    raise
+                opened_at = time.monotonic()
+                with self.condition:
+                    self.counters['opened'] += 1
+            elif time.monotonic() - returned_at >= self.check_after:
+                try:
+                    self.check(connection)
+                except Exception:
+                    with self.condition:
+                        self.counters['failed_checks'] += 1
+                    self.discard(connection)
+                    continue
+            with self.condition:
+                self.opened_at[id(connection)] = opened_at
+                self.record_checkout(started, waited)
+            return connection
+
+    def putconn(self, connection):
+        """Return a checked out connection; it is closed instead if it can't be reused."""
+        with self.condition:
+            opened_at = self.opened_at.get(id(connection))
+        if opened_at is None:
+            connection.close()
+            return
+        now = time.monotonic()
+        if self.closed or now - opened_at >= self.max_lifetime:
+            with self.condition:
+                self.counters['closed_expired'] += 1
+            self.discard(connection)
+        elif not self.reset(connection):
+            self.discard(connection)
+        else:
+            with self.condition:
+                del self.opened_at[id(connection)]
+                self.idle.append((connection, opened_at, now))
+                self.condition.notify()
+
+    def discard(self, connection):
+        """Close a checked out connection and free its slot."""
+        with self.condition:
+            self.opened_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self.release_slot()
+
+    def release_slot(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def record_checkout(self, started, waited):
+        # Called with the condition held
+        self.counters['checkouts'] += 1
+        if waited:
+            wait = time.monotonic() - started
+            self.counters['waits'] += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        self.peak_in_use = max(self.peak_in_use, self.size - len(self.idle))
+
+    def evict_idle(self):
+        """Close connections idle longer than ``max_idle``, keeping ``min_size`` open."""
+        # Called with the condition held
+        cutoff = time.monotonic() - self.max_idle
+        while self.idle and self.size > self.min_size and self.idle[0][2] < cutoff:
+            connection = self.idle.pop(0)[0]
+            self.size -= 1
+            self.counters['closed_idle'] += 1
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def close(self):
+        """Close every idle connection; ones in use are closed when they come back."""
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+            self.closed = True
+        for connection, _, _ in idle:
+            connection.close()
+
+    def stats(self):
+        with self.condition:
+            in_use = self.size - len(self.idle)
+            return {
+                'max_size': self.max_size,
+                'size': self.size,
+                'in_use': in_use,
+                'idle': len(self.idle),
+                'saturation': round(in_use / self.max_size, 3),
+                'peak_in_use': self.peak_in_use,
+                **self.counters,
+                'wait_ms_total': round(self.wait_seconds * 1000, 2),
+                'wait_ms_max': round(self.max_wait_seconds * 1000, 2),
+                'wait_ms_mean': round(self.wait_seconds * 1000 / self.counters['waits'], 2) if self.counters['waits'] else 0.0,
+            }
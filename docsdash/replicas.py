@@ -0,0 +1,247 @@
+"""
+Read replica routing.
+
+``ReplicaRouter`` sends reads to one of ``REPLICA_DATABASES`` only while a
+view has opted in with ``replica_reads`` (or, with ``REPLICA_READS_DEFAULT``,
+for every GET and HEAD request that hasn't opted out with ``primary_reads``).
+Everything else, all writes and any read inside a transaction on the primary
+goes to ``default``.
+
+Read-your-writes: once a request writes, the rest of it reads from the
+primary, and ``ReplicaRoutingMiddleware`` pins the session to the primary for
+``REPLICA_PIN_SECONDS`` so the next pages see the write too.
+
+Lag: each process checks a replica's replay lag at most every
+``REPLICA_LAG_CHECK_SECONDS``. Replicas further behind than
+``REPLICA_MAX_LAG_SECONDS``, that can't be reached or that aren't streaming
+from the primary get no reads until a later check finds them caught up; with
+none left reads use the primary.
+"""
+
+import logging
+import random
+import threading
+import time
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_SESSION_KEY = '_primary_pinned_until'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# NULL while the replica isn't streaming from the primary: a disconnected WAL
+# receiver has nothing left to replay, so its received and replayed positions
+# match however far behind it is. Otherwise zero once the replica has replayed
+# everything it received, or else the age of the last transaction it replayed.
+# Roles without pg_read_all_stats see a NULL status for a running receiver.
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming' OR status IS NULL
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+class Routing:
+    """Where the current request may read from."""
+
+    def __init__(self, replica=False, pinned_until=0.0):
+        self.replica = replica
+        self.pinned_until = pinned_until
+        self.wrote = False
+        self.parent = None
+        self.token = None
+
+    def reads_from_replica(self):
+        return self.replica and not self.wrote and self.pinned_until <= time.time()
+
+current_routing = ContextVar('current_routing', default=None)
+
+class ReplicaLag:
+    """Replay lag per replica, measured at most once per ``REPLICA_LAG_CHECK_SECONDS``."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}
+
+    def measure(self, alias):
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            return 0.0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            logger.warning("Replica %s is unreachable; reading from the primary", alias, exc_info=True)
+            return None
+        if lag is None:
+            logger.warning("Replica %s is not streaming from the primary; reading from the primary", alias)
+            return None
+        return float(lag)
+
+    def get(self, alias):
+        """Seconds ``alias`` is behind the primary, or None if it can't be reached."""
+        now = time.monotonic()
+        with self.lock:
+            checked_at, lag = self.checked.get(alias, (None, None))
+            if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_SECONDS:
+                return lag
+            # Later callers reuse the previous reading while this one measures
+            self.checked[alias] = (now, lag)
+        lag = self.measure(alias)
+        with self.lock:
+            self.checked[alias] = (time.monotonic(), lag)
+        if lag is not None and lag > settings.REPLICA_MAX_LAG_SECONDS:
+            logger.warning("Replica %s is %.1f s behind; reading from the primary", alias, lag)
+        return lag
+
+    def clear(self):
+        with self.lock:
+            self.checked.clear()
+
+replica_lag = ReplicaLag()
+
+def healthy_replicas():
+    """Replicas reachable and within ``REPLICA_MAX_LAG_SECONDS`` of the primary."""
+    healthy = []
+    for alias in settings.REPLICA_DATABASES:
+        lag = replica_lag.get(alias)
+        if lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS:
+            healthy.append(alias)
+    return healthy
+
+class ReplicaRouter:
+    """Reads go to a healthy replica when the current request allows it."""
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        routing = current_routing.get()
+        if routing is None or not routing.reads_from_replica():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+class route_reads(ContextDecorator):
+    """Read from replicas (``replica=True``) or the primary within a block or view."""
+
+    def __init__(self, replica):
+        self.replica = replica
+
+    def __enter__(self):
+        parent = current_routing.get()
+        routing = Routing(replica=self.replica, pinned_until=parent.pinned_until if parent else 0.0)
+        # A write earlier in the request keeps pinning the rest of it
+        routing.wrote = bool(parent and parent.wrote)
+        routing.parent = parent
+        routing.token = current_routing.set(routing)
+        return routing
+
+    def __exit__(self, *exc_info):
+        routing = current_routing.get()
+        current_routing.reset(routing.token)
+        if routing.parent is not None and routing.wrote:
+            routing.parent.wrote = True
+        return False
+
+    def __call__(self, func):
+        if not iscoroutinefunction(func):
+            return super().__call__(func)
+
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            with self:
+                return await func(*args, **kwargs)
+        return inner
+
+def replica_reads(view_func):
+    """Decorator for views whose GET and HEAD requests may read from a replica."""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_async_view(request, *args, **kwargs):
+            with route_reads(replica=request.method in SAFE_METHODS):
+                return await view_func(request, *args, **kwargs)
+        return _wrapped_async_view
+
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        with route_reads(replica=request.method in SAFE_METHODS):
+            return view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+# Decorator for views that must always read from the primary
+primary_reads = route_reads(replica=False)
+
+class ReplicaRoutingMiddleware:
+    """Scope replica routing to each request and pin sessions that write (see docsdash.replicas)."""
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = self.routing(request, request.session.get(PIN_SESSION_KEY, 0.0))
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        self.pin(request, routing)
+        return response
+
+    async def __acall__(self, request):
+        # Loading the session may query the database
+        pinned_until = await sync_to_async(request.session.get)(PIN_SESSION_KEY, 0.0)
+        routing = self.routing(request, pinned_until)
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        self.pin(request, routing)
+        return response
+
+    def routing(self, request, pinned_until):
+        return Routing(
+            replica=settings.REPLICA_READS_DEFAULT and request.method in SAFE_METHODS, pinned_until=pinned_until,
+        )
+
+    def pin(self, request, routing):
+        if routing.wrote:
+            request.session[PIN_SESSION_KEY] = time.time() + settings.REPLICA_PIN_SECONDS
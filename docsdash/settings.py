@@ -41,18 +41,22 @@ INSTALLED_APPS = [
     'patients.apps.PatientsConfig',
     'appointments.apps.AppointmentsConfig',
     'authentication.apps.AuthenticationConfig',
+    'jobs.apps.JobsConfig',
+    'profiling.apps.ProfilingConfig',
 ]
 
 # Tailwind app
 TAILWIND_APP_NAME = 'theme'
 
 MIDDLEWARE = [
+    'profiling.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'authentication.middleware.SessionActivityMiddleware',
+    'docsdash.replicas.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
@@ -71,6 +75,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'dashboard.context_processors.fragment_cache',
             ],
         },
     },
@@ -78,6 +83,68 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'docsdash.wsgi.application'
 
+# Request profiling (see profiling.middleware). Off unless PROFILING_ENABLED=1;
+# the test runner turns it on in strict mode, so over-budget views fail tests.
+# Budgets are per URL name; any of queries, duplicate_queries (repeats of one
+# SQL shape), db_ms, render_ms and total_ms. Counts include the session and
+# user lookups, the session save that slides its expiry (2 more for its
+# savepoint inside a test's transaction) and the periodic session activity
+# flush. The dashboard's own 3 queries are the same warm or cold (see
+# dashboard.stats); patient_detail's covers a cold chart (see patients.chart),
+# one query per list on top of the 4 for the page.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED') == '1'
+PROFILING_STRICT = False
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0.05'))
+TEST_RUNNER = 'docsdash.test_runner.ProfilingTestRunner'
+PROFILING_BUDGETS = {
+    'dashboard': {'queries': 9, 'duplicate_queries': 0},
+    'patient_detail': {'queries': 16, 'duplicate_queries': 0},
+    'patient_list': {'queries': 12, 'duplicate_queries': 2},
+    'appointment_list': {'queries': 12, 'duplicate_queries': 3},
+    'get_calendar_events': {'queries': 6, 'duplicate_queries': 0},
+}
+
+# Saved runs of `manage.py run_benchmarks`, compared with --compare
+BENCHMARK_RESULTS_DIR = BASE_DIR / 'benchmark_results'
+
+# Profiles are logged one JSON object per line, for `manage.py profile_report`
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'profiling': (
+            {'class': 'logging.FileHandler', 'filename': os.getenv('PROFILING_LOG_FILE')}
+            if os.getenv('PROFILING_LOG_FILE') else {'class': 'logging.StreamHandler'}
+        ),
+    },
+    'loggers': {
+        'profiling': {'handlers': ['profiling'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Live updates: 'local' for a single process, 'postgres' to relay via LISTEN/NOTIFY
+LIVE_UPDATES_BACKEND = os.getenv('LIVE_UPDATES_BACKEND', 'local')
+
+# Status given to scheduled/confirmed appointments left open once their day has passed
+APPOINTMENT_SWEEP_STATUS = 'no_show'
+
+# Shared cache for dashboard rollups and calendar feeds. Without REDIS_URL each
+# worker process falls back to its own in-memory cache, and whatever relies on
+# one process seeing another's writes checks SHARED_CACHE.
+SHARED_CACHE = bool(os.getenv('REDIS_URL'))
+if SHARED_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
+# Dashboard fragments are keyed on version counters kept in the cache (see
+# dashboard.versions). A per-process cache never sees the bumps made by other
+# workers, so without REDIS_URL the fragments are rendered on every request.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24 if SHARED_CACHE else 0
+
 # Database
 #DATABASES = {
 #    'default': {
@@ -88,9 +155,38 @@ WSGI_APPLICATION = 'docsdash.wsgi.application'
 
 tmpPostgres = urlparse(os.getenv("DATABASE_URL"))
 
+# Connections are pooled per process (see docsdash.postgresql_pool) unless
+# DATABASE_POOL_SIZE is 0, in which case each thread keeps its own persistent
+# connection, health checked before reuse.
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '10'))
+if DATABASE_POOL_SIZE:
+    DATABASE_CONNECTION = {
+        'ENGINE': 'docsdash.postgresql_pool',
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            'pool': {
+                'max_size': DATABASE_POOL_SIZE,
+                'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', '2')),
+                # Seconds to wait for a free connection
+                'timeout': float(os.getenv('DATABASE_POOL_TIMEOUT', '10')),
+                # Idle connections above min_size are closed after this many seconds
+                'max_idle': 300,
+                'max_lifetime': 1800,
+                # Connections idle this long are checked with SELECT 1 on checkout
+                'check_after': 5,
+            },
+        },
+    }
+else:
+    DATABASE_CONNECTION = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    }
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        **DATABASE_CONNECTION,
         'NAME': tmpPostgres.path.replace('/', ''),
         'USER': tmpPostgres.username,
         'PASSWORD': tmpPostgres.password,
@@ -99,6 +195,41 @@ DATABASES = {
     }
 }
 
+# Read replicas (see docsdash.replicas), as a comma-separated list of URLs.
+# Views opt in to replica reads with @replica_reads; REPLICA_READS_DEFAULT
+# sends every GET to the replicas unless the view opts out with @primary_reads.
+REPLICA_DATABASES = []
+for number, replica_url in enumerate(filter(None, os.getenv('REPLICA_DATABASE_URLS', '').split(',')), 1):
+    replica = urlparse(replica_url.strip())
+    DATABASES[f'replica{number}'] = {
+        **DATABASE_CONNECTION,
+        'NAME': replica.path.replace('/', ''),
+        'USER': replica.username,
+        'PASSWORD': replica.password,
+        'HOST': replica.hostname,
+        'PORT': replica.port or 5432,
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['docsdash.replicas.ReplicaRouter']
+REPLICA_READS_DEFAULT = False
+# Seconds a session reads from the primary after writing
+REPLICA_PIN_SECONDS = 5
+# Replicas further behind than this get no reads
+REPLICA_MAX_LAG_SECONDS = 2
+REPLICA_LAG_CHECK_SECONDS = 5
+
+# In-process caches (see dashboard.invalidation). 'postgres' tells every
+# worker of a change through LISTEN/NOTIFY; 'local' only evicts in the
+# process that wrote, so other workers would serve stale charts, and is only
+# safe with a single worker process.
+CACHE_INVALIDATION_BACKEND = os.getenv('CACHE_INVALIDATION_BACKEND', 'postgres')
+# Upper bound on how long a cached value is served, whatever the backend
+LOCAL_CACHE_TIMEOUT = 300
+# Entries kept per cache and process, least recently used dropped first
+LOCAL_CACHE_MAX_ENTRIES = 1000
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -124,9 +255,42 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 
+# Login attempts and session records are written in batches (see authentication.audit)
+LOGIN_AUDIT_BATCH_SIZE = 100
+LOGIN_AUDIT_FLUSH_SECONDS = 2
+
+# Failed logins allowed per sliding window before a lockout (see authentication.throttle).
+# The IP limit is higher because a clinic's staff often share one address. The
+# counters are kept in the cache, so without REDIS_URL each worker counts alone.
+LOGIN_THROTTLE_WINDOW_SECONDS = 15 * 60
+LOGIN_THROTTLE_IP_LIMIT = 50
+LOGIN_THROTTLE_EMAIL_LIMIT = 5
+LOGIN_LOCKOUT_BASE_SECONDS = 60
+LOGIN_LOCKOUT_MAX_SECONDS = 60 * 60
+
+# Login attempts and session records are dropped a month at a time after these
+# many days (see authentication.retention)
+LOGIN_ATTEMPT_RETENTION_DAYS = 180
+USER_SESSION_RETENTION_DAYS = 365
+
+# Succeeded and failed background jobs are deleted after this many days (see jobs.retention)
+JOB_RETENTION_DAYS = 7
+
 # Session security
 SESSION_COOKIE_AGE = 3600  # 1 hour
-SESSION_SAVE_EVERY_REQUEST = True
+# Rather than saving the session on every request, SessionActivityMiddleware
+# saves it at most this often to slide the expiry, so an idle session lasts
+# between SESSION_COOKIE_AGE - SESSION_REFRESH_SECONDS and SESSION_COOKIE_AGE
+SESSION_REFRESH_SECONDS = 300
+# Sessions live only in the shared cache when there is one. Without it they
+# stay in the database: a per-process cache would keep serving a session on
+# the other workers after logout deleted it.
+SESSION_ENGINE = (
+    'django.contrib.sessions.backends.cache' if SHARED_CACHE
+    else 'django.contrib.sessions.backends.db'
+)
+# UserSession.last_activity is written at most this often per session and process
+SESSION_ACTIVITY_FLUSH_SECONDS = 60
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 SESSION_COOKIE_SECURE = True  # Only send over HTTPS
 CSRF_COOKIE_SECURE = True
@@ -157,6 +321,10 @@ COMPRESS_PRECOMPILERS = (
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Patient exports hold PHI, so they are kept outside MEDIA_ROOT and only
+# served to their requester by patients.views.download_export
+PATIENT_EXPORT_ROOT = os.getenv('PATIENT_EXPORT_ROOT', os.path.join(BASE_DIR, 'private', 'exports'))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
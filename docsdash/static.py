@@ -0,0 +1,89 @@
+"""
+Static files served in front of Django rather than from its middleware.
+
+WhiteNoise 6.5's middleware is sync only, so with it in ``MIDDLEWARE`` the
+ASGI handler runs the whole middleware chain, and every async view under it,
+through ``SyncToAsync`` on a thread. Instead both entry points wrap Django's
+application: ``StaticFilesWSGI`` in docsdash.wsgi and ``StaticFilesASGI`` in
+docsdash.asgi. Requests for static files are answered there, and everything
+else reaches Django, whose middleware chain stays async end to end under
+ASGI.
+
+Files are looked up and their headers built by WhiteNoise, configured by the
+usual ``WHITENOISE_*`` settings, so caching, compression and range requests
+behave as they did with the middleware.
+"""
+
+from http import HTTPStatus
+
+from asgiref.sync import sync_to_async
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.string_utils import decode_path_info
+
+# Bytes read from a static file per ASGI message
+CHUNK_SIZE = 64 * 1024
+
+class StaticFiles:
+    """Wraps ``application``, answering requests for static files itself."""
+
+    def __init__(self, application):
+        self.application = application
+        # Builds WhiteNoise's index of files from the Django settings
+        self.whitenoise = WhiteNoiseMiddleware()
+
+    def find(self, path):
+        if self.whitenoise.autorefresh:
+            return self.whitenoise.find_file(path)
+        return self.whitenoise.files.get(path)
+
+class StaticFilesWSGI(StaticFiles):
+
+    def __call__(self, environ, start_response):
+        static_file = self.find(decode_path_info(environ.get('PATH_INFO', '')))
+        if static_file is None:
+            return self.application(environ, start_response)
+        return WhiteNoise.serve(static_file, environ, start_response)
+
+def request_headers(scope):
+    """The scope's headers as WSGI environ keys, which WhiteNoise reads."""
+    headers = {}
+    for name, value in scope['headers']:
+        key = 'HTTP_' + name.decode('latin-1').upper().replace('-', '_')
+        headers[key] = f"{headers[key]},{value.decode('latin-1')}" if key in headers else value.decode('latin-1')
+    return headers
+
+class StaticFilesASGI(StaticFiles):
+
+    async def __call__(self, scope, receive, send):
+        static_file = None
+        if scope['type'] == 'http':
+            path = scope['path'].removeprefix(scope.get('root_path', ''))
+            static_file = self.find(path)
+        if static_file is None:
+            return await self.application(scope, receive, send)
+        await self.serve(static_file, scope, send)
+
+    async def serve(self, static_file, scope, send):
+        # Opens the file, so off the event loop
+        response = await sync_to_async(static_file.get_response, thread_sensitive=False)(
+            scope['method'], request_headers(scope),
+        )
+        await send({
+            'type': 'http.response.start',
+            'status': int(response.status),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers],
+        })
+        if response.file is None or response.status == HTTPStatus.NOT_MODIFIED:
+            await send({'type': 'http.response.body'})
+            return
+        read = sync_to_async(response.file.read, thread_sensitive=False)
+        try:
+            while True:
+                chunk = await read(CHUNK_SIZE)
+                more_body = len(chunk) == CHUNK_SIZE
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
+                if not more_body:
+                    break
+        finally:
+            response.file.close()
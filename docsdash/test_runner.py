@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+class ProfilingTestRunner(DiscoverRunner):
+    """Django's runner with request profiling in strict mode, so views over their budget fail tests."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.PROFILING_ENABLED = True
+        settings.PROFILING_STRICT = True
+        settings.PROFILING_SAMPLE_RATE = 0
+        # Tests run in one process, and a listener connection would keep the
+        # test database from being dropped
+        settings.CACHE_INVALIDATION_BACKEND = 'local'
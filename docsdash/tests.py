@@ -0,0 +1,377 @@
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection, router
+from django.db.utils import load_backend
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.module_loading import import_string
+
+from authentication.models import User
+from .postgresql_pool.base import close_pools, pools
+from .postgresql_pool.pool import ConnectionPool, PoolTimeout
+from .static import StaticFilesASGI
+from .replicas import (
+    PIN_SESSION_KEY, ReplicaLag, ReplicaRoutingMiddleware, primary_reads, replica_lag, replica_reads, route_reads,
+)
+
+
+@override_settings(
+    REPLICA_DATABASES=['replica1', 'replica2'], REPLICA_MAX_LAG_SECONDS=2, REPLICA_LAG_CHECK_SECONDS=5,
+    REPLICA_PIN_SECONDS=5, REPLICA_READS_DEFAULT=False,
+)
+class ReplicaRoutingTests(SimpleTestCase):
+    """Reads go to a replica only when allowed, caught up and not pinned by a write."""
+
+    def setUp(self):
+        replica_lag.clear()
+        self.addCleanup(replica_lag.clear)
+        self.lag = {'replica1': 0.0, 'replica2': 0.0}
+        patcher = mock.patch.object(replica_lag, 'measure', side_effect=lambda alias: self.lag[alias])
+        self.measure = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def request(self, view, method='get', session=None):
+        request = getattr(self.factory, method)('/')
+        request.session = session if session is not None else {}
+        return ReplicaRoutingMiddleware(view)(request), request.session
+
+    def test_reads_use_the_primary_unless_a_view_opts_in(self):
+        self.assertEqual(router.db_for_read(User), 'default')
+        with route_reads(replica=True):
+            self.assertIn(router.db_for_read(User), ['replica1', 'replica2'])
+            with primary_reads:
+                self.assertEqual(router.db_for_read(User), 'default')
+        self.assertEqual(router.db_for_write(User), 'default')
+
+    def test_opted_in_views_only_use_replicas_for_safe_methods(self):
+        reads = []
+
+        @replica_reads
+        def view(request):
+            reads.append(router.db_for_read(User))
+            return HttpResponse()
+
+        self.request(view)
+        self.request(view, method='post')
+        self.assertIn(reads[0], ['replica1', 'replica2'])
+        self.assertEqual(reads[1], 'default')
+
+    def test_writes_pin_the_rest_of_the_request_and_the_session(self):
+        reads = []
+
+        @replica_reads
+        def view(request):
+            reads.append(router.db_for_read(User))
+            if request.GET.get('write'):
+                router.db_for_write(User)
+                reads.append(router.db_for_read(User))
+            return HttpResponse()
+
+        with mock.patch('docsdash.replicas.time.time', return_value=1000.0):
+            _, session = self.request(view)
+            self.assertNotIn(PIN_SESSION_KEY, session)
+
+            request = self.factory.get('/', {'write': '1'})
+            request.session = session
+            ReplicaRoutingMiddleware(view)(request)
+            self.assertEqual(session[PIN_SESSION_KEY], 1005.0)
+
+            self.request(view, session=session)
+        with mock.patch('docsdash.replicas.time.time', return_value=1006.0):
+            self.request(view, session=session)
+
+        self.assertIn(reads[0], ['replica1', 'replica2'])
+        self.assertIn(reads[1], ['replica1', 'replica2'])
+        self.assertEqual(reads[2:4], ['default', 'default'])
+        self.assertIn(reads[4], ['replica1', 'replica2'])
+
+    def test_lagging_or_unreachable_replicas_are_skipped(self):
+        self.lag.update(replica1=30.0, replica2=None)
+        with route_reads(replica=True), self.assertLogs('docsdash.replicas', 'WARNING') as logs:
+            self.assertEqual(router.db_for_read(User), 'default')
+        self.assertIn('Replica replica1 is 30.0 s behind', logs.output[0])
+
+        self.lag.update(replica2=0.5)
+        replica_lag.clear()
+        with route_reads(replica=True), self.assertLogs('docsdash.replicas', 'WARNING'):
+            self.assertEqual({router.db_for_read(User) for _ in range(10)}, {'replica2'})
+
+    def test_replicas_not_streaming_count_as_unreachable(self):
+        replica = mock.MagicMock(vendor='postgresql')
+        replica.cursor.return_value.__enter__.return_value.fetchone.return_value = (None,)
+
+        with mock.patch('docsdash.replicas.connections', {'replica1': replica}), \
+                self.assertLogs('docsdash.replicas', 'WARNING') as logs:
+            self.assertIsNone(ReplicaLag().measure('replica1'))
+        self.assertIn('Replica replica1 is not streaming from the primary', logs.output[0])
+
+    def test_lag_is_measured_once_per_interval(self):
+        with route_reads(replica=True):
+            for _ in range(5):
+                router.db_for_read(User)
+        self.assertEqual(self.measure.call_count, 2)
+
+    def test_reads_follow_the_instance_they_relate_to(self):
+        user = User(email='doctor@example.com')
+        user._state.db = 'default'
+        with route_reads(replica=True):
+            self.assertEqual(router.db_for_read(User, instance=user), 'default')
+
+    def test_async_views_are_routed_and_pinned_the_same_way(self):
+        reads = []
+
+        @replica_reads
+        async def view(request):
+            reads.append(router.db_for_read(User))
+            if request.GET.get('write'):
+                router.db_for_write(User)
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        request = self.factory.get('/', {'write': '1'})
+        request.session = {}
+        async_to_sync(middleware)(request)
+
+        self.assertIn(reads[0], ['replica1', 'replica2'])
+        self.assertIn(PIN_SESSION_KEY, request.session)
+
+    @override_settings(REPLICA_READS_DEFAULT=True)
+    def test_views_can_opt_out_when_replicas_are_the_default(self):
+        reads = []
+
+        def view(request):
+            reads.append(router.db_for_read(User))
+            return HttpResponse()
+
+        self.request(view)
+        self.request(primary_reads(view))
+        self.assertIn(reads[0], ['replica1', 'replica2'])
+        self.assertEqual(reads[1], 'default')
+
+
+class ReplicaLagQueryTests(TestCase):
+    """The lag query runs on PostgreSQL and reads zero on a primary."""
+
+    def test_primary_has_no_lag(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Replica lag is only measured on PostgreSQL.')
+        self.assertEqual(ReplicaLag().measure('default'), 0.0)
+
+
+class FakeConnection:
+    opened = 0
+
+    def __init__(self):
+        FakeConnection.opened += 1
+        self.closed = False
+        self.healthy = True
+
+    def close(self):
+        self.closed = True
+
+
+def check(connection):
+    if not connection.healthy:
+        raise ConnectionError
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Connections are reused, bounded, health checked and evicted when idle."""
+
+    def setUp(self):
+        FakeConnection.opened = 0
+        self.now = 1000.0
+        patcher = mock.patch('docsdash.postgresql_pool.pool.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_pool(self, **options):
+        return ConnectionPool(check, lambda connection: not connection.closed, **options)
+
+    def test_connections_are_reused(self):
+        pool = self.make_pool(max_size=2)
+        for _ in range(5):
+            pool.putconn(pool.getconn(FakeConnection))
+        self.assertEqual(FakeConnection.opened, 1)
+        self.assertEqual(pool.stats()['checkouts'], 5)
+        self.assertEqual((pool.stats()['size'], pool.stats()['idle']), (1, 1))
+
+    def test_checkouts_wait_for_a_free_connection_and_time_out(self):
+        pool = self.make_pool(max_size=1, timeout=0.0)
+        held = pool.getconn(FakeConnection)
+        self.assertEqual(pool.stats()['saturation'], 1.0)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(FakeConnection)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+        pool.putconn(held)
+        self.assertIs(pool.getconn(FakeConnection), held)
+
+    def test_waiting_checkouts_get_returned_connections(self):
+        pool = self.make_pool(max_size=1, timeout=5.0)
+        held = pool.getconn(FakeConnection)
+        received = []
+        waiter = threading.Thread(target=lambda: received.append(pool.getconn(FakeConnection)))
+        waiter.start()
+        while not pool.condition._waiters:
+            time.sleep(0.001)
+        pool.putconn(held)
+        waiter.join()
+
+        self.assertEqual(received, [held])
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_idle_connections_are_health_checked_and_replaced(self):
+        pool = self.make_pool(check_after=5.0)
+        connection = pool.getconn(FakeConnection)
+        pool.putconn(connection)
+        connection.healthy = False
+
+        self.now += 1
+        self.assertIs(pool.getconn(FakeConnection), connection)
+        pool.putconn(connection)
+        self.now += 10
+        replacement = pool.getconn(FakeConnection)
+
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['failed_checks'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_idle_connections_are_evicted_down_to_min_size(self):
+        pool = self.make_pool(max_size=3, min_size=1, max_idle=60.0)
+        connections = [pool.getconn(FakeConnection) for _ in range(3)]
+        for connection in connections:
+            pool.putconn(connection)
+
+        self.now += 61
+        pool.putconn(pool.getconn(FakeConnection))
+
+        self.assertEqual(pool.stats()['size'], 1)
+        self.assertEqual(pool.stats()['closed_idle'], 2)
+        self.assertEqual(sum(connection.closed for connection in connections), 2)
+
+    def test_broken_and_expired_connections_are_closed_on_return(self):
+        pool = self.make_pool(max_lifetime=600.0)
+        broken = pool.getconn(FakeConnection)
+        broken.closed = True
+        pool.putconn(broken)
+        self.assertEqual(pool.stats()['size'], 0)
+
+        old = pool.getconn(FakeConnection)
+        self.now += 601
+        pool.putconn(old)
+        self.assertTrue(old.closed)
+        self.assertEqual(pool.stats()['closed_expired'], 1)
+
+
+class PooledBackendTests(TestCase):
+    """The pooled backend hands a closed connection to the next checkout."""
+
+    def setUp(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('The pooled backend is PostgreSQL only.')
+        self.addCleanup(close_pools, alias='pooled_test')
+
+    def wrapper(self):
+        engine = 'docsdash.postgresql_pool'
+        settings_dict = {
+            **connection.settings_dict, 'ENGINE': engine, 'CONN_MAX_AGE': 0, 'OPTIONS': {'pool': {'max_size': 2}},
+        }
+        return load_backend(engine).DatabaseWrapper(settings_dict, 'pooled_test')
+
+    def test_connections_are_returned_and_reused(self):
+        first, second = self.wrapper(), self.wrapper()
+        first.ensure_connection()
+        raw = first.connection
+        first.close()
+        with second.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertIs(second.connection, raw)
+        self.assertEqual(pools()['pooled_test'].stats()['opened'], 1)
+        second.close()
+
+    def test_session_state_is_discarded_before_reuse(self):
+        first, second = self.wrapper(), self.wrapper()
+        with first.cursor() as cursor:
+            cursor.execute("SET application_name = 'leaked'")
+            cursor.execute('CREATE TEMPORARY TABLE leaked (id int)')
+            cursor.execute('SELECT pg_advisory_lock(4242)')
+            cursor.execute('LISTEN leaked')
+        raw = first.connection
+        first.close()
+        with second.cursor() as cursor:
+            self.assertIs(second.connection, raw)
+            cursor.execute('SHOW application_name')
+            self.assertNotEqual(cursor.fetchone()[0], 'leaked')
+            cursor.execute("SELECT to_regclass('pg_temp.leaked')")
+            self.assertIsNone(cursor.fetchone()[0])
+            cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute('SELECT count(*) FROM pg_listening_channels()')
+            self.assertEqual(cursor.fetchone()[0], 0)
+        second.close()
+
+    def test_connections_closed_in_a_transaction_are_discarded(self):
+        wrapper = self.wrapper()
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        wrapper.in_atomic_block = True
+        wrapper.close()
+        wrapper.in_atomic_block = False
+        self.assertTrue(raw.closed)
+        self.assertEqual(pools()['pooled_test'].stats()['size'], 0)
+
+
+class StaticFilesTests(SimpleTestCase):
+    """Static files are answered in front of Django, which keeps its middleware chain async."""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        Path(root, 'app.css').write_text('body {}')
+        overrides = override_settings(
+            STATIC_ROOT=root, STATIC_URL='/static/', WHITENOISE_AUTOREFRESH=False, WHITENOISE_USE_FINDERS=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def request(self, path, headers=()):
+        async def django(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'django'})
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'root_path': '', 'headers': list(headers)}
+        async_to_sync(StaticFilesASGI(django))(scope, receive, send)
+        headers = {name.decode(): value.decode() for name, value in messages[0]['headers']}
+        return messages[0]['status'], headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+    def test_static_files_are_served_under_asgi(self):
+        status, headers, body = self.request('/static/app.css')
+        self.assertEqual((status, body), (200, b'body {}'))
+        self.assertEqual(headers['content-type'], 'text/css; charset="utf-8"')
+        self.assertEqual(self.request('/patients/')[::2], (404, b'django'))
+
+    def test_conditional_requests_are_answered(self):
+        etag = self.request('/static/app.css')[1]['etag']
+        self.assertEqual(self.request('/static/app.css', [(b'if-none-match', etag.encode())])[::2], (304, b''))
+
+    def test_middleware_chain_is_async_capable(self):
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(path), 'async_capable', False), path)
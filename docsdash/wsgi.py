@@ -6,6 +6,9 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from docsdash.static import StaticFilesWSGI
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'docsdash.settings')
 
-application = get_wsgi_application()
\ No newline at end of file
+# Static files are served in front of Django (see docsdash.static)
+application = StaticFilesWSGI(get_wsgi_application())
\ No newline at end of file
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from jobs.worker import Worker
+
+class Command(BaseCommand):
+    help = "Run a background job worker. Start several for concurrency; no message broker is needed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Thread pool size for I/O bound tasks (0 runs them inline).")
+        parser.add_argument('--batch-size', type=int, default=10, help="Maximum jobs claimed or in flight at once.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when no job is due.")
+        parser.add_argument('--once', action='store_true', help="Exit once no jobs are due instead of polling forever.")
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            threads=options['threads'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        )
+        self.stdout.write(f"Job worker {worker.name} started")
+        try:
+            worker.run(stop_when_idle=options['once'])
+        except KeyboardInterrupt:
+            self.stdout.write("Job worker stopped")
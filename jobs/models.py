@@ -0,0 +1,51 @@
+from django.db import models
+from django.utils import timezone
+
+class Job(models.Model):
+    """A unit of background work claimed and run by the ``run_jobs`` worker."""
+    
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+    
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        indexes = [
+            # Workers only ever scan the queued jobs in run order
+            models.Index(fields=['run_at'], condition=models.Q(status='queued'), name='job_queued_run_at_idx'),
+            models.Index(fields=['locked_at'], condition=models.Q(status='running'), name='job_running_locked_idx'),
+            # For the retention purge (see jobs.retention)
+            models.Index(
+                fields=['finished_at'], condition=models.Q(status__in=['succeeded', 'failed']),
+                name='job_finished_at_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.task} ({self.get_status_display()})"
+
+class PeriodicJob(models.Model):
+    """Schedule for a task that is enqueued every ``interval_seconds``."""
+    
+    task = models.CharField(max_length=200, unique=True)
+    interval_seconds = models.PositiveIntegerField()
+    next_run_at = models.DateTimeField(default=timezone.now)
+    is_active = models.BooleanField(default=True)
+    
+    def __str__(self):
+        return f"{self.task} every {self.interval_seconds}s"
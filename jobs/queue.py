@@ -0,0 +1,82 @@
+"""
+Task registry and enqueueing for the database-backed job queue.
+
+Declare tasks in an app's ``tasks.py`` with the ``task`` decorator and queue
+them with ``enqueue``. Because jobs are ordinary rows, enqueueing inside a
+transaction only makes the job visible to workers once that transaction
+commits, and a rolled back request leaves no job behind.
+
+    @task(executor='thread', max_attempts=5)
+    def send_reminder(appointment_id):
+        ...
+
+    enqueue(send_reminder, appointment.pk)
+"""
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Job
+
+EXECUTORS = ('inline', 'thread')
+
+registry = {}
+
+class Task:
+    """A registered background task."""
+
+    def __init__(self, func, name, max_attempts, executor, schedule):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r}; expected one of {EXECUTORS}.")
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.executor = executor
+        self.schedule = schedule
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<Task {self.name}>"
+
+def task(func=None, *, name=None, max_attempts=3, executor='inline', schedule=None):
+    """Register ``func`` as a background task.
+
+    ``executor='thread'`` runs the task on the worker's thread pool, for I/O
+    bound work such as e-mail or HTTP calls; ``'inline'`` tasks run one at a
+    time on the worker's main thread. ``schedule`` (a timedelta) also makes the
+    worker enqueue the task periodically.
+    """
+    def register(func):
+        task_name = name or f"{func.__module__}.{func.__qualname__}"
+        registered = Task(func, task_name, max_attempts, executor, schedule)
+        registry[task_name] = registered
+        return registered
+
+    if func is not None:
+        return register(func)
+    return register
+
+def get_task(name):
+    try:
+        return registry[name]
+    except KeyError:
+        raise LookupError(f"No task registered as {name!r}.") from None
+
+def enqueue(task_ref, *args, run_at=None, delay=None, **kwargs):
+    """Queue ``task_ref`` (a Task or its registered name) and return the Job.
+
+    Arguments must be JSON-serializable; pass primary keys, not model instances.
+    """
+    registered = task_ref if isinstance(task_ref, Task) else get_task(task_ref)
+    if run_at is None:
+        run_at = timezone.now() + (delay or timedelta(0))
+    return Job.objects.create(
+        task=registered.name,
+        args=list(args),
+        kwargs=kwargs,
+        run_at=run_at,
+        max_attempts=registered.max_attempts,
+    )
@@ -0,0 +1,34 @@
+"""
+Retention for finished jobs.
+
+Succeeded and failed jobs are kept ``JOB_RETENTION_DAYS`` after they finish,
+for inspection in the admin, then deleted in bounded batches by the periodic
+``purge_finished_jobs`` task, so the queue table stays the size of the work
+actually in flight.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job
+
+PURGE_BATCH_SIZE = 5000
+
+FINISHED_STATUSES = ('succeeded', 'failed')
+
+def purge_finished_jobs(now=None, batch_size=PURGE_BATCH_SIZE):
+    """Delete jobs that finished more than ``JOB_RETENTION_DAYS`` ago; returns how many."""
+    now = now or timezone.now()
+    expired = Job.objects.filter(
+        status__in=FINISHED_STATUSES, finished_at__lt=now - timedelta(days=settings.JOB_RETENTION_DAYS),
+    )
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(expired.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return deleted
+            deleted += Job.objects.filter(pk__in=batch).delete()[0]
@@ -0,0 +1,9 @@
+from datetime import timedelta
+
+from .queue import task
+from .retention import purge_finished_jobs as purge
+
+@task(schedule=timedelta(hours=1))
+def purge_finished_jobs():
+    """Delete finished jobs past their retention period (see jobs.retention)."""
+    purge()
@@ -0,0 +1,107 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job, PeriodicJob
+from .queue import enqueue, registry, task
+from .retention import purge_finished_jobs
+from .worker import Worker
+
+calls = []
+
+
+@task(name='jobs.tests.record', max_attempts=2)
+def record(value):
+    calls.append(value)
+
+
+@task(name='jobs.tests.fail', max_attempts=2)
+def fail():
+    raise RuntimeError('boom')
+
+
+class JobQueueTests(TestCase):
+    """Jobs are claimed once, retried with backoff and scheduled periodically."""
+
+    def setUp(self):
+        calls.clear()
+        self.worker = Worker(threads=0)
+
+    def test_enqueued_job_runs_and_succeeds(self):
+        job = enqueue(record, 'hello')
+
+        self.assertEqual(self.worker.run_once(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(calls, ['hello'])
+
+    def test_future_jobs_wait_until_due(self):
+        enqueue('jobs.tests.record', 'later', delay=timedelta(hours=1))
+
+        self.assertEqual(self.worker.run_once(), 0)
+        self.assertEqual(calls, [])
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        enqueue(record, 'once')
+        now = timezone.now()
+
+        self.assertEqual(len(self.worker.claim(10, now)), 1)
+        self.assertEqual(Worker(threads=0).claim(10, now), [])
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        job = enqueue(fail)
+
+        self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 2)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = enqueue(record, 'crashed')
+        self.worker.claim(10, timezone.now())
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.worker.requeue_stale(timezone.now())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+
+    def test_periodic_jobs_are_enqueued_once_per_interval(self):
+        periodic = PeriodicJob.objects.create(task='jobs.tests.record', interval_seconds=60)
+        now = timezone.now()
+
+        self.worker.enqueue_periodic(now)
+        self.worker.enqueue_periodic(now)
+
+        self.assertEqual(Job.objects.filter(task='jobs.tests.record').count(), 1)
+        periodic.refresh_from_db()
+        self.assertEqual(periodic.next_run_at, now + timedelta(seconds=60))
+
+    def test_scheduled_tasks_are_synced(self):
+        self.worker.sync_schedules()
+
+        scheduled = {name for name, registered in registry.items() if registered.schedule}
+        self.assertIn('dashboard.tasks.sweep_alerts', scheduled)
+        self.assertEqual(set(PeriodicJob.objects.values_list('task', flat=True)), scheduled)
+
+    @override_settings(JOB_RETENTION_DAYS=7)
+    def test_finished_jobs_are_purged_after_retention(self):
+        now = timezone.now()
+        old, recent, queued, failed = (enqueue(record, value) for value in range(4))
+        Job.objects.filter(pk=old.pk).update(status='succeeded', finished_at=now - timedelta(days=8))
+        Job.objects.filter(pk=recent.pk).update(status='succeeded', finished_at=now - timedelta(days=6))
+        Job.objects.filter(pk=queued.pk).update(run_at=now - timedelta(days=30))
+        Job.objects.filter(pk=failed.pk).update(status='failed', finished_at=now - timedelta(days=8))
+
+        self.assertEqual(purge_finished_jobs(now, batch_size=1), 2)
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {recent.pk, queued.pk})
@@ -0,0 +1,157 @@
+"""
+Worker loop for the database-backed job queue.
+
+Any number of workers may run against the same database. Jobs are claimed
+with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the backend supports it
+(PostgreSQL) and always through a conditional ``UPDATE`` on the job status,
+which keeps claims exclusive on SQLite too. Failed jobs are retried with
+exponential backoff until ``max_attempts`` is reached, and jobs left running
+by a crashed worker are requeued after ``stale_after``.
+"""
+
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job, PeriodicJob
+from .queue import enqueue, get_task, registry
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 60 * 60
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter after the ``attempts``-th failure."""
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+class Worker:
+
+    def __init__(self, threads=4, batch_size=10, poll_interval=1.0, stale_after=timedelta(minutes=30)):
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job') if threads else None
+        self.in_flight = set()
+
+    def sync_schedules(self):
+        """Create or update PeriodicJob rows for tasks declared with a schedule."""
+        for registered in registry.values():
+            if registered.schedule is None:
+                continue
+            interval = int(registered.schedule.total_seconds())
+            periodic, created = PeriodicJob.objects.get_or_create(
+                task=registered.name, defaults={'interval_seconds': interval}
+            )
+            if not created and periodic.interval_seconds != interval:
+                PeriodicJob.objects.filter(pk=periodic.pk).update(interval_seconds=interval)
+
+    def enqueue_periodic(self, now):
+        due = PeriodicJob.objects.filter(is_active=True, next_run_at__lte=now)
+        for periodic in due:
+            next_run_at = now + timedelta(seconds=periodic.interval_seconds)
+            with transaction.atomic():
+                # Only the worker that moves next_run_at on gets to enqueue
+                advanced = PeriodicJob.objects.filter(
+                    pk=periodic.pk, next_run_at=periodic.next_run_at
+                ).update(next_run_at=next_run_at)
+                if advanced:
+                    enqueue(periodic.task)
+
+    def requeue_stale(self, now):
+        stale = Job.objects.filter(status='running', locked_at__lt=now - self.stale_after)
+        stale.filter(attempts__gte=F('max_attempts')).update(
+            status='failed', finished_at=now, last_error='Worker stopped while running the job.'
+        )
+        stale.update(status='queued', locked_by='', locked_at=None, run_at=now)
+
+    def claim(self, limit, now):
+        """Mark up to ``limit`` due jobs as running for this worker and return them."""
+        with transaction.atomic():
+            due = Job.objects.filter(status='queued', run_at__lte=now).order_by('run_at')
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            job_ids = list(due.values_list('pk', flat=True)[:limit])
+            if not job_ids:
+                return []
+            Job.objects.filter(pk__in=job_ids, status='queued').update(
+                status='running', locked_by=self.name, locked_at=now, attempts=F('attempts') + 1
+            )
+        return list(Job.objects.filter(pk__in=job_ids, status='running', locked_by=self.name, locked_at=now))
+
+    def execute(self, job):
+        try:
+            get_task(job.task).func(*job.args, **job.kwargs)
+        except Exception:
+            self.record_failure(job, traceback.format_exc())
+        else:
+            Job.objects.filter(pk=job.pk).update(status='succeeded', finished_at=timezone.now(), last_error='')
+
+    def execute_in_thread(self, job):
+        try:
+            self.execute(job)
+        finally:
+            connection.close()
+
+    def record_failure(self, job, error):
+        now = timezone.now()
+        logger.warning("Job %s (%s) failed on attempt %s", job.pk, job.task, job.attempts)
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(status='failed', finished_at=now, last_error=error)
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status='queued', run_at=now + retry_delay(job.attempts), locked_by='', locked_at=None, last_error=error
+            )
+
+    def dispatch(self, job):
+        try:
+            executor = get_task(job.task).executor
+        except LookupError:
+            executor = 'inline'
+        if executor == 'thread' and self.pool is not None:
+            future = self.pool.submit(self.execute_in_thread, job)
+            self.in_flight.add(future)
+            future.add_done_callback(self.in_flight.discard)
+        else:
+            self.execute(job)
+
+    def run_once(self):
+        """Schedule periodic jobs and dispatch one batch; returns the number claimed."""
+        now = timezone.now()
+        self.enqueue_periodic(now)
+        capacity = self.batch_size - len(self.in_flight)
+        if capacity <= 0:
+            return 0
+        jobs = self.claim(capacity, now)
+        for job in jobs:
+            self.dispatch(job)
+        return len(jobs)
+
+    def run(self, stop_when_idle=False):
+        self.sync_schedules()
+        self.requeue_stale(timezone.now())
+        last_stale_check = time.monotonic()
+        try:
+            while True:
+                claimed = self.run_once()
+                if time.monotonic() - last_stale_check > self.stale_after.total_seconds() / 2:
+                    self.requeue_stale(timezone.now())
+                    last_stale_check = time.monotonic()
+                if not claimed:
+                    if stop_when_idle and not self.in_flight:
+                        break
+                    time.sleep(self.poll_interval)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True)
@@ -0,0 +1,36 @@
+"""
+The clinical lists on a patient's chart, cached per patient in each process.
+
+Opening a chart otherwise runs one query per list. The lists are evicted for
+the patient whenever one of their rows is saved or deleted (see
+dashboard.signals), and by the bulk writers that skip those signals, so every
+worker sees a change on its next load (see dashboard.invalidation).
+"""
+
+from dashboard.invalidation import LocalCache
+
+from .models import Allergy, ChronicCondition, FamilyHistory, Immunization, MedicalHistory, Medication, PatientNote, VitalSigns
+
+CHART_MODELS = [Allergy, ChronicCondition, Medication, MedicalHistory, FamilyHistory, Immunization, VitalSigns, PatientNote]
+
+patient_charts = LocalCache('patient_chart')
+
+def load_chart(patient_id):
+    # Queried by id so cached rows don't hold on to a particular Patient instance
+    return {
+        'allergies': list(Allergy.objects.filter(patient_id=patient_id).order_by('-severity')),
+        'chronic_conditions': list(
+            ChronicCondition.objects.filter(patient_id=patient_id).order_by('-is_active', 'condition_name')
+        ),
+        'medications': list(Medication.objects.filter(patient_id=patient_id).order_by('-is_active', 'medication_name')),
+        'medical_history': list(MedicalHistory.objects.filter(patient_id=patient_id).order_by('-date')),
+        'family_history': list(FamilyHistory.objects.filter(patient_id=patient_id).order_by('relationship')),
+        'immunizations': list(Immunization.objects.filter(patient_id=patient_id).order_by('-date_administered')),
+        'latest_vitals': VitalSigns.objects.filter(patient_id=patient_id).select_related('recorded_by')
+        .order_by('-date_recorded').first(),
+        'notes': list(PatientNote.objects.filter(patient_id=patient_id).select_related('created_by').order_by('-created_at')),
+    }
+
+def get_chart(patient_id):
+    """The patient's allergies, conditions, medications, history, latest vitals and notes."""
+    return patient_charts.get_or_set(patient_id, lambda: load_chart(patient_id))
@@ -3,6 +3,18 @@ from django.conf import settings
 from simple_history.models import HistoricalRecords
 import uuid
 
+class PatientQuerySet(models.QuerySet):
+    
+    def search(self, query):
+        """Patients whose name, MRN, email or primary phone contains ``query``."""
+        return self.filter(
+            models.Q(first_name__icontains=query) |
+            models.Q(last_name__icontains=query) |
+            models.Q(medical_record_number__icontains=query) |
+            models.Q(email__icontains=query) |
+            models.Q(phone_primary__icontains=query)
+        )
+
 class Patient(models.Model):
     """Model for patient records."""
     
@@ -63,6 +75,15 @@ class Patient(models.Model):
     # Audit trail
     history = HistoricalRecords()
     
+    objects = PatientQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # The patient list is paged in name order, so the first pages
+            # walk this index instead of sorting every match
+            models.Index(fields=['last_name', 'first_name'], name='patient_name_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.first_name} {self.last_name} (MRN: {self.medical_record_number})"
     
@@ -304,6 +325,9 @@ class RecentPatient(models.Model):
     class Meta:
         unique_together = ('user', 'patient')
         ordering = ['-last_viewed']
+        indexes = [
+            models.Index(fields=['user', '-last_viewed'], name='recent_patient_user_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.full_name} viewed {self.patient.full_name} on {self.last_viewed}"
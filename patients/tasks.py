@@ -0,0 +1,31 @@
+import csv
+import os
+import secrets
+
+from django.conf import settings
+
+from jobs.queue import task
+from .models import Patient
+
+EXPORT_FIELDS = [
+    'medical_record_number', 'first_name', 'last_name', 'date_of_birth', 'gender',
+    'email', 'phone_primary', 'address', 'insurance_provider', 'insurance_member_id', 'is_active',
+]
+
+def export_dir(user_id):
+    """Directory holding ``user_id``'s exports; never served as a static or media file."""
+    return os.path.join(settings.PATIENT_EXPORT_ROOT, str(user_id))
+
+@task(executor='thread')
+def export_patients(patient_ids, user_id):
+    """Write the selected patients to a CSV file in the user's export directory."""
+    directory = export_dir(user_id)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    filename = f"patients-{secrets.token_urlsafe(16)}.csv"
+    
+    rows = Patient.objects.filter(id__in=patient_ids).order_by('last_name', 'first_name').values_list(*EXPORT_FIELDS)
+    with open(os.path.join(directory, filename), 'w', newline='') as export_file:
+        writer = csv.writer(export_file)
+        writer.writerow(EXPORT_FIELDS)
+        writer.writerows(rows.iterator(chunk_size=2000))
+    return filename
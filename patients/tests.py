@@ -1,3 +1,138 @@
-from django.test import TestCase
+import tempfile
+from datetime import date
+
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from authentication import permissions
+from authentication.models import User
+from jobs.models import Job
+from .models import FavoritePatient, Patient
+from .tasks import export_patients
 
 # Create your tests here.
+class FavoriteToggleTests(TestCase):
+    """AJAX toggles answer with JSON; plain requests go back to the chart."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+        cls.patient = Patient.objects.create(
+            medical_record_number='MRN-0001', first_name='John', last_name='Smith',
+            date_of_birth=date(1980, 1, 1), gender='M', phone_primary='555-0100', address='1 Main St',
+            emergency_contact_name='Jane Smith', emergency_contact_relation='Spouse',
+            emergency_contact_phone='555-0101',
+        )
+
+    async def test_ajax_toggles_return_json(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse('toggle_favorite', args=[self.patient.pk])
+
+        response = await self.async_client.post(url, headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(response.json()['is_favorite'], True)
+        self.assertTrue(await FavoritePatient.objects.filter(user=self.user, patient=self.patient).aexists())
+
+        response = await self.async_client.post(url, headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(response.json()['is_favorite'], False)
+        self.assertFalse(await FavoritePatient.objects.filter(user=self.user, patient=self.patient).aexists())
+
+    def test_plain_requests_redirect_to_the_chart(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('toggle_favorite', args=[self.patient.pk]))
+        self.assertRedirects(response, reverse('patient_detail', args=[self.patient.pk]), fetch_redirect_response=False)
+
+    def test_unknown_patients_are_not_found(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('toggle_favorite', args=[self.patient.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+
+
+class PatientExportTests(TestCase):
+    """Exports are written outside MEDIA_ROOT and only served to their requester."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+        cls.other = User.objects.create_user(
+            email='nurse@example.com', password='unused-password', first_name='Ann', last_name='Lee', role='nurse'
+        )
+        cls.patient = Patient.objects.create(
+            medical_record_number='MRN-0001', first_name='John', last_name='Smith',
+            date_of_birth=date(1980, 1, 1), gender='M', phone_primary='555-0100', address='1 Main St',
+            emergency_contact_name='Jane Smith', emergency_contact_relation='Spouse',
+            emergency_contact_phone='555-0101',
+        )
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PATIENT_EXPORT_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.filename = export_patients([self.patient.pk], self.user.pk)
+
+    def test_exports_are_listed_and_downloaded_by_their_requester(self):
+        self.client.force_login(self.user)
+        exports = self.client.get(reverse('patient_export_list')).json()['exports']
+        self.assertEqual([export['name'] for export in exports], [self.filename])
+
+        response = self.client.get(exports[0]['url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'MRN-0001', b''.join(response.streaming_content))
+
+    def test_other_users_cannot_download_an_export(self):
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(reverse('patient_export_list')).json()['exports'], [])
+        response = self.client.get(reverse('patient_export_download', args=[self.filename]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_paths_outside_the_export_directory_are_rejected(self):
+        self.client.force_login(self.user)
+        for filename in ('..', 'notes.txt', 'patients-..%2F..%2Fsecret.csv'):
+            response = self.client.get(reverse('patient_export_download', args=[filename]))
+            self.assertEqual(response.status_code, 404)
+        response = self.client.get(f"/patients/exports/..%2F{self.other.pk}%2F{self.filename}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_anonymous_requests_are_sent_to_login(self):
+        response = self.client.get(reverse('patient_export_download', args=[self.filename]))
+        self.assertEqual(response.status_code, 302)
+
+
+class BulkExportTests(TestCase):
+    """Bulk exports only include patients the user may change."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='nurse@example.com', password='unused-password', first_name='Ann', last_name='Lee', role='nurse'
+        )
+        cls.patient = Patient.objects.create(
+            medical_record_number='MRN-0001', first_name='John', last_name='Smith',
+            date_of_birth=date(1980, 1, 1), gender='M', phone_primary='555-0100', address='1 Main St',
+            emergency_contact_name='Jane Smith', emergency_contact_relation='Spouse',
+            emergency_contact_phone='555-0101',
+        )
+
+    def export(self, *patient_ids):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('bulk_action'), {'action': 'export', 'patient_ids': patient_ids})
+        self.assertRedirects(response, reverse('patient_list'), fetch_redirect_response=False)
+        return Job.objects.filter(task=export_patients.name).values_list('args', flat=True)
+
+    def test_exports_the_selected_patients(self):
+        self.assertEqual(list(self.export(self.patient.pk)), [[[self.patient.pk], self.user.pk]])
+
+    def test_patients_the_user_cannot_change_are_left_out(self):
+        scoped = {'nurse': {'patients.change': ('appointments__provider',)}}
+        with mock.patch.dict(permissions.ROLE_PERMISSIONS, scoped):
+            self.assertEqual(list(self.export(self.patient.pk)), [])
+
+    def test_malformed_ids_are_ignored(self):
+        self.assertEqual(list(self.export('abc')), [])
@@ -21,4 +21,6 @@ urlpatterns = [
     
     # Bulk actions
     path('bulk-action/', views.bulk_action, name='bulk_action'),
+    path('exports/', views.export_list, name='patient_export_list'),
+    path('exports/<str:filename>', views.download_export, name='patient_export_download'),
 ]
@@ -1,7 +1,11 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
-from django.db.models import Q
-from django.http import JsonResponse
+import os
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.shortcuts import render, redirect
+from django.db.models import Exists, OuterRef, Q
+from django.http import FileResponse, Http404, JsonResponse
+from django.urls import reverse
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_POST
@@ -17,17 +21,25 @@ from .forms import (
     MedicationForm, MedicalHistoryForm, FamilyHistoryForm,
     ImmunizationForm, VitalSignsForm, PatientNoteForm
 )
-from authentication.decorators import medical_staff_required
+from authentication.decorators import login_required, permission_required
+from authentication.permissions import aget_permitted_or_404, filter_queryset, get_permitted_or_404
+from dashboard import versions
+from docsdash.replicas import replica_reads
+from jobs.queue import enqueue
+from .chart import get_chart
+from .tasks import export_dir, export_patients
 
 @login_required
+@replica_reads
 def patient_list(request):
     """View for listing all patients with search and filter capabilities."""
     
     query = request.GET.get('q', '')
     status = request.GET.get('status', 'active')
     
-    # Base queryset
-    patients = Patient.objects.all()
+    # Base queryset, limited to what the user may see
+    visible = filter_queryset(request.user, Patient.objects.all(), 'patients.view')
+    patients = visible
     
     # Filter by status
     if status == 'active':
@@ -37,13 +49,7 @@ def patient_list(request):
     
     # Apply search query
     if query:
-        patients = patients.filter(
-            Q(first_name__icontains=query) | 
-            Q(last_name__icontains=query) | 
-            Q(medical_record_number__icontains=query) |
-            Q(email__icontains=query) |
-            Q(phone_primary__icontains=query)
-        )
+        patients = patients.search(query)
     
     # Pagination
     paginator = Paginator(patients.order_by('last_name', 'first_name'), 20)
@@ -51,10 +57,10 @@ def patient_list(request):
     page_obj = paginator.get_page(page_number)
     
     # Get recently viewed patients
-    recent_patients = RecentPatient.objects.filter(user=request.user)[:5]
+    recent_patients = RecentPatient.objects.filter(user=request.user).select_related('patient')[:5]
     
     # Get favorite patients
-    favorite_patients = FavoritePatient.objects.filter(user=request.user)
+    favorite_patients = FavoritePatient.objects.filter(user=request.user).select_related('patient')
     
     context = {
         'page_obj': page_obj,
@@ -62,15 +68,15 @@ def patient_list(request):
         'status': status,
         'recent_patients': recent_patients,
         'favorite_patients': favorite_patients,
-        'total_count': patients.count(),
-        'active_count': Patient.objects.filter(is_active=True).count(),
-        'inactive_count': Patient.objects.filter(is_active=False).count(),
+        'total_count': paginator.count,
+        'active_count': visible.filter(is_active=True).count(),
+        'inactive_count': visible.filter(is_active=False).count(),
     }
     
     return render(request, 'patients/patient_list.html', context)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def patient_create(request):
     """View for creating a new patient."""
     
@@ -99,43 +105,30 @@ def patient_create(request):
 def patient_detail(request, pk):
     """View for displaying patient details."""
     
-    patient = get_object_or_404(Patient, pk=pk)
-    
-    # Record this view in recent patients
-    RecentPatient.objects.update_or_create(
-        user=request.user,
-        patient=patient,
-        defaults={'last_viewed': timezone.now()}
+    # Whether the patient is a favorite comes with the patient row
+    patient = get_permitted_or_404(
+        request.user, 'patients.view',
+        Patient.objects.annotate(
+            is_favorite=Exists(FavoritePatient.objects.filter(user=request.user, patient=OuterRef('pk')))
+        ),
+        pk=pk,
     )
     
-    # Check if patient is a favorite
-    is_favorite = FavoritePatient.objects.filter(user=request.user, patient=patient).exists()
-    
-    # Get related data
-    allergies = patient.allergies.all().order_by('-severity')
-    chronic_conditions = patient.chronic_conditions.all().order_by('-is_active', 'condition_name')
-    medications = patient.medications.all().order_by('-is_active', 'medication_name')
-    medical_history = patient.medical_history.all().order_by('-date')
-    family_history = patient.family_history.all().order_by('relationship')
-    immunizations = patient.immunizations.all().order_by('-date_administered')
-    
-    # Get latest vital signs
-    latest_vitals = patient.vital_signs.order_by('-date_recorded').first()
+    # Record this view in recent patients with a single upsert, which skips
+    # post_save, so mark the user's cached recent list stale here
+    RecentPatient.objects.bulk_create(
+        [RecentPatient(user=request.user, patient=patient)],
+        update_conflicts=True, unique_fields=['user', 'patient'], update_fields=['last_viewed'],
+    )
+    versions.bump(versions.recent_patients_version_name(request.user.pk))
     
-    # Get notes
-    notes = patient.notes.all().order_by('-created_at')
+    # Chart lists, cached per patient until one of them changes
+    chart = get_chart(patient.pk)
     
     context = {
         'patient': patient,
-        'is_favorite': is_favorite,
-        'allergies': allergies,
-        'chronic_conditions': chronic_conditions,
-        'medications': medications,
-        'medical_history': medical_history,
-        'family_history': family_history,
-        'immunizations': immunizations,
-        'latest_vitals': latest_vitals,
-        'notes': notes,
+        'is_favorite': patient.is_favorite,
+        **chart,
         'allergy_form': AllergyForm(),
         'chronic_condition_form': ChronicConditionForm(),
         'medication_form': MedicationForm(),
@@ -149,11 +142,11 @@ def patient_detail(request, pk):
     return render(request, 'patients/patient_detail.html', context)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def patient_edit(request, pk):
     """View for editing patient information."""
     
-    patient = get_object_or_404(Patient, pk=pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=pk)
     
     if request.method == 'POST':
         form = PatientForm(request.POST, request.FILES, instance=patient)
@@ -167,11 +160,11 @@ def patient_edit(request, pk):
     return render(request, 'patients/patient_form.html', {'form': form, 'patient': patient, 'is_create': False})
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def toggle_patient_status(request, pk):
     """View for toggling patient active/inactive status."""
     
-    patient = get_object_or_404(Patient, pk=pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=pk)
     patient.is_active = not patient.is_active
     patient.save()
     
@@ -181,32 +174,36 @@ def toggle_patient_status(request, pk):
     return redirect('patient_detail', pk=patient.pk)
 
 @login_required
-def toggle_favorite(request, pk):
-    """View for toggling favorite status of a patient."""
+async def toggle_favorite(request, pk):
+    """View for toggling favorite status of a patient.
+    
+    Async, as it is mostly called over AJAX.
+    """
     
-    patient = get_object_or_404(Patient, pk=pk)
-    favorite, created = FavoritePatient.objects.get_or_create(user=request.user, patient=patient)
+    user = await request.auser()
+    patient = await aget_permitted_or_404(user, 'patients.view', Patient, pk=pk)
+    favorite, created = await FavoritePatient.objects.aget_or_create(user=user, patient=patient)
     
     if not created:
-        favorite.delete()
+        await favorite.adelete()
         is_favorite = False
         message = f"Removed {patient.full_name} from favorites."
     else:
         is_favorite = True
         message = f"Added {patient.full_name} to favorites."
     
-    if request.is_ajax():
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({'is_favorite': is_favorite, 'message': message})
     
     messages.success(request, message)
     return redirect('patient_detail', pk=patient.pk)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def add_allergy(request, patient_pk):
     """View for adding an allergy to a patient."""
     
-    patient = get_object_or_404(Patient, pk=patient_pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=patient_pk)
     
     if request.method == 'POST':
         form = AllergyForm(request.POST)
@@ -219,11 +216,11 @@ def add_allergy(request, patient_pk):
     return redirect('patient_detail', pk=patient_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def add_chronic_condition(request, patient_pk):
     """View for adding a chronic condition to a patient."""
     
-    patient = get_object_or_404(Patient, pk=patient_pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=patient_pk)
     
     if request.method == 'POST':
         form = ChronicConditionForm(request.POST)
@@ -236,11 +233,11 @@ def add_chronic_condition(request, patient_pk):
     return redirect('patient_detail', pk=patient_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def add_medication(request, patient_pk):
     """View for adding a medication to a patient."""
     
-    patient = get_object_or_404(Patient, pk=patient_pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=patient_pk)
     
     if request.method == 'POST':
         form = MedicationForm(request.POST)
@@ -253,11 +250,11 @@ def add_medication(request, patient_pk):
     return redirect('patient_detail', pk=patient_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def add_medical_history(request, patient_pk):
     """View for adding medical history to a patient."""
     
-    patient = get_object_or_404(Patient, pk=patient_pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=patient_pk)
     
     if request.method == 'POST':
         form = MedicalHistoryForm(request.POST)
@@ -270,11 +267,11 @@ def add_medical_history(request, patient_pk):
     return redirect('patient_detail', pk=patient_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def add_family_history(request, patient_pk):
     """View for adding family history to a patient."""
     
-    patient = get_object_or_404(Patient, pk=patient_pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=patient_pk)
     
     if request.method == 'POST':
         form = FamilyHistoryForm(request.POST)
@@ -287,11 +284,11 @@ def add_family_history(request, patient_pk):
     return redirect('patient_detail', pk=patient_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def add_immunization(request, patient_pk):
     """View for adding an immunization to a patient."""
     
-    patient = get_object_or_404(Patient, pk=patient_pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=patient_pk)
     
     if request.method == 'POST':
         form = ImmunizationForm(request.POST)
@@ -304,11 +301,11 @@ def add_immunization(request, patient_pk):
     return redirect('patient_detail', pk=patient_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def add_vital_signs(request, patient_pk):
     """View for adding vital signs to a patient."""
     
-    patient = get_object_or_404(Patient, pk=patient_pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=patient_pk)
     
     if request.method == 'POST':
         form = VitalSignsForm(request.POST)
@@ -330,11 +327,11 @@ def add_vital_signs(request, patient_pk):
     return redirect('patient_detail', pk=patient_pk)
 
 @login_required
-@medical_staff_required
+@permission_required('patients.change')
 def add_note(request, patient_pk):
     """View for adding a note to a patient."""
     
-    patient = get_object_or_404(Patient, pk=patient_pk)
+    patient = get_permitted_or_404(request.user, 'patients.change', Patient, pk=patient_pk)
     
     if request.method == 'POST':
         form = PatientNoteForm(request.POST)
@@ -353,25 +350,66 @@ def bulk_action(request):
     """View for performing bulk actions on selected patients."""
     
     action = request.POST.get('action')
-    patient_ids = request.POST.getlist('patient_ids')
+    patient_ids = [patient_id for patient_id in request.POST.getlist('patient_ids') if patient_id.isdigit()]
     
     if not patient_ids:
         messages.warning(request, "No patients selected.")
         return redirect('patient_list')
     
-    patients = Patient.objects.filter(id__in=patient_ids)
+    patients = filter_queryset(request.user, Patient.objects.filter(id__in=patient_ids), 'patients.change')
     count = patients.count()
     
     if action == 'activate':
         patients.update(is_active=True)
+        # update() skips post_save, so mark cached dashboard content stale here
+        versions.bump('patients')
         messages.success(request, f"{count} patients activated.")
     elif action == 'deactivate':
         patients.update(is_active=False)
+        versions.bump('patients')
         messages.success(request, f"{count} patients deactivated.")
+    elif action == 'export' and not count:
+        messages.warning(request, "None of the selected patients can be exported.")
     elif action == 'export':
-        # In a real app, this would generate an export file
-        messages.success(request, f"Export of {count} patients initiated.")
+        # Only the patients the user may change, never the submitted ids as such
+        enqueue(export_patients, list(patients.values_list('pk', flat=True)), request.user.pk)
+        messages.success(request, f"Export of {count} patients initiated. It will be listed under your exports.")
     else:
         messages.error(request, "Invalid action.")
     
     return redirect('patient_list')
+
+EXPORT_FILENAME = re.compile(r'^patients-[\w-]+\.csv$')
+
+@login_required
+def export_list(request):
+    """The current user's finished patient exports, newest first."""
+    
+    directory = export_dir(request.user.pk)
+    names = [name for name in os.listdir(directory) if EXPORT_FILENAME.match(name)] if os.path.isdir(directory) else []
+    exports = sorted(
+        ((name, os.path.getmtime(os.path.join(directory, name))) for name in names), key=lambda item: -item[1]
+    )
+    
+    return JsonResponse({'exports': [
+        {
+            'name': name,
+            'created': datetime.fromtimestamp(modified, tz=dt_timezone.utc).isoformat(),
+            'url': reverse('patient_export_download', args=[name]),
+        }
+        for name, modified in exports
+    ]})
+
+@login_required
+def download_export(request, filename):
+    """Serve one of the current user's patient exports; other users' files are not found."""
+    
+    if not EXPORT_FILENAME.match(filename):
+        raise Http404("Export not found.")
+    path = os.path.join(export_dir(request.user.pk), filename)
+    if not os.path.isfile(path):
+        raise Http404("Export not found.")
+    
+    response = FileResponse(open(path, 'rb'), as_attachment=True, filename=filename, content_type='text/csv')
+    response['Cache-Control'] = 'private, no-store'
+    return response
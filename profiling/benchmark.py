@@ -0,0 +1,303 @@
+"""
+Load benchmarks for the main views.
+
+Each scenario builds request URLs from a sample of the data, and is driven by
+``clients`` concurrent test clients (one thread and database connection
+each) logged in as the same user, ``requests`` times per client. Every
+request is timed and its queries counted with the profiler's execute
+wrapper. Only 200 responses count: a redirect to the login page or a 404 is
+fast and would flatter the percentiles, so any other status is an error.
+Results are written as JSON to ``BENCHMARK_RESULTS_DIR`` so a run
+can be compared with an earlier one.
+
+The test client keeps its connection between requests, so the cost of
+connecting is measured separately: ``connection_churn`` times requests that
+connect, run a few trivial queries and close, once opening a new connection
+each time and once checking one out of a pool (see docsdash.postgresql_pool).
+
+``worker_concurrency`` compares one worker serving ``concurrency`` requests
+at once under each handler: a threaded WSGI worker with that many threads,
+each holding its thread for the whole request, and the ASGI handler on one
+event loop, where the middleware chain and async views run as coroutines and
+only the ORM calls hop onto a thread. Queries can be slowed down by
+``db_latency`` seconds each to stand in for a busy or distant database.
+"""
+
+import asyncio
+import json
+import math
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.backends.utils import CursorWrapper
+from django.db.utils import load_backend
+from django.db.models import Max, Min
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.models import Appointment, LabOrder, Prescription
+from docsdash.postgresql_pool.base import close_pools, pools
+from authentication.models import User
+from patients.models import Allergy, Medication, Patient, PatientNote, VitalSigns
+from .middleware import Profile
+from .synthetic import FIRST_NAMES, LAST_NAMES
+
+# Patient ids drawn for the detail and search scenarios
+SAMPLE_SIZE = 1000
+
+COUNTED_MODELS = [User, Patient, Allergy, Medication, VitalSigns, PatientNote, Appointment, Prescription, LabOrder]
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def sample_patient_ids(rng, size=SAMPLE_SIZE):
+    bounds = Patient.objects.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return []
+    candidates = {rng.randint(bounds['low'], bounds['high']) for _ in range(size * 2)}
+    return list(Patient.objects.filter(pk__in=candidates).values_list('pk', flat=True)[:size])
+
+def calendar_window(rng):
+    start = timezone.now() + timedelta(days=rng.randint(-60, 30))
+    return f"?start={start.date().isoformat()}T00:00:00Z&end={(start + timedelta(days=7)).date().isoformat()}T00:00:00Z"
+
+SCENARIOS = {
+    'patient_list_search': lambda rng, patient_ids: (
+        reverse('patient_list') + '?q=' + rng.choice(LAST_NAMES + FIRST_NAMES)[:rng.randint(3, 6)]
+    ),
+    'patient_detail': lambda rng, patient_ids: reverse('patient_detail', args=[rng.choice(patient_ids)]),
+    'dashboard': lambda rng, patient_ids: reverse('dashboard'),
+    'get_calendar_events': lambda rng, patient_ids: reverse('get_calendar_events') + calendar_window(rng),
+    'appointment_list': lambda rng, patient_ids: reverse('appointment_list'),
+    'dashboard_stats': lambda rng, patient_ids: reverse('dashboard_stats'),
+}
+
+# Scenarios served by async views, for worker_concurrency
+ASYNC_SCENARIOS = ['get_calendar_events', 'dashboard_stats']
+
+def drive(user, urls):
+    """Request ``urls`` in order with one logged-in client; returns [(seconds, queries, ok)]."""
+    client = Client()
+    client.force_login(user)
+    timings = []
+    for url in urls:
+        profile = Profile()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(profile):
+                ok = client.get(url).status_code == 200
+        except Exception:
+            ok = False
+        timings.append((time.perf_counter() - started, sum(profile.shapes.values()), ok))
+    return timings
+
+def drive_in_thread(user, urls):
+    try:
+        return drive(user, urls)
+    finally:
+        connections.close_all()
+
+def summarize(timings, elapsed):
+    succeeded = [(seconds, queries) for seconds, queries, ok in timings if ok]
+    summary = {'requests': len(timings), 'errors': len(timings) - len(succeeded)}
+    if succeeded:
+        latencies = [seconds * 1000 for seconds, _ in succeeded]
+        queries = [count for _, count in succeeded]
+        summary.update({
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'mean_queries': round(sum(queries) / len(queries), 2),
+            'max_queries': max(queries),
+            'requests_per_second': round(len(succeeded) / elapsed, 2),
+        })
+    return summary
+
+def run(user, scenarios=None, clients=4, requests=50, seed=0, connection_overhead=False):
+    """Benchmark ``scenarios`` (default all) and return the results."""
+    rng = random.Random(seed)
+    patient_ids = sample_patient_ids(rng)
+    results = {}
+    for name in scenarios or SCENARIOS:
+        if name == 'patient_detail' and not patient_ids:
+            continue
+        plans = [[SCENARIOS[name](rng, patient_ids) for _ in range(requests)] for _ in range(clients)]
+        started = time.perf_counter()
+        if clients == 1:
+            timings = drive(user, plans[0])
+        else:
+            with ThreadPoolExecutor(clients) as executor:
+                timings = [timing for batch in executor.map(lambda urls: drive_in_thread(user, urls), plans) for timing in batch]
+        results[name] = summarize(timings, time.perf_counter() - started)
+
+    summary = {
+        'started_at': timezone.now().isoformat(),
+        'commit': current_commit(),
+        'database': connection.vendor,
+        'clients': clients,
+        'requests_per_client': requests,
+        'rows': {model.__name__: model.objects.count() for model in COUNTED_MODELS},
+        'scenarios': results,
+    }
+    if connection_overhead:
+        summary['connections'] = connection_churn(clients, requests)
+    return summary
+
+CONNECTION_ENGINES = {
+    'direct': 'django.db.backends.postgresql',
+    'pooled': 'docsdash.postgresql_pool',
+}
+
+def churn(engine, settings_dict, alias, requests, queries):
+    # Each thread needs its own connection wrapper
+    wrapper = load_backend(engine).DatabaseWrapper(settings_dict, alias)
+    timings = []
+    try:
+        for _ in range(requests):
+            started = time.perf_counter()
+            wrapper.ensure_connection()
+            with wrapper.cursor() as cursor:
+                for _ in range(queries):
+                    cursor.execute('SELECT 1')
+            wrapper.close()
+            timings.append((time.perf_counter() - started, queries, True))
+    finally:
+        wrapper.close()
+    return timings
+
+def connection_churn(clients=4, requests=50, queries=3):
+    """Per-request latency with a new connection each time versus a pooled one, on PostgreSQL."""
+    default = connections[DEFAULT_DB_ALIAS].settings_dict
+    results = {}
+    for label, engine in CONNECTION_ENGINES.items():
+        alias = f'benchmark_{label}'
+        options = {key: value for key, value in default['OPTIONS'].items() if key != 'pool'}
+        if label == 'pooled':
+            options['pool'] = {'max_size': clients}
+        settings_dict = {**default, 'ENGINE': engine, 'CONN_MAX_AGE': 0, 'OPTIONS': options}
+        started = time.perf_counter()
+        with ThreadPoolExecutor(clients) as executor:
+            batches = executor.map(
+                lambda _: churn(engine, settings_dict, alias, requests, queries), range(clients)
+            )
+            timings = [timing for batch in batches for timing in batch]
+        results[label] = summarize(timings, time.perf_counter() - started)
+        if alias in pools():
+            results[label]['pool'] = pools()[alias].stats()
+        close_pools(alias=alias)
+    return results
+
+@contextmanager
+def added_latency(seconds):
+    """Sleep ``seconds`` before every query run in the block, in any thread."""
+    if not seconds:
+        yield
+        return
+    execute = CursorWrapper.execute
+
+    def slow_execute(self, sql, params=None):
+        time.sleep(seconds)
+        return execute(self, sql, params)
+
+    CursorWrapper.execute = slow_execute
+    try:
+        yield
+    finally:
+        CursorWrapper.execute = execute
+
+async def drive_async(client, urls, concurrency):
+    """Request ``urls`` through the ASGI handler, at most ``concurrency`` at once."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(url):
+        # As the ASGI handler does, so each request's ORM calls get their own thread
+        async with semaphore, ThreadSensitiveContext():
+            started = time.perf_counter()
+            try:
+                ok = (await client.get(url)).status_code == 200
+            except Exception:
+                ok = False
+            return time.perf_counter() - started, 0, ok
+
+    return await asyncio.gather(*(fetch(url) for url in urls))
+
+def concurrency_summary(timings, elapsed):
+    summary = {
+        metric: value for metric, value in summarize(timings, elapsed).items() if not metric.endswith('queries')
+    }
+    # Requests in progress at once on average (Little's law)
+    summary['in_flight'] = round(sum(seconds for seconds, _, ok in timings if ok) / elapsed, 2)
+    return summary
+
+def worker_concurrency(user, scenario='get_calendar_events', concurrency=8, requests=200, db_latency=0.0, seed=0):
+    """One worker's throughput for ``scenario`` under each handler, ``concurrency`` requests at once."""
+    rng = random.Random(seed)
+    patient_ids = sample_patient_ids(rng)
+    urls = [SCENARIOS[scenario](rng, patient_ids) for _ in range(requests)]
+    results = {'scenario': scenario, 'concurrency': concurrency, 'db_latency_ms': db_latency * 1000}
+    with added_latency(db_latency):
+        started = time.perf_counter()
+        # A threaded worker: each thread takes its next request once the last one is done
+        with ThreadPoolExecutor(concurrency) as executor:
+            batches = executor.map(
+                lambda urls: drive_in_thread(user, urls), [urls[thread::concurrency] for thread in range(concurrency)]
+            )
+            timings = [timing for batch in batches for timing in batch]
+        results['wsgi'] = concurrency_summary(timings, time.perf_counter() - started)
+
+        client = AsyncClient()
+        client.force_login(user)
+        started = time.perf_counter()
+        timings = asyncio.run(drive_async(client, urls, concurrency))
+        results['asgi'] = concurrency_summary(timings, time.perf_counter() - started)
+    return results
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save(results):
+    directory = Path(settings.BENCHMARK_RESULTS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{timezone.now():%Y%m%dT%H%M%S}.json"
+    path.write_text(json.dumps(results, indent=2))
+    return path
+
+def load(reference):
+    """Saved results by path, or the most recent saved run for ``'latest'``."""
+    if reference == 'latest':
+        saved = sorted(Path(settings.BENCHMARK_RESULTS_DIR).glob('*.json'))
+        if not saved:
+            return None
+        reference = saved[-1]
+    return json.loads(Path(reference).read_text())
+
+def compare(results, baseline):
+    """{scenario: {metric: (baseline, current, change)}} for the scenarios both runs have."""
+    changes = {}
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if not previous:
+            continue
+        changes[name] = {
+            metric: (previous[metric], current[metric], current[metric] - previous[metric])
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'mean_queries')
+            if metric in previous and metric in current
+        }
+    return changes
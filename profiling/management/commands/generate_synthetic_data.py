@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from profiling.synthetic import generate
+
+class Command(BaseCommand):
+    help = "Bulk-insert synthetic patients, appointments and staff for benchmarking (see profiling.synthetic)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1_000_000, help="Patients to add.")
+        parser.add_argument('--appointments', type=int, default=5_000_000, help="Appointments to add.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same data.")
+        parser.add_argument(
+            '--skip-rollups', action='store_true', help="Don't rebuild the utilization rollups afterwards."
+        )
+
+    def handle(self, *args, **options):
+        def progress(model, done, total):
+            self.stdout.write(f"{model}: {done}/{total}")
+
+        counts = generate(
+            patients=options['patients'], appointments=options['appointments'], seed=options['seed'],
+            rollups=not options['skip_rollups'], progress=progress if options['verbosity'] > 1 else None,
+        )
+        for model, count in counts.items():
+            self.stdout.write(f"{model}: {count} rows inserted")
@@ -0,0 +1,71 @@
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from profiling.benchmark import percentile
+
+SORT_KEYS = ['queries', 'duplicate_queries', 'db_ms', 'total_ms', 'over_budget']
+
+def read_profiles(lines):
+    """Profile records from log lines; text before the JSON (timestamps, levels) is skipped."""
+    for line in lines:
+        start = line.find('{')
+        if start == -1:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if isinstance(record, dict) and 'queries' in record:
+            yield record
+
+class Command(BaseCommand):
+    help = "Summarize the worst views in a request profiling log (see profiling.middleware)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('log_file', help="Log file with one JSON profile per line.")
+        parser.add_argument('--sort', choices=SORT_KEYS, default='queries', help="Rank views by this metric.")
+        parser.add_argument('--limit', type=int, default=10, help="Views to list.")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['log_file']) as log:
+                views = defaultdict(list)
+                for record in read_profiles(log):
+                    views[record['view'] or record['path']].append(record)
+        except OSError as error:
+            raise CommandError(f"Cannot read {options['log_file']}: {error}")
+
+        summaries = []
+        for view, records in views.items():
+            duplicates = defaultdict(int)
+            samples = {}
+            for record in records:
+                for duplicate in record['duplicates']:
+                    duplicates[duplicate['fingerprint']] += duplicate['count']
+                    samples[duplicate['fingerprint']] = duplicate['sql']
+            summaries.append({
+                'view': view,
+                'requests': len(records),
+                'queries': max(record['queries'] for record in records),
+                'duplicate_queries': max(record['duplicate_queries'] for record in records),
+                'db_ms': percentile([record['db_ms'] for record in records], 0.95),
+                'total_ms': percentile([record['total_ms'] for record in records], 0.95),
+                'p50_ms': percentile([record['total_ms'] for record in records], 0.5),
+                'over_budget': sum('over_budget' in record for record in records),
+                'worst_duplicate': max(duplicates.items(), key=lambda item: item[1], default=None),
+                'samples': samples,
+            })
+
+        summaries.sort(key=lambda summary: summary[options['sort']], reverse=True)
+        for summary in summaries[:options['limit']]:
+            self.stdout.write(
+                f"{summary['view']}: {summary['requests']} requests, max {summary['queries']} queries "
+                f"({summary['duplicate_queries']} repeated), p95 db {summary['db_ms']:.1f} ms, "
+                f"p50/p95 total {summary['p50_ms']:.1f}/{summary['total_ms']:.1f} ms, "
+                f"{summary['over_budget']} over budget"
+            )
+            if summary['worst_duplicate']:
+                fingerprint, count = summary['worst_duplicate']
+                self.stdout.write(f"    repeated {count}x: {summary['samples'][fingerprint]}")
@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from authentication.models import User
+from profiling import benchmark
+
+class Command(BaseCommand):
+    help = "Load-test the main views with concurrent clients and report latency percentiles and queries per request."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=4, help="Concurrent clients per scenario.")
+        parser.add_argument('--requests', type=int, default=50, help="Requests per client per scenario.")
+        parser.add_argument(
+            '--scenario', action='append', choices=list(benchmark.SCENARIOS), help="Run only this scenario; repeatable."
+        )
+        parser.add_argument('--user', help="Email of the account to log in as; defaults to the first active admin.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the requested URLs.")
+        parser.add_argument(
+            '--connections', action='store_true',
+            help="Also time connecting per request against checking out of a pool (PostgreSQL only).",
+        )
+        parser.add_argument(
+            '--async-worker', type=int, metavar='CONCURRENCY',
+            help="Also compare a threaded WSGI worker with an ASGI worker, each serving this many requests at once.",
+        )
+        parser.add_argument(
+            '--async-scenario', choices=benchmark.ASYNC_SCENARIOS, default='get_calendar_events',
+            help="Async view used by --async-worker.",
+        )
+        parser.add_argument(
+            '--db-latency', type=float, default=0.0, metavar='MS',
+            help="Milliseconds added to every query in the --async-worker comparison.",
+        )
+        parser.add_argument('--compare', help="Saved results to compare against: a file path or 'latest'.")
+        parser.add_argument('--no-save', action='store_true', help="Don't write the results to BENCHMARK_RESULTS_DIR.")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_active=True)
+        user = (
+            users.filter(email=options['user']) if options['user'] else users.filter(role='admin').order_by('pk')
+        ).first()
+        if user is None:
+            raise CommandError("No active user to benchmark as; pass --user.")
+
+        # Load the baseline first so 'latest' isn't this run
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = benchmark.load(options['compare'])
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Cannot read {options['compare']}: {error}")
+            if baseline is None:
+                raise CommandError("No saved results to compare against.")
+
+        if options['connections'] and connection.vendor != 'postgresql':
+            raise CommandError("--connections needs a PostgreSQL database.")
+
+        results = benchmark.run(
+            user, scenarios=options['scenario'], clients=options['clients'],
+            requests=options['requests'], seed=options['seed'], connection_overhead=options['connections'],
+        )
+        for name, summary in results['scenarios'].items():
+            if 'p50_ms' not in summary:
+                self.stdout.write(f"{name}: all {summary['requests']} requests failed")
+                continue
+            self.stdout.write(
+                f"{name}: p50/p95/p99 {summary['p50_ms']:.1f}/{summary['p95_ms']:.1f}/{summary['p99_ms']:.1f} ms, "
+                f"{summary['mean_queries']:.1f} queries (max {summary['max_queries']}), "
+                f"{summary['requests_per_second']:.1f} req/s, {summary['errors']} errors"
+            )
+
+        if options['async_worker']:
+            results['worker'] = worker = benchmark.worker_concurrency(
+                user, scenario=options['async_scenario'], concurrency=options['async_worker'],
+                requests=options['requests'] * options['clients'], db_latency=options['db_latency'] / 1000,
+                seed=options['seed'],
+            )
+            for handler in ('wsgi', 'asgi'):
+                summary = worker[handler]
+                if 'p50_ms' not in summary:
+                    self.stdout.write(f"worker ({handler}): all {summary['requests']} requests failed")
+                    continue
+                self.stdout.write(
+                    f"worker ({handler}, {worker['scenario']}): {summary['requests_per_second']:.1f} req/s, "
+                    f"{summary['in_flight']:.1f} in flight, p50/p95 {summary['p50_ms']:.1f}/{summary['p95_ms']:.1f} ms, "
+                    f"{summary['errors']} errors"
+                )
+
+        for label, summary in results.get('connections', {}).items():
+            self.stdout.write(
+                f"connections ({label}): p50/p95/p99 {summary['p50_ms']:.2f}/{summary['p95_ms']:.2f}/"
+                f"{summary['p99_ms']:.2f} ms per request, {summary['requests_per_second']:.1f} req/s"
+            )
+
+        if baseline:
+            self.stdout.write(f"Compared with {baseline.get('commit') or 'unknown commit'} ({baseline['started_at']}):")
+            for name, changes in benchmark.compare(results, baseline).items():
+                self.stdout.write(f"  {name}: " + ", ".join(
+                    f"{metric} {before:.1f} -> {after:.1f} ({change:+.1f})"
+                    for metric, (before, after, change) in changes.items()
+                ))
+
+        if not options['no_save']:
+            self.stdout.write(f"Results saved to {benchmark.save(results)}")
@@ -0,0 +1,171 @@
+"""
+Opt-in per-request profiling with query and latency budgets.
+
+With ``PROFILING_ENABLED`` set, every request is measured: queries run on
+each database connection, the queries repeated with the same SQL shape
+(the usual sign of an N+1), total database time, template render time and
+total time. Requests are checked against ``PROFILING_BUDGETS``, keyed by URL
+name. Over-budget requests are logged as warnings, or raise
+``BudgetExceeded`` with ``PROFILING_STRICT`` so tests fail. A
+``PROFILING_SAMPLE_RATE`` share of all requests is logged too. Each log
+record is one JSON object, and the ``profile_report`` command summarizes a
+log of them.
+
+Without ``PROFILING_ENABLED`` the middleware removes itself at startup.
+"""
+
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template
+
+logger = logging.getLogger(__name__)
+
+# Repeated queries listed per request in the log
+MAX_DUPLICATES_LOGGED = 5
+
+current_profile = ContextVar('current_profile', default=None)
+
+class BudgetExceeded(Exception):
+    pass
+
+def fingerprint(sql):
+    """SQL with literals and IN lists folded, so repeats of one query shape match."""
+    shape = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    shape = re.sub(r'\b\d+(?:\.\d+)?\b', '?', shape)
+    shape = re.sub(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)', '(...)', shape)
+    return re.sub(r'\s+', ' ', shape).strip()
+
+class Profile:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.shapes = Counter()
+        self.samples = {}
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            shape = fingerprint(sql)
+            self.shapes[shape] += 1
+            self.samples.setdefault(shape, sql)
+
+    def summary(self, request, response):
+        duplicates = [
+            {'fingerprint': hashlib.sha1(shape.encode()).hexdigest()[:12], 'count': count, 'sql': self.samples[shape][:300]}
+            for shape, count in self.shapes.most_common(MAX_DUPLICATES_LOGGED) if count > 1
+        ]
+        match = request.resolver_match
+        return {
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': sum(self.shapes.values()),
+            'duplicate_queries': sum(count - 1 for count in self.shapes.values()),
+            'duplicates': duplicates,
+            'db_ms': round(self.db_seconds * 1000, 2),
+            'render_ms': round(self.render_seconds * 1000, 2),
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+        }
+
+def over_budget(summary):
+    """Metrics of ``summary`` over the budget of its view, as {metric: (value, budget)}."""
+    budget = settings.PROFILING_BUDGETS.get(summary['view'], {})
+    return {
+        metric: (summary[metric], limit)
+        for metric, limit in budget.items()
+        if summary[metric] > limit
+    }
+
+_render = Template.render
+
+def timed_render(self, context=None, request=None):
+    profile = current_profile.get()
+    if profile is None:
+        return _render(self, context, request)
+    started = time.perf_counter()
+    try:
+        return _render(self, context, request)
+    finally:
+        profile.render_seconds += time.perf_counter() - started
+
+@contextmanager
+def wrap_connections(profile):
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        yield
+
+class ProfilingMiddleware:
+    """Measure each request and check it against its view's budget (see profiling.middleware)."""
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        Template.render = timed_render
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            with wrap_connections(profile):
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.check(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = Profile()
+        token = current_profile.set(profile)
+        wrappers = ExitStack()
+        try:
+            # Connections are per thread; wrap the ones on the thread the
+            # request's async ORM queries run on
+            await sync_to_async(wrappers.enter_context)(wrap_connections(profile))
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(wrappers.close)()
+        finally:
+            current_profile.reset(token)
+        return self.check(request, response, profile)
+
+    def check(self, request, response, profile):
+        summary = profile.summary(request, response)
+        exceeded = over_budget(summary)
+        if exceeded:
+            summary['over_budget'] = {metric: limit for metric, (value, limit) in exceeded.items()}
+            if settings.PROFILING_STRICT:
+                raise BudgetExceeded(f"{summary['view']} over budget: " + ', '.join(
+                    f'{metric} {value} > {limit}' for metric, (value, limit) in exceeded.items()
+                ))
+            logger.warning(json.dumps(summary))
+        elif random.random() < settings.PROFILING_SAMPLE_RATE:
+            logger.info(json.dumps(summary))
+        return response
@@ -0,0 +1,136 @@
+"""
+Query plan expectations for the hot querysets.
+
+Each ``HotQuery`` builds a queryset the way its view does and declares what
+its plan must look like: an index it has to use (any one of ``uses``) and
+tables it must never read with a full scan (``no_seq_scan``). The plans come
+from ``EXPLAIN`` without ANALYZE, so the queries aren't run.
+
+The plans are only meaningful on a database seeded with enough rows and
+ANALYZEd, so the planner weighs an index against a scan with realistic
+statistics; a cost-based switch to a sequential scan then fails the check
+just as a dropped index does. SQLite has no such costing and reports
+``SCAN <table>`` for a full table scan.
+
+Patient search isn't listed: its substring matches can't use a btree index,
+so its plan reads all of patients_patient (or walks all of patient_name_idx)
+until a trigram index is added.
+
+Tests that only check an index *can* serve a query, on a few fixture rows,
+set ``force_index_paths``: sequential scans are then turned off for the
+test's transaction, which leaves a Seq Scan only where no index applies.
+"""
+
+import re
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import connection
+
+from appointments.models import Appointment
+from authentication.permissions import filter_queryset
+from patients.models import RecentPatient
+
+HotQuery = namedtuple('HotQuery', ['name', 'build', 'uses', 'no_seq_scan'])
+
+# Builders take the test context: {'user', 'patient', 'today', 'now'}
+HOT_QUERIES = [
+    # Wide windows join more appointments than a hash join over all patients
+    # costs, so only the appointments side is held to an index
+    HotQuery(
+        'appointment_date_range',
+        lambda context: Appointment.objects.between_dates(context['today'], context['today'] + timedelta(days=7))
+        .select_related('patient', 'appointment_type').order_by('start_time'),
+        uses=['appt_start_time_idx'],
+        no_seq_scan=['appointments_appointment'],
+    ),
+    HotQuery(
+        'provider_schedule',
+        lambda context: Appointment.objects.filter(provider=context['user'])
+        .between_dates(context['today'], context['today'] + timedelta(days=7)),
+        uses=['appt_provider_start_idx'],
+        no_seq_scan=['appointments_appointment'],
+    ),
+    HotQuery(
+        'recent_patients',
+        lambda context: RecentPatient.objects.filter(user=context['user']).select_related('patient')[:5],
+        uses=['recent_patient_user_idx'],
+        no_seq_scan=['patients_recentpatient', 'patients_patient'],
+    ),
+    HotQuery(
+        'calendar_events',
+        lambda context: filter_queryset(context['user'], Appointment.objects.all(), 'appointments.view')
+        .select_related('patient', 'appointment_type')
+        .filter(
+            start_time__gte=context['now'], start_time__lt=context['now'] + timedelta(days=7),
+            end_time__lte=context['now'] + timedelta(days=7),
+        ),
+        uses=['appt_start_time_idx'],
+        no_seq_scan=['appointments_appointment'],
+    ),
+    HotQuery(
+        'chart_allergies',
+        lambda context: context['patient'].allergies.order_by('-severity'),
+        uses=['patients_allergy_patient_id'],
+        no_seq_scan=['patients_allergy'],
+    ),
+    HotQuery(
+        'chart_medications',
+        lambda context: context['patient'].medications.order_by('-is_active', 'medication_name'),
+        uses=['patients_medication_patient_id'],
+        no_seq_scan=['patients_medication'],
+    ),
+    HotQuery(
+        'chart_latest_vitals',
+        lambda context: context['patient'].vital_signs.order_by('-date_recorded')[:1],
+        uses=['patients_vitalsigns_patient_id'],
+        no_seq_scan=['patients_vitalsigns'],
+    ),
+    HotQuery(
+        'chart_notes',
+        lambda context: context['patient'].notes.order_by('-created_at'),
+        uses=['patients_patientnote_patient_id'],
+        no_seq_scan=['patients_patientnote'],
+    ),
+    HotQuery(
+        'chart_appointments',
+        lambda context: context['patient'].appointments.select_related('provider').order_by('-start_time'),
+        uses=['appointments_appointment_patient_id'],
+        no_seq_scan=['appointments_appointment'],
+    ),
+]
+
+def full_scans(plan):
+    """Tables read in full by ``plan``."""
+    if connection.vendor == 'postgresql':
+        return set(re.findall(r'Seq Scan on (\w+)', plan))
+    # SQLite: "SCAN t" reads the table, "SCAN t USING [COVERING] INDEX i" walks an index
+    return set(re.findall(r'\bSCAN (\w+)(?! USING)', plan))
+
+def plan_problems(plan, uses=(), no_seq_scan=()):
+    """Ways ``plan`` falls short of its expectations, as messages."""
+    problems = []
+    if uses and not any(re.search(rf'\b{re.escape(index)}', plan) for index in uses):
+        problems.append(f"uses none of {', '.join(uses)}")
+    for table in sorted(full_scans(plan) & set(no_seq_scan)):
+        problems.append(f"scans all of {table}")
+    return problems
+
+class QueryPlanAssertions:
+    """TestCase mixin: ``assertPlan`` checks a queryset's plan against expectations."""
+
+    # Turn sequential scans off, to check index usability on a few rows
+    force_index_paths = False
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest('Query plan checks are only defined for PostgreSQL and SQLite.')
+        if connection.vendor == 'postgresql' and self.force_index_paths:
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertPlan(self, queryset, uses=(), no_seq_scan=()):
+        plan = queryset.explain()
+        problems = plan_problems(plan, uses, no_seq_scan)
+        self.assertFalse(problems, f"Plan {'; '.join(problems)}:\n{plan}")
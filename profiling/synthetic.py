@@ -0,0 +1,248 @@
+"""
+Synthetic data at production scale, for benchmarks.
+
+Patients are generated in batches of ``PATIENT_BATCH`` together with their
+allergies, medications, vital signs and notes, and appointments in batches of
+``APPOINTMENT_BATCH`` together with their prescriptions and lab orders. Every
+batch is a handful of ``bulk_create`` calls in one transaction, so a million
+patients take minutes rather than hours. Bulk inserts skip history rows and
+signals; the utilization rollups and dashboard versions are refreshed once at
+the end instead.
+
+Runs are deterministic for a given seed and can be repeated: medical record
+numbers continue after the synthetic patients already present, and the
+synthetic staff accounts are reused.
+"""
+
+import random
+from collections import Counter
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from appointments.models import Appointment, AppointmentType, LabOrder, Prescription
+from appointments.utilization import backfill
+from authentication.models import User
+from dashboard import versions
+from patients.models import Allergy, Medication, Patient, PatientNote, VitalSigns
+
+PATIENT_BATCH = 2000
+
+APPOINTMENT_BATCH = 10000
+
+# Appointments are spread over this many days before and after today
+HISTORY_DAYS = 730
+BOOKING_DAYS = 60
+
+# Patients per doctor; nurses and front-desk staff scale from the doctors
+PATIENTS_PER_DOCTOR = 2000
+
+MRN_PREFIX = 'SYN'
+
+FIRST_NAMES = [
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+    'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Carlos', 'Karen',
+    'Wei', 'Aisha', 'Mohammed', 'Priya', 'Hiroshi', 'Olga', 'Kwame', 'Sofia', 'Lucas', 'Fatima',
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Nguyen', 'Okafor', 'Kowalski',
+]
+STREETS = ['Main St', 'Oak Ave', 'Maple Dr', 'Cedar Ln', 'Park Rd', 'Elm St', 'Lake View', 'Hill Crest']
+ALLERGENS = {
+    'medication': ['Penicillin', 'Sulfa drugs', 'Aspirin', 'Ibuprofen', 'Codeine'],
+    'food': ['Peanuts', 'Shellfish', 'Eggs', 'Milk', 'Tree nuts'],
+    'environmental': ['Pollen', 'Dust mites', 'Mold', 'Pet dander', 'Latex'],
+    'other': ['Adhesive tape', 'Nickel'],
+}
+REACTIONS = ['Hives', 'Rash', 'Swelling', 'Anaphylaxis', 'Wheezing', 'Nausea']
+MEDICATIONS = [
+    ('Lisinopril', '10 mg'), ('Metformin', '500 mg'), ('Atorvastatin', '20 mg'), ('Levothyroxine', '50 mcg'),
+    ('Amlodipine', '5 mg'), ('Omeprazole', '20 mg'), ('Albuterol', '90 mcg'), ('Sertraline', '50 mg'),
+]
+LABS = [
+    ('Complete blood count', 'CBC with differential'), ('Lipid panel', 'Fasting lipid panel'),
+    ('HbA1c', 'Glycated hemoglobin'), ('Metabolic panel', 'Comprehensive metabolic panel'),
+    ('Thyroid panel', 'TSH and free T4'), ('Urinalysis', 'Routine urinalysis'),
+]
+REASONS = ['Annual checkup', 'Follow-up visit', 'Persistent cough', 'Back pain', 'Medication review', 'Headaches']
+NOTES = [
+    'Patient reports feeling well.', 'Discussed diet and exercise.', 'Reviewed recent lab results.',
+    'Advised to return if symptoms persist.', 'Medication adherence discussed.',
+]
+APPOINTMENT_TYPES = [('Consultation', 30), ('Follow-up', 15), ('Annual physical', 60), ('Procedure', 90)]
+
+def staff_accounts(patients, rng):
+    """Synthetic doctors, nurses and staff sized for ``patients``, creating any that are missing."""
+    doctors = max(2, patients // PATIENTS_PER_DOCTOR)
+    wanted = {'doctor': doctors, 'nurse': max(1, doctors // 2), 'staff': max(1, doctors // 4)}
+    emails = {
+        f'synthetic.{role}{number}@example.com': role
+        for role, count in wanted.items() for number in range(count)
+    }
+    existing = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+    password = make_password(None)
+    User.objects.bulk_create([
+        User(
+            email=email, role=role, password=password,
+            first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+        )
+        for email, role in emails.items() if email not in existing
+    ])
+    return dict(User.objects.filter(email__in=emails).values_list('pk', 'role'))
+
+def appointment_types():
+    types = list(AppointmentType.objects.filter(is_active=True).values_list('pk', 'duration_minutes'))
+    if not types:
+        created = AppointmentType.objects.bulk_create([
+            AppointmentType(name=name, duration_minutes=minutes) for name, minutes in APPOINTMENT_TYPES
+        ])
+        types = [(appointment_type.pk, appointment_type.duration_minutes) for appointment_type in created]
+    return types
+
+def build_patient(number, rng, today):
+    first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return Patient(
+        medical_record_number=f'{MRN_PREFIX}{number:010d}',
+        first_name=first_name,
+        last_name=last_name,
+        date_of_birth=today - timedelta(days=rng.randint(365, 95 * 365)),
+        gender=rng.choice('MFO'),
+        email=f'{first_name}.{last_name}{number}@example.com'.lower(),
+        phone_primary=f'555-{rng.randint(0, 9999):04d}',
+        address=f'{rng.randint(1, 9999)} {rng.choice(STREETS)}',
+        emergency_contact_name=f'{rng.choice(FIRST_NAMES)} {last_name}',
+        emergency_contact_relation=rng.choice(['Spouse', 'Parent', 'Sibling', 'Child', 'Friend']),
+        emergency_contact_phone=f'555-{rng.randint(0, 9999):04d}',
+        blood_type=rng.choice([choice for choice, _ in Patient.BLOOD_TYPE_CHOICES]),
+        height_cm=rng.randint(150, 200),
+        weight_kg=Decimal(rng.randint(4500, 12000)) / 100,
+    )
+
+def patient_records(patient, rng, now, clinicians):
+    """Allergies, medications, vital signs and notes for one new patient."""
+    records = []
+    for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+        allergy_type = rng.choice(list(ALLERGENS))
+        records.append(Allergy(
+            patient=patient, allergy_type=allergy_type, allergen=rng.choice(ALLERGENS[allergy_type]),
+            reaction=rng.choice(REACTIONS), severity=rng.choice([choice for choice, _ in Allergy.SEVERITY_CHOICES]),
+        ))
+    for _ in range(rng.choice([0, 1, 1, 2, 3, 4])):
+        name, dosage = rng.choice(MEDICATIONS)
+        records.append(Medication(
+            patient=patient, medication_name=name, dosage=dosage,
+            frequency=rng.choice([choice for choice, _ in Medication.FREQUENCY_CHOICES]),
+            start_date=(now - timedelta(days=rng.randint(0, 1500))).date(),
+            prescribing_doctor=f'Dr. {rng.choice(LAST_NAMES)}', is_active=rng.random() < 0.8,
+        ))
+    for _ in range(rng.randint(1, 5)):
+        records.append(VitalSigns(
+            patient=patient, date_recorded=now - timedelta(days=rng.randint(0, HISTORY_DAYS)),
+            temperature=Decimal(rng.randint(361, 382)) / 10, heart_rate=rng.randint(55, 105),
+            blood_pressure_systolic=rng.randint(100, 160), blood_pressure_diastolic=rng.randint(60, 100),
+            respiratory_rate=rng.randint(12, 20), oxygen_saturation=rng.randint(93, 100),
+            recorded_by_id=rng.choice(clinicians),
+        ))
+    for _ in range(rng.choice([0, 1, 1, 2, 3])):
+        records.append(PatientNote(patient=patient, created_by_id=rng.choice(clinicians), note=rng.choice(NOTES)))
+    return records
+
+def appointment_status(start_time, now, rng):
+    if start_time >= now:
+        return 'confirmed' if rng.random() < 0.4 else 'scheduled'
+    roll = rng.random()
+    if roll < 0.08:
+        return 'cancelled'
+    if roll < 0.15:
+        return 'no_show'
+    return 'completed'
+
+def build_appointment(patient_id, rng, now, doctors, types):
+    day = now.date() + timedelta(days=rng.randint(-HISTORY_DAYS, BOOKING_DAYS))
+    start_time = timezone.make_aware(datetime.combine(day, time(rng.randint(8, 16), rng.choice([0, 15, 30, 45]))))
+    type_id, minutes = rng.choice(types)
+    provider_id = rng.choice(doctors)
+    return Appointment(
+        patient_id=patient_id, appointment_type_id=type_id, provider_id=provider_id, created_by_id=provider_id,
+        start_time=start_time, end_time=start_time + timedelta(minutes=minutes),
+        status=appointment_status(start_time, now, rng), reason=rng.choice(REASONS),
+    )
+
+def visit_records(appointment, rng):
+    """Prescriptions and lab orders for one completed appointment."""
+    records = []
+    if rng.random() < 0.3:
+        for _ in range(rng.randint(1, 2)):
+            name, dosage = rng.choice(MEDICATIONS)
+            records.append(Prescription(
+                appointment=appointment, medication_name=name, dosage=dosage,
+                frequency=rng.choice([choice for choice, _ in Prescription.FREQUENCY_CHOICES]),
+                duration_days=rng.choice([7, 14, 30, 90]), refills=rng.randint(0, 3),
+                instructions='Take as directed.', prescribed_by_id=appointment.provider_id,
+            ))
+    if rng.random() < 0.2:
+        lab_name, description = rng.choice(LABS)
+        records.append(LabOrder(
+            appointment=appointment, lab_name=lab_name, description=description,
+            status=rng.choice(['ordered', 'completed', 'completed']), ordered_by_id=appointment.provider_id,
+        ))
+    return records
+
+def bulk_insert(records, counts):
+    """Insert mixed records with one bulk_create per model."""
+    by_model = {}
+    for record in records:
+        by_model.setdefault(type(record), []).append(record)
+    for model, objects in by_model.items():
+        model.objects.bulk_create(objects, batch_size=PATIENT_BATCH)
+        counts[model.__name__] += len(objects)
+
+def generate(patients=1_000_000, appointments=5_000_000, seed=0, rollups=True, progress=None):
+    """Generate the data set; returns a Counter of rows inserted per model."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    counts = Counter()
+
+    staff = staff_accounts(patients, rng)
+    doctors = [pk for pk, role in staff.items() if role == 'doctor']
+    clinicians = [pk for pk, role in staff.items() if role in ('doctor', 'nurse')]
+    types = appointment_types()
+
+    first_number = Patient.objects.filter(medical_record_number__startswith=MRN_PREFIX).count()
+    patient_ids = []
+    for batch_start in range(0, patients, PATIENT_BATCH):
+        batch = [
+            build_patient(first_number + number, rng, now.date())
+            for number in range(batch_start, min(batch_start + PATIENT_BATCH, patients))
+        ]
+        with transaction.atomic():
+            Patient.objects.bulk_create(batch)
+            bulk_insert([record for patient in batch for record in patient_records(patient, rng, now, clinicians)], counts)
+        counts['Patient'] += len(batch)
+        patient_ids.extend(patient.pk for patient in batch)
+        if progress:
+            progress('Patient', counts['Patient'], patients)
+
+    for batch_start in range(0, appointments if patient_ids else 0, APPOINTMENT_BATCH):
+        size = min(APPOINTMENT_BATCH, appointments - batch_start)
+        batch = [build_appointment(rng.choice(patient_ids), rng, now, doctors, types) for _ in range(size)]
+        with transaction.atomic():
+            Appointment.objects.bulk_create(batch)
+            bulk_insert([
+                record for appointment in batch if appointment.status == 'completed'
+                for record in visit_records(appointment, rng)
+            ], counts)
+        counts['Appointment'] += len(batch)
+        if progress:
+            progress('Appointment', counts['Appointment'], appointments)
+
+    if rollups and counts['Appointment']:
+        for _ in backfill(now.date() - timedelta(days=HISTORY_DAYS), now.date() + timedelta(days=BOOKING_DAYS)):
+            pass
+    versions.bump('appointments', 'patients')
+    return counts
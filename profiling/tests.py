@@ -0,0 +1,303 @@
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.conf import settings
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings, tag
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.models import Appointment
+from authentication.models import User
+from patients.models import Patient, RecentPatient
+from . import benchmark
+from .middleware import BudgetExceeded, Profile, fingerprint
+from .plans import HOT_QUERIES, QueryPlanAssertions, plan_problems
+from .synthetic import MRN_PREFIX, generate
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0)
+class ProfilingMiddlewareTests(TestCase):
+    """Requests are measured and checked against their view's budget."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='doctor'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_dashboard_is_within_its_default_budget(self):
+        with self.assertLogs('profiling.middleware', 'INFO') as logs:
+            self.client.get(reverse('dashboard'))
+
+        summary = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        self.assertEqual(summary['view'], 'dashboard')
+        self.assertGreater(summary['queries'], 0)
+        self.assertGreater(summary['render_ms'], 0)
+        self.assertNotIn('over_budget', summary)
+
+    @override_settings(PROFILING_BUDGETS={'dashboard': {'queries': 1}}, PROFILING_STRICT=False)
+    def test_over_budget_requests_warn(self):
+        with self.assertLogs('profiling.middleware', 'WARNING') as logs:
+            self.client.get(reverse('dashboard'))
+
+        self.assertEqual(json.loads(logs.records[0].getMessage())['over_budget'], {'queries': 1})
+
+    @override_settings(PROFILING_BUDGETS={'dashboard': {'queries': 1}}, PROFILING_STRICT=True)
+    def test_strict_mode_fails_the_request(self):
+        with self.assertRaisesMessage(BudgetExceeded, 'dashboard over budget: queries'):
+            self.client.get(reverse('dashboard'))
+
+    async def test_async_requests_are_measured(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        with self.assertLogs('profiling.middleware', 'INFO') as logs:
+            await client.get(reverse('dashboard_stats'))
+
+        summary = json.loads(logs.records[0].getMessage())
+        self.assertEqual(summary['view'], 'dashboard_stats')
+        self.assertGreater(summary['queries'], 0)
+
+    def test_repeated_query_shapes_are_reported(self):
+        profile = Profile()
+        with connection.execute_wrapper(profile):
+            for pk in range(3):
+                User.objects.filter(pk=pk).exists()
+            User.objects.filter(pk__in=[1, 2, 3]).exists()
+
+        self.assertEqual(profile.shapes.most_common(1)[0][1], 3)
+        self.assertEqual(fingerprint("SELECT 1 FROM t WHERE id IN (%s, %s) AND name = 'x'"),
+                         "SELECT ? FROM t WHERE id IN (...) AND name = ?")
+
+
+# Stand-ins for the page templates missing from this tree, reading what the
+# pages list; real templates are found first once they exist
+STAND_IN_TEMPLATES = {
+    'patients/patient_detail.html': (
+        '{% extends "base.html" %}{% block content %}{{ patient.full_name }} {{ is_favorite }}'
+        '{% for allergy in allergies %}{{ allergy.allergen }}{% endfor %}'
+        '{% for medication in medications %}{{ medication.medication_name }}{% endfor %}'
+        '{{ latest_vitals.recorded_by.full_name }}'
+        '{% for note in notes %}{{ note.created_by.full_name }}{% endfor %}{% endblock %}'
+    ),
+    'patients/patient_list.html': (
+        '{% extends "base.html" %}{% block content %}'
+        '{% for patient in page_obj %}{{ patient.full_name }}{% endfor %}'
+        '{% for recent in recent_patients %}{{ recent.patient.full_name }}{% endfor %}'
+        '{% for favorite in favorite_patients %}{{ favorite.patient.full_name }}{% endfor %}'
+        '{{ total_count }} {{ active_count }} {{ inactive_count }}{% endblock %}'
+    ),
+    'appointments/appointment_list.html': (
+        '{% extends "base.html" %}{% block content %}{{ filter_form }}'
+        '{% for appointment in todays_appointments %}{{ appointment.patient.full_name }} '
+        '{{ appointment.appointment_type.name }} {{ appointment.provider.full_name }}{% endfor %}'
+        '{% for appointment in upcoming_appointments %}{{ appointment.patient.full_name }} '
+        '{{ appointment.appointment_type.name }} {{ appointment.provider.full_name }}{% endfor %}'
+        '{% for appointment in past_page_obj %}{{ appointment.patient.full_name }} '
+        '{{ appointment.appointment_type.name }} {{ appointment.provider.full_name }}{% endfor %}{% endblock %}'
+    ),
+}
+
+def stand_in_templates():
+    engine = {**settings.TEMPLATES[0], 'APP_DIRS': False}
+    engine['OPTIONS'] = {**engine['OPTIONS'], 'loaders': [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+        ('django.template.loaders.locmem.Loader', STAND_IN_TEMPLATES),
+    ]}
+    return override_settings(TEMPLATES=[engine])
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_STRICT=True, PROFILING_SAMPLE_RATE=0)
+class ViewBudgetTests(TransactionTestCase):
+    """Every budgeted view stays within its budget on a seeded data set."""
+
+    def setUp(self):
+        cache.clear()
+        generate(patients=50, appointments=500, seed=4, rollups=False)
+        self.user = User.objects.filter(role='doctor').order_by('pk').first()
+        self.patient = Patient.objects.filter(allergies__isnull=False, notes__isnull=False).order_by('pk').first()
+        self.client.force_login(self.user)
+        templates = stand_in_templates()
+        templates.enable()
+        self.addCleanup(templates.disable)
+
+    def test_budgeted_views_stay_within_budget(self):
+        start = timezone.localdate()
+        urls = {
+            'dashboard': reverse('dashboard'),
+            'patient_detail': reverse('patient_detail', args=[self.patient.pk]),
+            'patient_list': reverse('patient_list') + '?q=' + self.patient.last_name[:4],
+            'appointment_list': reverse('appointment_list'),
+            'get_calendar_events': (
+                reverse('get_calendar_events') + f'?start={start.isoformat()}T00:00:00Z'
+                f'&end={(start + timedelta(days=7)).isoformat()}T00:00:00Z'
+            ),
+        }
+        self.assertEqual(urls.keys(), settings.PROFILING_BUDGETS.keys())
+
+        for view, url in urls.items():
+            with self.subTest(view):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ProfileReportTests(TestCase):
+    """profile_report ranks the views of a sampled log."""
+
+    def test_worst_views_are_listed_first(self):
+        records = [
+            {'view': 'patient_detail', 'path': '/patients/1/', 'queries': 40, 'duplicate_queries': 30, 'db_ms': 80.0,
+             'total_ms': 120.0, 'duplicates': [{'fingerprint': 'abc', 'count': 31, 'sql': 'SELECT ... allergies'}],
+             'over_budget': {'queries': 15}},
+            {'view': 'dashboard', 'path': '/', 'queries': 7, 'duplicate_queries': 0, 'db_ms': 5.0,
+             'total_ms': 20.0, 'duplicates': []},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as log:
+            log.write('not a profile\n')
+            for record in records:
+                log.write(f'WARNING 2026-10-19 profiling.middleware {json.dumps(record)}\n')
+        self.addCleanup(os.unlink, log.name)
+
+        out = io.StringIO()
+        call_command('profile_report', log.name, stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('patient_detail: 1 requests, max 40 queries (30 repeated)'))
+        self.assertIn('1 over budget', lines[0])
+        self.assertEqual(lines[1], '    repeated 31x: SELECT ... allergies')
+        self.assertTrue(lines[2].startswith('dashboard:'))
+
+
+class SyntheticDataTests(TestCase):
+    """The generator bulk-inserts a consistent data set and can be run again."""
+
+    def test_generated_rows_and_reruns(self):
+        counts = generate(patients=20, appointments=60, seed=1)
+
+        self.assertEqual(counts['Patient'], 20)
+        self.assertEqual(counts['Appointment'], 60)
+        self.assertEqual(Patient.objects.filter(medical_record_number__startswith=MRN_PREFIX).count(), 20)
+        self.assertFalse(Appointment.objects.exclude(provider__role='doctor').exists())
+        self.assertFalse(Appointment.objects.filter(end_time__lte=F('start_time')).exists())
+        staff = User.objects.count()
+
+        generate(patients=20, appointments=10, seed=2, rollups=False)
+
+        self.assertEqual(User.objects.count(), staff)
+        self.assertEqual(Patient.objects.values('medical_record_number').distinct().count(), 40)
+
+
+@override_settings(PROFILING_ENABLED=False)
+class BenchmarkTests(TestCase):
+    """run_benchmarks reports percentiles per scenario and compares with saved runs."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='admin@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='admin'
+        )
+        generate(patients=5, appointments=20, seed=1, rollups=False)
+
+    def test_results_are_saved_and_compared(self):
+        results_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(results_dir.cleanup)
+        options = ['--clients', '1', '--requests', '5', '--scenario', 'dashboard', '--scenario', 'get_calendar_events']
+
+        with override_settings(BENCHMARK_RESULTS_DIR=results_dir.name):
+            call_command('run_benchmarks', *options, stdout=io.StringIO())
+            out = io.StringIO()
+            call_command('run_benchmarks', *options, '--compare', 'latest', '--no-save', stdout=out)
+            saved = os.listdir(results_dir.name)
+
+        self.assertEqual(len(saved), 1)
+        with open(os.path.join(results_dir.name, saved[0])) as file:
+            results = json.load(file)
+        self.assertEqual(results['rows']['Patient'], 5)
+        dashboard = results['scenarios']['dashboard']
+        self.assertEqual((dashboard['requests'], dashboard['errors']), (5, 0))
+        self.assertLessEqual(dashboard['p50_ms'], dashboard['p95_ms'])
+        self.assertLessEqual(dashboard['p95_ms'], dashboard['p99_ms'])
+        self.assertGreater(dashboard['mean_queries'], 0)
+        self.assertIn('get_calendar_events: p50/p95/p99', out.getvalue())
+        self.assertIn('dashboard: p50_ms', out.getvalue())
+
+    def test_only_ok_responses_count_as_successes(self):
+        timings = benchmark.drive(self.user, ['/no-such-page/', reverse('dashboard')])
+        self.assertEqual([ok for _, _, ok in timings], [False, True])
+        self.assertEqual(benchmark.summarize(timings, 1)['errors'], 1)
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 0.5), 50)
+        self.assertEqual(benchmark.percentile(values, 0.99), 99)
+        self.assertEqual(benchmark.percentile([7], 0.95), 7)
+
+
+PLAN_PATIENTS = 5000
+PLAN_APPOINTMENTS = 50000
+PLAN_RECENT_PER_USER = 250
+
+
+# Seeding takes a while, so CI can run these on their own or skip them with --exclude-tag plans
+@tag('plans')
+class QueryPlanRegressionTests(QueryPlanAssertions, TestCase):
+    """Every hot query keeps the plan it declares in profiling.plans."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Enough rows that the planner's choices, with real statistics, match production's
+        generate(patients=PLAN_PATIENTS, appointments=PLAN_APPOINTMENTS, seed=3, rollups=False)
+        cls.user = User.objects.filter(role='doctor').order_by('pk').first()
+        cls.patient = Patient.objects.filter(allergies__isnull=False).order_by('pk').first()
+        patients = list(Patient.objects.order_by('pk')[:PLAN_RECENT_PER_USER])
+        RecentPatient.objects.bulk_create(
+            [RecentPatient(user=user, patient=patient) for user in User.objects.all() for patient in patients]
+        )
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def test_hot_queries_keep_their_plans(self):
+        now = timezone.now()
+        context = {'user': self.user, 'patient': self.patient, 'today': timezone.localdate(), 'now': now}
+        for hot_query in HOT_QUERIES:
+            with self.subTest(hot_query.name):
+                self.assertPlan(hot_query.build(context), hot_query.uses, hot_query.no_seq_scan)
+
+    def test_full_scans_are_reported(self):
+        plan = Patient.objects.filter(address__contains='Street').explain()
+        self.assertEqual(plan_problems(plan, no_seq_scan=['patients_patient']), ['scans all of patients_patient'])
+        self.assertEqual(plan_problems(plan, uses=['patient_name_idx']), ['uses none of patient_name_idx'])
+
+
+class DatabasePoolMetricsTests(TestCase):
+    """Pool metrics are reported to users who can view reports."""
+
+    def test_pool_stats_are_reported_to_admins(self):
+        admin = User.objects.create_user(
+            email='admin@example.com', password='unused-password', first_name='Ada', last_name='Doe', role='admin'
+        )
+        doctor = User.objects.create_user(
+            email='doctor@example.com', password='unused-password', first_name='Bo', last_name='Doe', role='doctor'
+        )
+        pool = mock.Mock(stats=mock.Mock(return_value={'size': 3, 'in_use': 1, 'saturation': 0.1}))
+
+        self.client.force_login(doctor)
+        self.assertEqual(self.client.get(reverse('database_pools')).status_code, 302)
+
+        self.client.force_login(admin)
+        with mock.patch('profiling.views.pools', return_value={'default': pool}):
+            response = self.client.get(reverse('database_pools'))
+        self.assertEqual(response.json(), {'default': {'size': 3, 'in_use': 1, 'saturation': 0.1}})
@@ -0,0 +1,6 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('database-pools/', views.database_pools, name='database_pools'),
+]
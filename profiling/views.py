@@ -0,0 +1,11 @@
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+
+from authentication.decorators import permission_required
+from docsdash.postgresql_pool.base import pools
+
+@login_required
+@permission_required('reports.view')
+def database_pools(request):
+    """This process's connection pools: size, saturation and checkout wait times."""
+    return JsonResponse({alias: pool.stats() for alias, pool in pools().items()})